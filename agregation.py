@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+import schema
+
+# Calcul avec pandas des tables d'agrégats déduites des ventes : dvf_stats (rollups.py),
+# dvf_mensuel (series.py), communes_codes_postaux (communes.py) et dvf_grille (spatial.py).
+# Chaque module calcule des agrégats partiels d'un bloc de ventes (sa fonction partiel),
+# regroupés par identifiants de dimensions ; ils sont fusionnés à la fin (les nombres et les
+# sommes s'additionnent, les minimums et maximums se comparent), puis les libellés sont repris
+# des dimensions. Les blocs sont les lots insérés par le chargement, sans relire mutations, ou
+# des blocs lus dans mutations (Agregats.lire). La mémoire utilisée est celle des agrégats
+# partiels, pas celle des ventes.
+
+COLONNES_VENTES = [
+    "date_mutation",
+    "departement_id",
+    "commune_id",
+    "type_local_id",
+    "nature_mutation_id",
+    "code_postal",
+    "valeur_fonciere",
+    "surface_reelle_bati",
+    "surface_terrain",
+    "longitude",
+    "latitude",
+]
+
+COLONNES_REELLES = ["commune_id", "type_local_id", "nature_mutation_id", "valeur_fonciere", "surface_reelle_bati", "surface_terrain", "longitude", "latitude"]
+
+# Lignes lues dans mutations par bloc
+TAILLE_BLOC = 100_000
+
+# Seules les ventes d'une partition (année, département) sont agrégées, comme à l'ingestion
+WHERE_VENTES = "WHERE mutations.date_mutation IS NOT NULL AND mutations.departement_id IS NOT NULL"
+
+# Partitions (année, département) à relire, en table temporaire pour les joindre à mutations
+CREATE_PARTITIONS = """CREATE TEMP TABLE partitions_agregees (
+    departement_id INTEGER,
+    debut INTEGER,
+    fin INTEGER
+)"""
+
+JOIN_PARTITIONS = """JOIN temp.partitions_agregees AS partition
+ON partition.departement_id = mutations.departement_id AND mutations.date_mutation BETWEEN partition.debut AND partition.fin"""
+
+# Fusion des agrégats partiels selon l'opération qui les a calculés
+FUSIONS = {"size": "sum", "count": "sum", "sum": "sum", "min": "min", "max": "max"}
+
+
+# Types des colonnes d'un bloc de ventes, année, mois (AAAAMM) et prix au m² (NaN si la surface
+# est nulle ou absente). Les chaînes vides des lots lus dans un fichier sont des NULL.
+def preparer(ventes):
+    ventes = ventes.astype({nom: float for nom in COLONNES_REELLES})
+    ventes["code_postal"] = ventes["code_postal"].mask(ventes["code_postal"] == "")
+    ventes["date_mutation"] = ventes["date_mutation"].astype(np.int64)
+    ventes["departement_id"] = ventes["departement_id"].astype(np.int64)
+    ventes["annee"] = ventes["date_mutation"] // 10000
+    ventes["mois"] = ventes["date_mutation"] // 100
+    ventes["prix_m2"] = ventes["valeur_fonciere"] / ventes["surface_reelle_bati"].where(ventes["surface_reelle_bati"] != 0)
+    return ventes
+
+
+# Regroupement par les colonnes cles (NaN formant un groupe, comme NULL dans GROUP BY) ;
+# operations : (colonne du résultat, colonne regroupée, opération). Une somme sans aucune
+# valeur vaut NaN, enregistré comme NULL, comme sum() en SQL.
+def regrouper(valeurs, cles, operations):
+    groupes = valeurs.groupby(cles, dropna=False, sort=False)
+    resultat = {}
+    for nom, colonne, operation in operations:
+        if operation == "size":
+            resultat[nom] = groupes.size()
+        elif operation == "sum":
+            resultat[nom] = groupes[colonne].sum(min_count=1)
+        else:
+            resultat[nom] = getattr(groupes[colonne], operation)()
+    return pd.DataFrame(resultat).reset_index()
+
+
+# Fusion d'agrégats partiels calculés par regrouper avec les mêmes operations
+def fusionner(partiels, cles, operations):
+    return regrouper(partiels, cles, [(nom, nom, FUSIONS[operation]) for nom, _, operation in operations])
+
+
+# Libellé de chaque identifiant d'une dimension
+def libelles(conn, table, colonne):
+    lignes = conn.execute(f"SELECT id, {colonne} FROM {table}").fetchall()
+    return pd.Series([valeur for _, valeur in lignes], index=pd.Index([identifiant for identifiant, _ in lignes], dtype=float), dtype=object)
+
+
+# Ajoute à des agrégats la colonne de libellé d'une dimension, à partir de leur colonne
+# d'identifiant (NaN pour un identifiant NULL)
+def ajouter_libelle(conn, agregats, identifiant, table, colonne, nom=None):
+    agregats[nom or colonne] = agregats[identifiant].astype(float).map(libelles(conn, table, colonne))
+
+
+# Insère les lignes d'un DataFrame dont les colonnes sont dans l'ordre de la table. tolist()
+# donne des valeurs Python ; NaN est enregistré comme NULL.
+def inserer(conn, table, lignes):
+    conn.executemany(
+        f"INSERT INTO {table} VALUES ({', '.join('?' * len(lignes.columns))})",
+        zip(*(lignes[colonne].tolist() for colonne in lignes.columns)),
+    )
+
+
+# Agrégats partiels de plusieurs modules, cumulés bloc par bloc
+class Agregats:
+    def __init__(self, modules):
+        self.modules = modules
+        self.partiels = {module: [] for module in modules}
+
+    # Bloc de ventes : colonnes COLONNES_VENTES, telles que dans mutations
+    def ajouter(self, ventes):
+        ventes = preparer(ventes)
+        for module in self.modules:
+            self.partiels[module].append(module.partiel(ventes))
+
+    # Agrégats partiels d'un module en un seul DataFrame
+    def de(self, module):
+        partiels = self.partiels[module] or [module.partiel(preparer(pd.DataFrame(columns=COLONNES_VENTES)))]
+        return pd.concat(partiels, ignore_index=True)
+
+    # Agrégats des ventes de toutes les partitions, ou des seules partitions (année,
+    # département) données, lues dans mutations par blocs
+    @classmethod
+    def lire(cls, conn, modules, partitions=None):
+        agregats = cls(modules)
+        requete = f"SELECT {', '.join(f'mutations.{nom}' for nom in COLONNES_VENTES)} FROM mutations"
+        with conn:
+            if partitions is None:
+                curseur = conn.execute(f"{requete} {WHERE_VENTES}")
+            else:
+                conn.execute("DROP TABLE IF EXISTS temp.partitions_agregees")
+                conn.execute(CREATE_PARTITIONS)
+                conn.executemany(
+                    "INSERT INTO temp.partitions_agregees SELECT id, ?, ? FROM departements WHERE code_departement = ?",
+                    [(*schema.bornes_annee(annee), code_departement) for annee, code_departement in partitions],
+                )
+                curseur = conn.execute(f"{requete} {JOIN_PARTITIONS} {WHERE_VENTES}")
+            for lignes in iter(lambda: curseur.fetchmany(TAILLE_BLOC), []):
+                agregats.ajouter(pd.DataFrame.from_records(lignes, columns=COLONNES_VENTES, coerce_float=True))
+            conn.execute("DROP TABLE IF EXISTS temp.partitions_agregees")
+        return agregats
@@ -0,0 +1,173 @@
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+# Test de charge de l'API lancée par serve.py : pour chaque nombre de workers et chaque taille
+# de pool de connexions (0 : databases), démarre le serveur sans cache de réponses, envoie
+# pendant --duree secondes des requêtes sur plusieurs endpoints depuis --clients connexions
+# HTTP simultanées (réparties sur plusieurs processus pour que le client ne soit pas le
+# goulot), puis affiche le débit et les latences.
+
+RACINE = Path(__file__).resolve().parent.parent
+
+
+def chemins_requetes(db, nombre, graine=0):
+    conn = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+    try:
+        communes = sorted(nom for (nom,) in conn.execute("SELECT DISTINCT nom_commune FROM communes WHERE nom_commune IS NOT NULL"))
+        departements = sorted(code for (code,) in conn.execute("SELECT code_departement FROM departements WHERE code_departement IS NOT NULL"))
+    finally:
+        conn.close()
+    aleatoire = random.Random(graine)
+    lieux = aleatoire.sample(communes, min(nombre, len(communes))) + departements
+    chemins = []
+    for lieu in lieux:
+        lieu = quote(lieu)
+        chemins.append(f"/prix-moyen-m2-par-ville/?nom_ville={lieu}")
+        chemins.append(f"/profil-commune/?nom_commune={lieu}")
+        chemins.append(f"/prix-m2-robuste/?nom_ville={lieu}")
+        chemins.append(f"/quantiles-prix-m2/?lieux={lieu}")
+    aleatoire.shuffle(chemins)
+    return chemins
+
+
+# Endpoint d'un chemin, sans les paramètres
+def endpoint(chemin):
+    return chemin.split("?", 1)[0]
+
+
+# Un client : connexion HTTP persistante, requêtes enchaînées jusqu'à l'échéance. Les latences
+# sont rangées avec l'endpoint de la requête.
+def client(hote, port, chemins, fin, latences, erreurs):
+    conn = http.client.HTTPConnection(hote, port, timeout=30)
+    i = random.randrange(len(chemins))
+    while time.perf_counter() < fin:
+        chemin = chemins[i % len(chemins)]
+        debut = time.perf_counter()
+        try:
+            conn.request("GET", chemin)
+            reponse = conn.getresponse()
+            reponse.read()
+            if reponse.status >= 500:
+                erreurs.append(reponse.status)
+            else:
+                latences.append((endpoint(chemin), time.perf_counter() - debut))
+        except (OSError, http.client.HTTPException) as erreur:
+            erreurs.append(str(erreur))
+            conn.close()
+            conn = http.client.HTTPConnection(hote, port, timeout=30)
+        i += 1
+    conn.close()
+
+
+def processus_clients(hote, port, chemins, nb_clients, duree):
+    latences = []
+    erreurs = []
+    fin = time.perf_counter() + duree
+    threads = [threading.Thread(target=client, args=(hote, port, chemins, fin, latences, erreurs)) for _ in range(nb_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latences, len(erreurs)
+
+
+# Attend que /sante/ réponde "ok" sur toutes les connexions d'une série (une par worker au moins)
+def attendre(hote, port, workers, delai=600):
+    limite = time.monotonic() + delai
+    consecutifs = 0
+    while time.monotonic() < limite:
+        try:
+            conn = http.client.HTTPConnection(hote, port, timeout=5)
+            conn.request("GET", "/sante/")
+            ok = b'"ok"' in conn.getresponse().read()
+            conn.close()
+        except OSError:
+            ok = False
+        consecutifs = consecutifs + 1 if ok else 0
+        if consecutifs >= 4 * workers:
+            return
+        time.sleep(0.05 if ok else 0.5)
+    raise TimeoutError("le serveur n'est pas prêt")
+
+
+def lire_json(hote, port, chemin):
+    conn = http.client.HTTPConnection(hote, port, timeout=30)
+    try:
+        conn.request("GET", chemin)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+# Latences (endpoint, secondes) et nombre d'erreurs d'une mesure, et mesures du serveur
+# (/metrics d'un des workers) après la charge
+def executer(args, chemins, workers, connexions):
+    env = {**os.environ, "DVF_CACHE": "aucun"}
+    commande = [sys.executable, str(RACINE / "serve.py"), "--host", args.hote, "--port", str(args.port),
+                "--workers", str(workers), "--connexions", str(connexions)]
+    serveur = subprocess.Popen(commande, cwd=args.dossier, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        attendre(args.hote, args.port, workers)
+        # Chauffe : ouverture des connexions et cache de pages
+        processus_clients(args.hote, args.port, chemins, args.clients, 1)
+        repartition = [args.clients // args.processus + (i < args.clients % args.processus) for i in range(args.processus)]
+        with multiprocessing.Pool(args.processus) as pool:
+            resultats = pool.starmap(
+                processus_clients,
+                [(args.hote, args.port, chemins, nombre, args.duree) for nombre in repartition if nombre],
+            )
+        metriques = lire_json(args.hote, args.port, "/metrics")
+    finally:
+        serveur.terminate()
+        serveur.wait()
+    latences = [mesure for lignes, _ in resultats for mesure in lignes]
+    erreurs = sum(nombre for _, nombre in resultats)
+    return latences, erreurs, metriques
+
+
+# Débit (requêtes par seconde) et latences p50, p95 et p99 en millisecondes
+def resumer(latences, duree):
+    latences = sorted(latences)
+    if len(latences) < 2:
+        return len(latences) / duree, None, None, None
+    centiles = statistics.quantiles(latences, n=100)
+    return len(latences) / duree, centiles[49] * 1000, centiles[94] * 1000, centiles[98] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'API (serve.py) selon le nombre de workers et de connexions")
+    parser.add_argument("--dossier", default=str(RACINE), help="Dossier de dvf.db, où le serveur est lancé")
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", default=f"1,{os.cpu_count()}", help="Nombres de workers séparés par des virgules")
+    parser.add_argument("--connexions", default="0,4", help="Tailles du pool de connexions séparées par des virgules (0 : databases)")
+    parser.add_argument("--clients", type=int, default=32, help="Connexions HTTP simultanées")
+    parser.add_argument("--processus", type=int, default=max(1, os.cpu_count() // 2), help="Processus clients")
+    parser.add_argument("--duree", type=float, default=10, help="Durée de chaque mesure en secondes")
+    parser.add_argument("--lieux", type=int, default=200, help="Nombre de communes tirées au hasard")
+    args = parser.parse_args()
+
+    chemins = chemins_requetes(Path(args.dossier) / "dvf.db", args.lieux)
+    print(f"{'workers':>7} {'connexions':>10} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erreurs':>7}")
+    for workers in sorted({int(valeur) for valeur in args.workers.split(",")}):
+        for connexions in [int(valeur) for valeur in args.connexions.split(",")]:
+            latences, erreurs, _ = executer(args, chemins, workers, connexions)
+            debit, p50, p95, p99 = resumer([latence for _, latence in latences], args.duree)
+            centiles = " ".join(f"{valeur:8.1f}" if valeur is not None else f"{'-':>8}" for valeur in (p50, p95, p99))
+            print(f"{workers:>7} {connexions:>10} {debit:9.0f} {centiles} {erreurs:>7}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
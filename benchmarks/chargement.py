@@ -0,0 +1,150 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import generer_dvf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import createdb  # noqa: E402
+import schema  # noqa: E402
+
+# Benchmark du chargement sur un fichier DVF synthétique : la première version de createdb.py
+# (table dvf en texte, un INSERT OR IGNORE par ligne avec la contrainte unique en place) et
+# createdb.charger, étape par étape (lignes : lecture, empreintes des partitions, conversion,
+# insertion, agrégats partiels des lots et dédoublonnage ; puis index, agrégats et index
+# spatial, que la première version ne construisait pas). Trois situations : base vide, relance sur le même fichier (chargement
+# de chaque nuit sans changement), relance après modification d'une partition.
+
+# Colonnes numériques de la table dvf de la première version, les autres en TEXT
+TYPES_ANCIENS = {
+    "valeur_fonciere": "INTEGER",
+    "nombre_lots": "INTEGER",
+    "surface_reelle_bati": "INTEGER",
+    "nombre_pieces_principales": "INTEGER",
+    "surface_terrain": "INTEGER",
+    "longitude": "REAL",
+    "latitude": "REAL",
+}
+
+
+# Chargement de la première version de createdb.py, sur une base vide ou déjà remplie
+def charger_ligne_a_ligne(db, chemin):
+    conn = sqlite3.connect(db)
+    try:
+        colonnes = ",\n    ".join(f"{nom} {TYPES_ANCIENS.get(nom, 'TEXT')}" for nom in schema.NOMS_COLONNES)
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS dvf (
+    {colonnes},
+    CONSTRAINT unique_row UNIQUE (id_mutation, date_mutation, numero_disposition)
+)"""
+        )
+        curseur = conn.cursor()
+        requete = f"INSERT OR IGNORE INTO dvf VALUES ({', '.join('?' * len(schema.NOMS_COLONNES))})"
+        with open(chemin, newline="", encoding="utf-8") as fichier:
+            lecteur = csv.reader(fichier, delimiter=",")
+            next(lecteur)
+            for ligne in lecteur:
+                curseur.execute(requete, ligne)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def charger(db, chemin):
+    conn = sqlite3.connect(db)
+    progression = createdb.Progression()
+    try:
+        createdb.charger(conn, [chemin], progression=progression)
+    finally:
+        conn.close()
+    return progression.etapes
+
+
+# Change la valeur foncière des ventes de la première partition (année, département) du fichier
+def modifier_partition(chemin):
+    with open(chemin, newline="", encoding="utf-8") as fichier:
+        entete, *lignes = csv.reader(fichier)
+    date, departement, valeur = (entete.index(nom) for nom in ("date_mutation", "code_departement", "valeur_fonciere"))
+    partition = (lignes[0][date][:4], lignes[0][departement])
+    for ligne in lignes:
+        if (ligne[date][:4], ligne[departement]) == partition and ligne[valeur]:
+            ligne[valeur] = f"{float(ligne[valeur]) * 1.01:.2f}"
+    with open(chemin, "w", newline="", encoding="utf-8") as fichier:
+        csv.writer(fichier, lineterminator="\n").writerows([entete, *lignes])
+
+
+def supprimer_base(db):
+    for fichier in (db, Path(f"{db}-wal"), Path(f"{db}-shm")):
+        fichier.unlink(missing_ok=True)
+
+
+# Durée écoulée et temps CPU du processus : sur une machine partagée, la durée écoulée varie
+# d'une exécution à l'autre selon la charge, le temps CPU beaucoup moins
+def mesurer(fonction, *arguments):
+    debut, debut_cpu = time.perf_counter(), time.process_time()
+    resultat = fonction(*arguments)
+    return time.perf_counter() - debut, time.process_time() - debut_cpu, resultat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du chargement : première version de createdb.py et chargement actuel")
+    parser.add_argument("--dossier", default="benchmark_chargement", help="Dossier de travail (fichier CSV et bases)")
+    parser.add_argument("--lignes", type=int, default=1_000_000, help="Lignes du fichier synthétique")
+    parser.add_argument("--annees", default="2022,2023")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--json", metavar="FICHIER", help="Écrit aussi les résultats en JSON")
+    args = parser.parse_args()
+
+    dossier = Path(args.dossier)
+    dossier.mkdir(parents=True, exist_ok=True)
+    # Fichier non compressé (la première version ne lit pas le gzip), copié avant d'être modifié
+    source = dossier / f"dvf_{args.lignes}_{args.graine}.csv"
+    if not source.exists():
+        generer_dvf.ecrire(source, args.lignes, [int(annee) for annee in args.annees.split(",")], args.graine)
+    chemin = dossier / "dvf.csv"
+    shutil.copyfile(source, chemin)
+    ancienne, actuelle = dossier / "ligne_a_ligne.db", dossier / "dvf.db"
+    supprimer_base(ancienne)
+    supprimer_base(actuelle)
+
+    resultats = {"lignes": args.lignes, "situations": []}
+    print(f"{'situation':<28} {'ligne à ligne s':>16} {'createdb s':>11} {'gain':>7} {'CPU ligne à ligne s':>20} {'CPU createdb s':>15}")
+    situations = [("base vide", None), ("relance sans changement", None), ("une partition modifiée", modifier_partition)]
+    for nom, preparation in situations:
+        if preparation:
+            preparation(chemin)
+        duree_ancienne, cpu_ancienne, _ = mesurer(charger_ligne_a_ligne, ancienne, chemin)
+        duree, cpu, etapes = mesurer(charger, actuelle, chemin)
+        resultats["situations"].append(
+            {
+                "situation": nom,
+                "ligne_a_ligne_s": duree_ancienne,
+                "createdb_s": duree,
+                "ligne_a_ligne_cpu_s": cpu_ancienne,
+                "createdb_cpu_s": cpu,
+                "etapes_s": etapes,
+            }
+        )
+        print(f"{nom:<28} {duree_ancienne:16.2f} {duree:11.2f} {duree_ancienne / duree:6.1f}x {cpu_ancienne:20.2f} {cpu:15.2f}", flush=True)
+
+    print("La première version ignore les lignes déjà présentes (INSERT OR IGNORE) : à la relance, sa base ne prend pas en compte la partition modifiée")
+    print("\nÉtapes de createdb.charger (s) :")
+    print(f"{'étape':<24}" + "".join(f"{nom:>26}" for nom, _ in situations))
+    for etape in resultats["situations"][0]["etapes_s"]:
+        print(f"{etape:<24}" + "".join(f"{situation['etapes_s'].get(etape, 0):26.2f}" for situation in resultats["situations"]))
+    print(f"\nTaille des bases : ligne à ligne {os.path.getsize(ancienne) / 1e6:.0f} Mo, createdb {os.path.getsize(actuelle) / 1e6:.0f} Mo")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fichier:
+            json.dump(resultats, fichier, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import csv
+import gzip
+import io
+import math
+import random
+import sys
+from bisect import bisect
+from itertools import accumulate
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from schema import NOMS_COLONNES  # noqa: E402
+
+# Générateur de fichiers DVF synthétiques, aux 40 colonnes des fichiers geo-dvf, pour mesurer
+# le chargement et l'API sans le fichier complet. Le fichier ne dépend que des paramètres :
+# même graine, même contenu (le .gz aussi, sans date dans l'en-tête gzip). La répartition
+# suit celle de DVF : quelques départements et, dans chacun, quelques communes concentrent
+# l'essentiel des ventes (lois de Zipf), les grandes villes ont plusieurs codes postaux et
+# des prix au m² plus élevés, une mutation compte une à trois dispositions.
+
+# Départements du plus actif au moins actif (approximativement, d'après DVF), puis les autres
+DEPARTEMENTS_ACTIFS = [
+    "75", "13", "33", "69", "59", "06", "31", "44", "34", "92", "83", "78", "77", "91", "93",
+    "94", "95", "38", "67", "35", "62", "76", "74", "64", "17", "85", "29", "56", "30", "84",
+]
+DEPARTEMENTS = DEPARTEMENTS_ACTIFS + sorted(
+    {f"{numero:02d}" for numero in range(1, 96) if numero != 20} - set(DEPARTEMENTS_ACTIFS)
+) + ["2A", "2B", "971", "972", "973", "974", "976"]
+
+# Préfectures : (nom, code INSEE, longitude, latitude, prix moyen au m²)
+PREFECTURES = {
+    "75": ("Paris", "75056", 2.347, 48.859, 10500),
+    "13": ("Marseille", "13055", 5.37, 43.296, 3600),
+    "33": ("Bordeaux", "33063", -0.58, 44.837, 4600),
+    "69": ("Lyon", "69123", 4.835, 45.758, 5000),
+    "59": ("Lille", "59350", 3.063, 50.629, 3600),
+    "06": ("Nice", "06088", 7.262, 43.710, 5200),
+    "31": ("Toulouse", "31555", 1.444, 43.604, 3700),
+    "44": ("Nantes", "44109", -1.554, 47.218, 3800),
+    "34": ("Montpellier", "34172", 3.877, 43.611, 3700),
+    "67": ("Strasbourg", "67482", 7.752, 48.573, 3700),
+    "35": ("Rennes", "35238", -1.680, 48.112, 4000),
+    "38": ("Grenoble", "38185", 5.724, 45.188, 2800),
+    "42": ("Saint-Étienne", "42218", 4.387, 45.434, 1400),
+    "2A": ("Ajaccio", "2A004", 8.737, 41.919, 3800),
+    "2B": ("Bastia", "2B033", 9.450, 42.697, 2900),
+    "974": ("Saint-Denis", "97411", 55.448, -20.882, 2900),
+    "93": ("Saint-Denis", "93066", 2.358, 48.936, 4000),
+}
+
+# Centres des départements d'outre-mer (longitude, latitude)
+OUTRE_MER = {"971": (-61.55, 16.24), "972": (-61.02, 14.64), "973": (-52.33, 4.94), "974": (55.45, -21.0), "976": (45.14, -12.8)}
+
+SYLLABES = ["ber", "mont", "val", "lan", "ville", "cour", "roche", "bois", "fon", "mar", "ville", "gny", "sac", "ac", "ieu",
+            "bourg", "champ", "nan", "tour", "pierre", "vil", "aur", "lun", "mes", "cha", "bel", "nuit", "ros"]
+PREFIXES = ["", "", "", "", "Saint-", "Sainte-", "Le ", "La ", "Les ", "Villeneuve-"]
+SUFFIXES = ["", "", "", "", "", "-sur-Mer", "-sur-Loire", "-les-Bains", "-en-Vallée", "-le-Château", "-d'Azergues"]
+VOIES = ["RUE", "RUE", "RUE", "AV", "BD", "CHE", "IMP", "ALL", "PL", "RTE"]
+NOMS_VOIES = ["DE LA REPUBLIQUE", "VICTOR HUGO", "JEAN JAURES", "DU GENERAL DE GAULLE", "PASTEUR", "DES ECOLES",
+              "DE LA GARE", "DU MOULIN", "DES LILAS", "DE L EGLISE", "DU STADE", "DES ACACIAS", "NATIONALE"]
+
+# (nature de mutation, poids)
+NATURES = [("Vente", 88), ("Vente en l'état futur d'achèvement", 5), ("Vente terrain à bâtir", 2),
+           ("Echange", 2), ("Adjudication", 2), ("Expropriation", 1)]
+# (code, type de local, poids) ; "" : terrain sans local
+TYPES_LOCAL = [("1", "Maison", 34), ("2", "Appartement", 30), ("3", "Dépendance", 20),
+               ("4", "Local industriel. commercial ou assimilé", 4), ("", "", 12)]
+CULTURES = [("S", "sols"), ("J", "jardins"), ("T", "terres"), ("AB", "terrains a bâtir"), ("P", "prés"), ("BT", "taillis sous futaie")]
+# Prix au m² des ventes hors préfectures (médiane de la loi log-normale)
+PRIX_M2_MEDIAN = 2300
+
+
+def zipf(nombre, exposant):
+    return list(accumulate(1 / (rang + 1) ** exposant for rang in range(nombre)))
+
+
+# Tirages à partir de random() seul, plus rapides que choice et randint
+def tirer(alea, cumuls):
+    return bisect(cumuls, alea() * cumuls[-1])
+
+
+def choisir(alea, valeurs):
+    return valeurs[int(alea() * len(valeurs))]
+
+
+# Entier entre 1 et maximum
+def entier(alea, maximum):
+    return 1 + int(alea() * maximum)
+
+
+def nom_commune(aleatoire):
+    nom = "".join(aleatoire.choice(SYLLABES) for _ in range(aleatoire.randint(2, 3))).capitalize()
+    return aleatoire.choice(PREFIXES) + nom + aleatoire.choice(SUFFIXES)
+
+
+def prefixe_postal(code_departement):
+    return "20" if code_departement in ("2A", "2B") else code_departement
+
+
+# Codes INSEE des communes d'un département (numéros sur trois chiffres, deux outre-mer),
+# sans reprendre celui de la préfecture
+def codes_insee(code_departement, nombre):
+    chiffres = 5 - len(code_departement)
+    prefecture = PREFECTURES.get(code_departement, (None, None))[1]
+    codes = [prefecture] if prefecture else []
+    for numero in range(1, 10 ** chiffres):
+        if len(codes) == nombre:
+            break
+        code = f"{code_departement}{numero * 7 % 10 ** chiffres:0{chiffres}d}"
+        if code != prefecture:
+            codes.append(code)
+    return codes
+
+
+# Communes d'un département : (code INSEE, nom, codes postaux, longitude, latitude, prix au m²),
+# la préfecture en premier
+def creer_communes(aleatoire, code_departement, nombre):
+    if code_departement in OUTRE_MER:
+        centre = OUTRE_MER[code_departement]
+        etendue = 0.25
+        nombre = min(nombre, 30)
+    else:
+        centre = (aleatoire.uniform(-1.5, 7.0), aleatoire.uniform(43.0, 50.5))
+        etendue = 0.45
+    # Paris est la seule commune de son département, avec ses vingt arrondissements
+    if code_departement == "75":
+        nombre = 1
+    prefixe = prefixe_postal(code_departement)
+    chiffres = 5 - len(prefixe)
+    communes = []
+    for rang, code in enumerate(codes_insee(code_departement, nombre)):
+        # Plusieurs codes postaux pour les communes les plus actives, jusqu'à 20 pour la première
+        nb_codes_postaux = 20 if code_departement == "75" else 1 + (rang == 0) * min(19, nombre // 10) + (rang < 5)
+        codes_postaux = [f"{prefixe}{(rang * 20 + i + 1) % 10 ** chiffres:0{chiffres}d}" for i in range(nb_codes_postaux)]
+        longitude = centre[0] + aleatoire.uniform(-etendue, etendue)
+        latitude = centre[1] + aleatoire.uniform(-etendue, etendue) * 0.7
+        # Les communes les plus actives sont en moyenne plus chères
+        prix_m2 = PRIX_M2_MEDIAN * math.exp(aleatoire.gauss(0, 0.3) - 0.08 * math.log(rang + 1))
+        communes.append([code, nom_commune(aleatoire), codes_postaux, longitude, latitude, prix_m2])
+    if code_departement in PREFECTURES:
+        nom, _, longitude, latitude, prix_m2 = PREFECTURES[code_departement]
+        communes[0][1] = nom
+        communes[0][3:] = longitude, latitude, prix_m2
+    return communes
+
+
+class Generateur:
+    def __init__(self, graine=0, communes_par_departement=300, exposant_departements=0.9, exposant_communes=1.1):
+        self.aleatoire = random.Random(graine)
+        self.departements = []
+        for code in DEPARTEMENTS:
+            communes = creer_communes(self.aleatoire, code, communes_par_departement)
+            self.departements.append((code, communes, zipf(len(communes), exposant_communes)))
+        self.cumuls_departements = zipf(len(self.departements), exposant_departements)
+        self.cumuls_natures = list(accumulate(poids for _, poids in NATURES))
+        self.cumuls_types = list(accumulate(poids for _, _, poids in TYPES_LOCAL))
+
+    # Lignes (listes dans l'ordre de NOMS_COLONNES) d'une mutation
+    def mutation(self, id_mutation, annee):
+        aleatoire = self.aleatoire
+        alea = aleatoire.random
+        code_departement, communes, cumuls_communes = self.departements[tirer(alea, self.cumuls_departements)]
+        code_commune, nom, codes_postaux, longitude, latitude, prix_m2 = communes[tirer(alea, cumuls_communes)]
+        nature = NATURES[tirer(alea, self.cumuls_natures)][0]
+        date = f"{annee}-{entier(alea, 12):02d}-{entier(alea, 28):02d}"
+        code_postal = choisir(alea, codes_postaux)
+        section = f"{choisir(alea, 'ABCDEHKLMNZ')}{choisir(alea, 'ABCDEHKLMNZ')}"
+        voie = f"{choisir(alea, VOIES)} {choisir(alea, NOMS_VOIES)}"
+        numero_voie = str(entier(alea, 150))
+        suffixe = "B" if alea() < 0.03 else ""
+        code_voie = f"{entier(alea, 9998):04d}"
+        x = longitude + aleatoire.gauss(0, 0.02)
+        y = latitude + aleatoire.gauss(0, 0.015)
+        prix = prix_m2 * math.exp(aleatoire.gauss(0, 0.25))
+        lignes = []
+        valeur = 0.0
+        for disposition in range(1, 1 + min(3, 1 + int(aleatoire.expovariate(3.0)))):
+            code_type, type_local, _ = TYPES_LOCAL[tirer(alea, self.cumuls_types)]
+            ligne = dict.fromkeys(NOMS_COLONNES, "")
+            surface = ""
+            if type_local == "Maison":
+                surface = round(aleatoire.lognormvariate(math.log(95), 0.3))
+                ligne["nombre_pieces_principales"] = str(max(1, round(surface / 22)))
+                ligne["surface_terrain"] = str(round(aleatoire.lognormvariate(math.log(600), 0.7)))
+                code_culture, culture = CULTURES[0] if alea() < 0.7 else choisir(alea, CULTURES)
+                ligne["code_nature_culture"], ligne["nature_culture"] = code_culture, culture
+                valeur += surface * prix
+            elif type_local == "Appartement":
+                surface = round(aleatoire.lognormvariate(math.log(55), 0.4))
+                ligne["nombre_pieces_principales"] = str(max(1, round(surface / 20)))
+                ligne["lot1_numero"] = str(entier(alea, 400))
+                ligne["lot1_surface_carrez"] = f"{surface * aleatoire.uniform(0.9, 1.0):.2f}"
+                ligne["nombre_lots"] = "1"
+                valeur += surface * prix * 1.1
+            elif type_local == "Dépendance":
+                ligne["lot1_numero"] = str(entier(alea, 400))
+                ligne["nombre_lots"] = "1"
+                valeur += aleatoire.uniform(5000, 30000)
+            elif type_local:
+                surface = round(aleatoire.lognormvariate(math.log(150), 0.8))
+                ligne["nombre_pieces_principales"] = "0"
+                valeur += surface * prix * 0.7
+            else:
+                code_culture, culture = choisir(alea, CULTURES)
+                terrain = round(aleatoire.lognormvariate(math.log(900), 1.0))
+                ligne["code_nature_culture"], ligne["nature_culture"] = code_culture, culture
+                ligne["surface_terrain"] = str(terrain)
+                valeur += terrain * aleatoire.uniform(5, 150)
+            ligne.update(
+                id_mutation=id_mutation, date_mutation=date, numero_disposition=f"{disposition:06d}", nature_mutation=nature,
+                adresse_numero=numero_voie, adresse_suffixe=suffixe, adresse_nom_voie=voie, adresse_code_voie=code_voie,
+                code_postal=code_postal, code_commune=code_commune, nom_commune=nom, code_departement=code_departement,
+                id_parcelle=f"{code_commune}000{section}{entier(alea, 2000):04d}",
+                code_type_local=code_type, type_local=type_local, surface_reelle_bati=str(surface),
+                longitude=f"{x:.6f}", latitude=f"{y:.6f}",
+            )
+            lignes.append(ligne)
+        # Valeur foncière de la mutation, répétée sur chaque ligne comme dans DVF (absente parfois)
+        valeur_fonciere = f"{round(valeur, -2):.2f}" if alea() > 0.01 else ""
+        for ligne in lignes:
+            ligne["valeur_fonciere"] = valeur_fonciere
+        return [[ligne[nom] for nom in NOMS_COLONNES] for ligne in lignes]
+
+    # Lignes réparties également entre les années, les mutations d'une année dans l'ordre
+    def lignes(self, nombre, annees):
+        produites = 0
+        for position, annee in enumerate(annees):
+            objectif = nombre * (position + 1) // len(annees)
+            numero = 0
+            while produites < objectif:
+                numero += 1
+                for ligne in self.mutation(f"{annee}-{numero}", annee)[:objectif - produites]:
+                    produites += 1
+                    yield ligne
+
+
+def ecrire_csv(texte, lignes):
+    ecrivain = csv.writer(texte, lineterminator="\n")
+    ecrivain.writerow(NOMS_COLONNES)
+    ecrivain.writerows(lignes)
+
+
+def ecrire(chemin, nombre, annees, graine=0, communes_par_departement=300):
+    lignes = Generateur(graine, communes_par_departement).lignes(nombre, annees)
+    chemin = str(chemin)
+    if not chemin.endswith(".gz"):
+        with open(chemin, "w", encoding="utf-8", newline="") as texte:
+            ecrire_csv(texte, lignes)
+        return
+    # Ni nom ni date dans l'en-tête gzip : même fichier compressé d'une génération à l'autre
+    with open(chemin, "wb") as brut, gzip.GzipFile("", "wb", compresslevel=6, fileobj=brut, mtime=0) as fichier:
+        with io.TextIOWrapper(fichier, encoding="utf-8", newline="") as texte:
+            ecrire_csv(texte, lignes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère un fichier DVF synthétique reproductible")
+    parser.add_argument("sortie", help="Fichier CSV à écrire (.csv ou .csv.gz)")
+    parser.add_argument("--lignes", type=int, default=100_000, help="Nombre de lignes (10 000 à 10 000 000)")
+    parser.add_argument("--annees", default="2023", help="Années séparées par des virgules")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--communes", type=int, default=300, help="Communes par département (30 au plus outre-mer)")
+    args = parser.parse_args()
+
+    ecrire(args.sortie, args.lignes, [int(annee) for annee in args.annees.split(",")], args.graine, args.communes)
+    print(f"{args.lignes} lignes écrites dans {args.sortie}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+import charge
+import generer_dvf
+
+sys.path.insert(0, str(charge.RACINE))
+
+import createdb  # noqa: E402
+
+# Suite de benchmarks sur des données synthétiques (generer_dvf.py), sans le fichier DVF
+# complet : génération du CSV, chargement initial (createdb.charger, utilisé par createdb.py
+# comme par insert_data_from_csv de l'API), relance sans changement, ajout d'une année, taille
+# de la base, puis charge concurrente sur chaque endpoint de l'API lancée par serve.py (sans
+# cache de réponses) : débit et latences p50 / p99 par endpoint, temps SQL, lignes renvoyées et
+# instructions SQLite (en milliers) par requête d'après /metrics.
+
+
+def taille_base(chemin):
+    return sum(os.path.getsize(fichier) for fichier in (chemin, f"{chemin}-wal") if os.path.exists(fichier))
+
+
+def charger(db, fichiers):
+    conn = sqlite3.connect(db)
+    try:
+        debut = time.perf_counter()
+        modifiees = createdb.charger(conn, fichiers)
+        duree = time.perf_counter() - debut
+        lignes = conn.execute("SELECT count(*) FROM mutations").fetchone()[0]
+    finally:
+        conn.close()
+    return duree, lignes, len(modifiees)
+
+
+def compter_lignes(chemin):
+    with createdb.ouvrir_csv(chemin) as fichier:
+        return sum(1 for _ in fichier) - 1
+
+
+# Chemins de chaque endpoint pour des lieux tirés au hasard, les plus actifs plus souvent
+# (tirage pondéré par le nombre de ventes, comme le sont les recherches)
+def chemins_endpoints(db, nombre, graine=0):
+    conn = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+    try:
+        communes = conn.execute(
+            """SELECT communes.nom_commune, count(*), avg(mutations.longitude), avg(mutations.latitude)
+               FROM mutations JOIN communes ON communes.id = mutations.commune_id
+               WHERE communes.nom_commune IS NOT NULL AND mutations.longitude IS NOT NULL
+               GROUP BY communes.nom_commune"""
+        ).fetchall()
+        departements = [code for (code,) in conn.execute("SELECT code_departement FROM departements WHERE code_departement IS NOT NULL")]
+    finally:
+        conn.close()
+    aleatoire = random.Random(graine)
+    tirees = aleatoire.choices(communes, weights=[ventes for _, ventes, _, _ in communes], k=nombre)
+    chemins = []
+    for nom, _, longitude, latitude in tirees:
+        departement = aleatoire.choice(departements)
+        lieu = quote(nom)
+        chemins += [
+            f"/prix-moyen-m2-par-ville/?nom_ville={lieu}",
+            f"/prix-moyen-m2-par-ville-maisons/?nom_ville={lieu}",
+            f"/moyenne-m2-appartement-par-commune/?nom_commune={lieu}",
+            f"/prix-moyen-m2-par-villes/?villes={lieu},{quote(aleatoire.choice(communes)[0])},{departement}",
+            f"/profil-commune/?nom_commune={aleatoire.choice([lieu, departement])}",
+            f"/prix-m2-robuste/?nom_ville={lieu}",
+            f"/quantiles-prix-m2/?lieux={lieu},{departement}&type_local=Appartement",
+            f"/serie-temporelle/?lieux={lieu}&pas=trimestre&lissage=4",
+            f"/maisons-par-commune/?nom_commune={lieu}&limite=100",
+            f"/autocompletion-communes/?debut={quote(nom[:3])}",
+            f"/prix-moyen-m2-rayon/?longitude={longitude:.4f}&latitude={latitude:.4f}&rayon_km=2",
+            f"/prix-moyen-m2-zone/?ouest={longitude - 0.05:.4f}&sud={latitude - 0.03:.4f}&est={longitude + 0.05:.4f}&nord={latitude + 0.03:.4f}",
+            f"/carte-chaleur/?zoom=10&ouest={longitude - 0.5:.4f}&sud={latitude - 0.3:.4f}&est={longitude + 0.5:.4f}&nord={latitude + 0.3:.4f}",
+        ]
+    aleatoire.shuffle(chemins)
+    return chemins
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks du chargement et de l'API sur des données DVF synthétiques")
+    parser.add_argument("--dossier", default="benchmark_dvf", help="Dossier de travail (CSV et base créés s'ils n'existent pas)")
+    parser.add_argument("--lignes", type=int, default=100_000, help="Lignes du fichier synthétique (10 000 à 10 000 000)")
+    parser.add_argument("--annees", default="2022,2023", help="Années du fichier initial ; l'année suivante est ajoutée ensuite")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=1, help="Workers de serve.py (/metrics ne couvre qu'un worker)")
+    parser.add_argument("--connexions", type=int, default=4, help="Connexions SQLite par worker (0 : databases)")
+    parser.add_argument("--clients", type=int, default=16, help="Connexions HTTP simultanées")
+    parser.add_argument("--processus", type=int, default=max(1, os.cpu_count() // 2), help="Processus clients")
+    parser.add_argument("--duree", type=float, default=20, help="Durée de la charge en secondes")
+    parser.add_argument("--lieux", type=int, default=200, help="Communes tirées pour les requêtes")
+    parser.add_argument("--json", metavar="FICHIER", help="Écrit aussi les résultats en JSON")
+    args = parser.parse_args()
+
+    dossier = Path(args.dossier)
+    dossier.mkdir(parents=True, exist_ok=True)
+    db = dossier / "dvf.db"
+    annees = [int(annee) for annee in args.annees.split(",")]
+    initial = dossier / f"dvf_{args.lignes}_{args.graine}.csv.gz"
+    ajout = dossier / f"dvf_{args.lignes}_{args.graine}_{max(annees) + 1}.csv.gz"
+    resultats = {"lignes": args.lignes, "annees": annees, "graine": args.graine}
+
+    if not initial.exists():
+        debut = time.perf_counter()
+        generer_dvf.ecrire(initial, args.lignes, annees, args.graine)
+        resultats["generation_s"] = time.perf_counter() - debut
+        print(f"Génération : {args.lignes} lignes en {resultats['generation_s']:.1f} s", flush=True)
+    if not ajout.exists():
+        generer_dvf.ecrire(ajout, args.lignes // len(annees), [max(annees) + 1], args.graine + 1)
+
+    # Les mesures de chargement partent d'une base vide
+    for fichier in (db, Path(f"{db}-wal"), Path(f"{db}-shm")):
+        fichier.unlink(missing_ok=True)
+    lignes_initial = compter_lignes(initial)
+    lignes_ajout = compter_lignes(ajout)
+    etapes = [
+        ("chargement initial", [initial], lignes_initial),
+        ("relance sans changement", [initial], lignes_initial),
+        ("ajout d'une année", [initial, ajout], lignes_ajout),
+    ]
+    resultats["chargement"] = []
+    print(f"{'étape':<24} {'durée s':>9} {'lignes/s':>10} {'partitions':>10} {'base Mo':>9}")
+    for nom, fichiers, lignes in etapes:
+        duree, _, partitions = charger(db, fichiers)
+        debit = lignes / duree if partitions else None
+        taille = taille_base(db)
+        resultats["chargement"].append({"etape": nom, "duree_s": duree, "lignes_par_s": debit, "partitions": partitions, "taille_octets": taille})
+        debit_texte = f"{debit:10.0f}" if debit else f"{'-':>10}"
+        print(f"{nom:<24} {duree:9.2f} {debit_texte} {partitions:10} {taille / 1e6:9.1f}", flush=True)
+
+    args.dossier = str(dossier)
+    chemins = chemins_endpoints(db, args.lieux, args.graine)
+    latences, erreurs, metriques = charge.executer(args, chemins, args.workers, args.connexions)
+    par_endpoint = {}
+    for endpoint, latence in latences:
+        par_endpoint.setdefault(endpoint, []).append(latence)
+    debit, p50, _, p99 = charge.resumer([latence for _, latence in latences], args.duree)
+    serveur = metriques.get("endpoints", {})
+    resultats["api"] = {"workers": args.workers, "connexions": args.connexions, "clients": args.clients,
+                        "req_par_s": debit, "p50_ms": p50, "p99_ms": p99, "erreurs": erreurs, "endpoints": {}}
+    print(f"\n{'endpoint':<40} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'SQL ms':>8} {'lignes':>8} {'instr. k':>9}")
+    for endpoint in sorted(par_endpoint):
+        debit_endpoint, p50_endpoint, _, p99_endpoint = charge.resumer(par_endpoint[endpoint], args.duree)
+        cote_serveur = serveur.get(endpoint)
+        sql_ms = cote_serveur["duree_sql_moyenne_ms"] if cote_serveur else None
+        lignes = cote_serveur["lignes_renvoyees"] / cote_serveur["nb_requetes"] if cote_serveur else None
+        instructions = cote_serveur["instructions_sqlite"] / cote_serveur["nb_requetes"] if cote_serveur and cote_serveur["instructions_sqlite"] is not None else None
+        resultats["api"]["endpoints"][endpoint] = {"req_par_s": debit_endpoint, "p50_ms": p50_endpoint, "p99_ms": p99_endpoint,
+                                                   "sql_ms": sql_ms, "lignes_par_requete": lignes, "instructions_par_requete": instructions}
+        valeurs = " ".join(f"{valeur:8.1f}" if valeur is not None else f"{'-':>8}" for valeur in (p50_endpoint, p99_endpoint, sql_ms, lignes))
+        instructions_texte = f"{instructions / 1000:9.1f}" if instructions is not None else f"{'-':>9}"
+        print(f"{endpoint:<40} {debit_endpoint:8.0f} {valeurs} {instructions_texte}")
+    centiles = " ".join(f"{valeur:8.1f}" if valeur is not None else f"{'-':>8}" for valeur in (p50, p99))
+    print(f"{'total':<40} {debit:8.0f} {centiles}   {erreurs} erreurs")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fichier:
+            json.dump(resultats, fichier, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
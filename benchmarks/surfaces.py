@@ -0,0 +1,122 @@
+import argparse
+import sqlite3
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy.dialects import sqlite
+from sqlmodel import select
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import communes  # noqa: E402
+from main import NATURES_VENTE, Dvf, requete_stats, requete_stats_dvf  # noqa: E402
+
+# Benchmark de régression des endpoints de surfaces moyennes : ancienne version (toutes les
+# colonnes de dvf ramenées dans Python puis sommées en boucle), agrégat SQL sur dvf et
+# lecture des agrégats précalculés. Avec --parquet, ajoute le moteur en colonnes (DuckDB sur
+# les fichiers Parquet). Affiche les octets ramenés et la latence.
+
+
+def compiler(requete):
+    return str(requete.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+# Requête et calcul tels qu'ils étaient faits avant : select(Dvf) puis somme en Python (sur le
+# lieu résolu, communes.Lieu)
+def requete_ancienne(lieu, type_local):
+    requete = select(Dvf).where(
+        (Dvf.nature_mutation.in_(NATURES_VENTE)) & (Dvf.type_local == type_local) & (Dvf.code_departement == lieu.code_departement)
+    )
+    return requete if lieu.departement else requete.where(Dvf.nom_commune == lieu.nom_commune)
+
+
+def moyenne_ancienne(lignes):
+    position = list(Dvf.__table__.columns.keys()).index("surface_reelle_bati")
+    total_surface = 0
+    for ligne in lignes:
+        total_surface += ligne[position] or 0
+    return total_surface / len(lignes) if lignes else None
+
+
+def moyenne_agregat(lignes):
+    stats = dict(zip(["nb_lignes", "nb_prix_m2", "somme_prix_m2", "nb_surface", "somme_surface"], lignes[0]))
+    return stats["somme_surface"] / stats["nb_surface"] if stats["nb_surface"] else None
+
+
+# Taille approximative des valeurs ramenées par SQLite
+def taille_octets(lignes):
+    total = 0
+    for ligne in lignes:
+        for valeur in ligne:
+            if isinstance(valeur, str):
+                total += len(valeur.encode("utf-8"))
+            elif valeur is not None:
+                total += 8
+    return total
+
+
+def mesurer(conn, sql, calcul, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        lignes = conn.execute(sql).fetchall()
+        resultat = calcul(lignes)
+        durees.append((time.perf_counter() - debut) * 1000)
+    return resultat, len(lignes), taille_octets(lignes), statistics.median(durees), max(durees)
+
+
+def mesurer_colonnes(entrepot, lieu, type_local, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        stats = entrepot.stats_groupees([lieu], lieu.departement, type_local).get(lieu)
+        resultat = stats["somme_surface"] / stats["nb_surface"] if stats and stats["nb_surface"] else None
+        durees.append((time.perf_counter() - debut) * 1000)
+    lignes = [tuple(stats.values())] if stats else []
+    return resultat, len(lignes), taille_octets(lignes), statistics.median(durees), max(durees)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des moyennes de surface par commune ou département")
+    parser.add_argument("--db", default="dvf.db", help="Chemin de la base SQLite")
+    parser.add_argument("--lieux", default="75,Paris,33,Toulouse", help="Communes ou départements séparés par des virgules")
+    parser.add_argument("--type-local", default="Appartement", help="Type de local (Maison ou Appartement)")
+    parser.add_argument("--repetitions", type=int, default=10)
+    parser.add_argument("--parquet", metavar="DOSSIER", help="Dossier Parquet exporté par createdb.py --parquet")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    entrepot = None
+    if args.parquet:
+        import colonnes
+
+        entrepot = colonnes.EntrepotColonnes(args.parquet)
+        entrepot.charger()
+    variantes = [
+        ("select(Dvf) + boucle", requete_ancienne, moyenne_ancienne),
+        ("agrégat SQL sur dvf", requete_stats_dvf, moyenne_agregat),
+        ("agrégats dvf_stats", requete_stats, moyenne_agregat),
+    ]
+    print(f"{'lieu':<12} {'variante':<22} {'moyenne':>10} {'lignes':>8} {'octets':>12} {'p50 ms':>9} {'max ms':>9}")
+    resolveur = communes.charger(conn)
+    for lieu in args.lieux.split(","):
+        canonique = resolveur.resoudre(lieu)
+        if canonique is None:
+            print(f"{lieu:<12} lieu inconnu")
+            continue
+        for nom, requete, calcul in variantes:
+            sql = compiler(requete(canonique, args.type_local))
+            resultat, nb_lignes, octets, p50, pire = mesurer(conn, sql, calcul, args.repetitions)
+            moyenne = f"{resultat:.2f}" if resultat is not None else "-"
+            print(f"{lieu:<12} {nom:<22} {moyenne:>10} {nb_lignes:>8} {octets:>12} {p50:>9.2f} {pire:>9.2f}")
+        if entrepot is not None:
+            resultat, nb_lignes, octets, p50, pire = mesurer_colonnes(entrepot, canonique, args.type_local, args.repetitions)
+            moyenne = f"{resultat:.2f}" if resultat is not None else "-"
+            print(f"{lieu:<12} {'DuckDB sur Parquet':<22} {moyenne:>10} {nb_lignes:>8} {octets:>12} {p50:>9.2f} {pire:>9.2f}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
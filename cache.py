@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+# Cache des réponses de l'API. Les données ne changent qu'au rechargement, les réponses
+# sont donc gardées par (endpoint, paramètres) pour une version des données : la version est
+# lue dans la table meta (incrémentée par createdb.charger) et une entrée d'une autre version
+# n'est jamais servie. Deux stockages : en mémoire (LRU borné en octets) ou un fichier SQLite
+# local partagé par les workers uvicorn.
+
+
+# Clé normalisée : chemin sans / final et paramètres triés
+def cle_requete(chemin, requete):
+    parametres = sorted(parse_qsl(requete, keep_blank_values=True))
+    return chemin.rstrip("/") + "?" + urlencode(parametres)
+
+
+# L'ETag ne dépend que de la clé et de la version : une revalidation (If-None-Match) est
+# tranchée sans exécuter la requête ni lire le cache
+def etag(cle, version):
+    return '"' + hashlib.sha1(f"{version}\x1f{cle}".encode("utf-8")).hexdigest()[:20] + '"'
+
+
+# Compteurs communs aux deux stockages, exposés par l'API
+class Stockage:
+    # Stockage qui fait des entrées-sorties, appelé dans un thread par le middleware
+    bloquant = False
+
+    def __init__(self, taille_max, ttl):
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self.compteurs = {"hits": 0, "misses": 0, "revalidations": 0}
+
+    def statistiques(self):
+        total = self.compteurs["hits"] + self.compteurs["misses"]
+        return {
+            **self.compteurs,
+            "taux_hits": self.compteurs["hits"] / total if total else None,
+            "entrees": self.nb_entrees(),
+        }
+
+
+class CacheMemoire(Stockage):
+    def __init__(self, taille_max, ttl):
+        super().__init__(taille_max, ttl)
+        self.entrees = OrderedDict()
+        self.taille = 0
+        self.verrou = threading.Lock()
+
+    def lire(self, cle, version):
+        with self.verrou:
+            entree = self.entrees.get(cle)
+            if entree is None:
+                return None
+            version_entree, expire_le, corps, type_contenu = entree
+            if version_entree != version or expire_le < time.time():
+                self.retirer(cle)
+                return None
+            self.entrees.move_to_end(cle)
+            return corps, type_contenu
+
+    def ecrire(self, cle, version, corps, type_contenu):
+        if len(corps) > self.taille_max:
+            return
+        with self.verrou:
+            if cle in self.entrees:
+                self.retirer(cle)
+            self.entrees[cle] = (version, time.time() + self.ttl, corps, type_contenu)
+            self.taille += len(corps)
+            while self.taille > self.taille_max:
+                self.retirer(next(iter(self.entrees)))
+
+    def retirer(self, cle):
+        self.taille -= len(self.entrees.pop(cle)[2])
+
+    def nb_entrees(self):
+        return len(self.entrees)
+
+
+# Cache dans un fichier SQLite local, partagé par les processus d'une même machine. L'ordre
+# LRU suit la date de dernière lecture de chaque entrée. Une écriture n'insère que sa ligne :
+# l'éviction (autres versions, entrées expirées, puis les moins récemment lues au-delà de la
+# taille maximale) n'a lieu qu'après un dixième de la taille maximale écrit depuis la
+# précédente, ou au changement de version, par lots de LOT_EVICTION lignes. Les dates de
+# lecture sont gardées en mémoire et enregistrées par lots de LECTURES_MAX, ou avant une éviction.
+class CacheSQLite(Stockage):
+    bloquant = True
+
+    LOT_EVICTION = 500
+    LECTURES_MAX = 100
+
+    def __init__(self, chemin, taille_max, ttl):
+        super().__init__(taille_max, ttl)
+        self.conn = sqlite3.connect(chemin, timeout=5, isolation_level=None, check_same_thread=False)
+        self.verrou = threading.Lock()
+        self.lectures = {}
+        self.ecrit = 0
+        self.version = None
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS reponses (
+                   cle TEXT PRIMARY KEY,
+                   version TEXT,
+                   expire_le REAL,
+                   lu_le REAL,
+                   taille INTEGER,
+                   type_contenu TEXT,
+                   corps BLOB
+               )"""
+        )
+        # (lu_le, taille) couvre la somme des tailles et le choix des entrées à évincer
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reponses_version ON reponses (version)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reponses_expire ON reponses (expire_le)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reponses_lu ON reponses (lu_le, taille)")
+
+    def lire(self, cle, version):
+        maintenant = time.time()
+        with self.verrou:
+            ligne = self.conn.execute(
+                "SELECT corps, type_contenu FROM reponses WHERE cle = ? AND version = ? AND expire_le >= ?",
+                (cle, version, maintenant),
+            ).fetchone()
+            if ligne is not None:
+                self.lectures[cle] = maintenant
+                if len(self.lectures) >= self.LECTURES_MAX:
+                    self.enregistrer_lectures()
+        return ligne
+
+    def ecrire(self, cle, version, corps, type_contenu):
+        if len(corps) > self.taille_max:
+            return
+        maintenant = time.time()
+        with self.verrou:
+            self.lectures.pop(cle, None)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reponses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cle, version, maintenant + self.ttl, maintenant, len(corps), type_contenu, corps),
+            )
+            self.ecrit += len(corps)
+            if self.ecrit > self.taille_max // 10 or version != self.version:
+                self.evincer(version, maintenant)
+
+    # Dates de lecture en attente, en une transaction
+    def enregistrer_lectures(self):
+        lectures, self.lectures = self.lectures, {}
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("UPDATE reponses SET lu_le = ? WHERE cle = ?", [(lu_le, cle) for cle, lu_le in lectures.items()])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    # Supprime les entrées choisies par une requête (clé, taille) par lots, chacun dans sa
+    # transaction pour ne pas bloquer les autres processus ; s'arrête une fois octets libérés
+    def supprimer_par_lots(self, requete, parametres, octets=None):
+        libere = 0
+        while octets is None or libere < octets:
+            cles = []
+            for cle, taille in self.conn.execute(f"{requete} LIMIT {self.LOT_EVICTION}", parametres).fetchall():
+                if octets is not None and libere >= octets:
+                    break
+                cles.append((cle,))
+                libere += taille
+            if not cles:
+                break
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("DELETE FROM reponses WHERE cle = ?", cles)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def evincer(self, version, maintenant):
+        if self.lectures:
+            self.enregistrer_lectures()
+        self.supprimer_par_lots("SELECT cle, taille FROM reponses WHERE version < ? OR version > ?", (version, version))
+        self.supprimer_par_lots("SELECT cle, taille FROM reponses WHERE expire_le < ?", (maintenant,))
+        total = self.conn.execute("SELECT coalesce(sum(taille), 0) FROM reponses").fetchone()[0]
+        if total > self.taille_max:
+            self.supprimer_par_lots("SELECT cle, taille FROM reponses ORDER BY lu_le, cle", (), total - self.taille_max)
+        self.ecrit = 0
+        self.version = version
+
+    def nb_entrees(self):
+        with self.verrou:
+            return self.conn.execute("SELECT count(*) FROM reponses").fetchone()[0]
+
+
+class CacheReponses(BaseHTTPMiddleware):
+    # stockage : CacheMemoire ou CacheSQLite ; version : fonction asynchrone qui renvoie la
+    # version des données, ou None tant qu'elles ne sont pas prêtes (pas de cache) ;
+    # chemins : endpoints mis en cache ; max_age : durée de fraîcheur annoncée au navigateur
+    def __init__(self, app, stockage, version, chemins, max_age=60):
+        super().__init__(app)
+        self.stockage = stockage
+        self.version = version
+        self.chemins = set(chemins)
+        self.max_age = max_age
+        self.compteurs = stockage.compteurs
+
+    # Un stockage bloquant (fichier SQLite) est appelé dans un thread, pour ne pas arrêter
+    # la boucle d'événements pendant ses lectures et écritures
+    async def appeler(self, methode, *arguments):
+        if self.stockage.bloquant:
+            return await asyncio.to_thread(methode, *arguments)
+        return methode(*arguments)
+
+    def entetes(self, cle, version):
+        return {"ETag": etag(cle, version), "Cache-Control": f"public, max-age={self.max_age}"}
+
+    async def dispatch(self, request, call_next):
+        if request.method != "GET" or request.url.path not in self.chemins:
+            return await call_next(request)
+        version = await self.version()
+        if version is None:
+            return await call_next(request)
+
+        cle = cle_requete(request.url.path, request.url.query)
+        entetes = self.entetes(cle, version)
+        if request.headers.get("if-none-match") == entetes["ETag"]:
+            self.compteurs["revalidations"] += 1
+            return Response(status_code=304, headers=entetes)
+
+        trouve = await self.appeler(self.stockage.lire, cle, version)
+        if trouve is not None:
+            self.compteurs["hits"] += 1
+            corps, type_contenu = trouve
+            return Response(corps, media_type=type_contenu, headers={**entetes, "X-Cache": "HIT"})
+
+        self.compteurs["misses"] += 1
+        reponse = await call_next(request)
+        if reponse.status_code != 200:
+            return reponse
+        # Une réponse envoyée en flux (sans longueur connue) n'est pas mise en mémoire
+        if "content-length" not in reponse.headers:
+            reponse.headers.update(entetes)
+            return reponse
+        corps = b"".join([morceau async for morceau in reponse.body_iterator])
+        type_contenu = reponse.headers.get("content-type")
+        await self.appeler(self.stockage.ecrire, cle, version, corps, type_contenu)
+        entetes_reponse = {nom: valeur for nom, valeur in reponse.headers.items() if nom.lower() != "content-length"}
+        entetes_reponse.update(entetes)
+        entetes_reponse["X-Cache"] = "MISS"
+        return Response(corps, status_code=200, headers=entetes_reponse, media_type=type_contenu)
+
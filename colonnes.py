@@ -0,0 +1,178 @@
+import shutil
+import sys
+import threading
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import communes
+import schema
+
+# Stockage en colonnes des ventes DVF : un fichier Parquet par partition (année, département)
+# écrit au chargement et interrogé sur place avec DuckDB. Utilisé par l'API quand
+# DVF_BACKEND=colonnes.
+
+# Dossier par défaut des fichiers Parquet
+DOSSIER = "dvf_parquet"
+
+# Colonnes exportées, avec le prix au m² précalculé
+SELECT_PARTITION = """SELECT
+    mutations.id_mutation,
+    mutations.date_mutation,
+    natures_mutation.nature_mutation,
+    types_local.type_local,
+    communes.code_commune,
+    communes.nom_commune,
+    mutations.valeur_fonciere,
+    mutations.surface_reelle_bati,
+    mutations.surface_terrain,
+    mutations.valeur_fonciere / NULLIF(mutations.surface_reelle_bati, 0) AS prix_m2,
+    mutations.longitude,
+    mutations.latitude
+FROM mutations
+LEFT JOIN communes ON communes.id = mutations.commune_id
+LEFT JOIN natures_mutation ON natures_mutation.id = mutations.nature_mutation_id
+LEFT JOIN types_local ON types_local.id = mutations.type_local_id
+WHERE mutations.departement_id = (SELECT id FROM departements WHERE code_departement = ?)
+AND mutations.date_mutation BETWEEN ? AND ?"""
+
+SCHEMA_ARROW = pa.schema(
+    [
+        ("id_mutation", pa.string()),
+        ("date_mutation", pa.int32()),
+        ("nature_mutation", pa.string()),
+        ("type_local", pa.string()),
+        ("code_commune", pa.string()),
+        ("nom_commune", pa.string()),
+        ("valeur_fonciere", pa.float64()),
+        ("surface_reelle_bati", pa.float64()),
+        ("surface_terrain", pa.float64()),
+        ("prix_m2", pa.float64()),
+        ("longitude", pa.float64()),
+        ("latitude", pa.float64()),
+    ]
+)
+
+# Fichiers lus par DuckDB, les colonnes de partition tirées des noms de dossiers. Le code du
+# département est lu comme du texte pour garder « 01 » ou « 2A ». DuckDB n'accepte pas de
+# paramètre dans une vue : le chemin est écrit dans la requête.
+LECTURE_PARQUET = "read_parquet('{fichiers}', hive_partitioning = true, hive_types = {{'annee': INTEGER, 'code_departement': VARCHAR}})"
+
+
+def dossier_partition(dossier, annee, code_departement):
+    return Path(dossier) / f"annee={int(annee)}" / f"code_departement={code_departement}"
+
+
+# Écrit en Parquet les partitions (année, département) données, ou toutes les partitions.
+# Une partition qui n'a plus de lignes est supprimée.
+def exporter(conn, dossier=DOSSIER, partitions=None):
+    if partitions is None:
+        shutil.rmtree(dossier, ignore_errors=True)
+        partitions = schema.toutes_partitions(conn)
+    for annee, code_departement in partitions:
+        chemin = dossier_partition(dossier, annee, code_departement)
+        lignes = conn.execute(SELECT_PARTITION, (code_departement, *schema.bornes_annee(annee))).fetchall()
+        shutil.rmtree(chemin, ignore_errors=True)
+        if not lignes:
+            continue
+        colonnes = {nom: pa.array(valeurs, type=SCHEMA_ARROW.field(nom).type) for nom, valeurs in zip(SCHEMA_ARROW.names, zip(*lignes))}
+        chemin.mkdir(parents=True, exist_ok=True)
+        pq.write_table(pa.table(colonnes, schema=SCHEMA_ARROW), chemin / "donnees.parquet")
+    print(f"{len(partitions)} partitions exportées en Parquet dans {dossier}", file=sys.stderr)
+
+
+def existe(dossier=DOSSIER):
+    return any(Path(dossier).glob("annee=*/code_departement=*/*.parquet"))
+
+
+# Export après un chargement : seules les partitions modifiées sont réécrites, sauf si le
+# dossier n'existe pas encore
+def mettre_a_jour(conn, dossier=DOSSIER, partitions=None):
+    exporter(conn, dossier, partitions if existe(dossier) else None)
+
+
+# Moteur de requêtes sur les fichiers Parquet : la vue dvf lit les fichiers à chaque requête,
+# sans copie en mémoire par processus. Un filtre sur le département (colonne de partition)
+# n'ouvre que les fichiers de ce département ; seules les colonnes de la requête sont lues.
+# Une commune est cherchée dans les fichiers de son département (voir communes.Lieu).
+class EntrepotColonnes:
+    def __init__(self, dossier=DOSSIER):
+        self.dossier = dossier
+        self.verrou = threading.Lock()
+        self.connexion = None
+
+    def charger(self):
+        connexion = duckdb.connect()
+        if existe(self.dossier):
+            fichiers = str(Path(self.dossier) / "annee=*" / "code_departement=*" / "*.parquet").replace("'", "''")
+            connexion.execute(f"CREATE VIEW dvf AS SELECT * FROM {LECTURE_PARQUET.format(fichiers=fichiers)}")
+            # Les métadonnées des fichiers (schéma, statistiques des blocs) sont gardées entre
+            # les requêtes ; DuckDB les relit si un fichier est réécrit
+            connexion.execute("SET parquet_metadata_cache = true")
+        else:
+            vide = SCHEMA_ARROW.append(pa.field("annee", pa.int32())).append(pa.field("code_departement", pa.string())).empty_table()
+            connexion.register("vide", vide)
+            connexion.execute("CREATE TABLE dvf AS SELECT * FROM vide")
+            connexion.unregister("vide")
+        # Première requête avec paramètres (chargement des conversions de paramètres de DuckDB,
+        # lecture des métadonnées de tous les fichiers) faite ici plutôt que par un client
+        connexion.execute(
+            f"SELECT count(*), sum(prix_m2) FROM dvf WHERE nature_mutation IN ({', '.join('?' * len(schema.NATURES_VENTE))})",
+            schema.NATURES_VENTE,
+        ).fetchall()
+        with self.verrou:
+            self.connexion = connexion
+
+    # Une connexion DuckDB par appel (curseur), utilisable depuis plusieurs threads
+    def curseur(self):
+        with self.verrou:
+            return self.connexion.cursor() if self.connexion is not None else None
+
+    # Mêmes agrégats que dvf_stats pour une liste de communes ou de départements (communes.Lieu),
+    # rangés par lieu. Tant que les fichiers ne sont pas chargés, aucun lieu n'est trouvé.
+    def stats_groupees(self, lieux, par_departement, type_local=None):
+        lignes = self.executer_stats(lieux, par_departement, type_local)
+        return communes.par_lieu(lignes, lieux, par_departement)
+
+    # Agrégats d'un lieu pour chaque type de local, en une requête
+    def profil(self, lieu):
+        return self.executer_stats([lieu], lieu.departement, None, par_type_local=True)
+
+    def executer_stats(self, lieux, par_departement, type_local, par_type_local=False):
+        curseur = self.curseur()
+        if curseur is None:
+            return []
+        try:
+            return self.requete_stats(curseur, lieux, par_departement, type_local, par_type_local)
+        finally:
+            curseur.close()
+
+    # Pour les communes, le filtre porte sur les noms et sur les départements : il peut ramener
+    # une homonyme d'un des départements, écartée par communes.par_lieu
+    def requete_stats(self, curseur, lieux, par_departement, type_local, par_type_local):
+        colonnes = ["code_departement"] if par_departement else ["nom_commune", "code_departement"]
+        groupes = colonnes + ["type_local"] if par_type_local else colonnes
+        conditions = [f"nature_mutation IN ({', '.join('?' * len(schema.NATURES_VENTE))})"]
+        parametres = [*schema.NATURES_VENTE]
+        for colonne in colonnes:
+            valeurs = list(dict.fromkeys(getattr(lieu, colonne) for lieu in lieux))
+            conditions.append(f"{colonne} IN ({', '.join('?' * len(valeurs))})")
+            parametres.extend(valeurs)
+        if type_local is not None:
+            conditions.append("type_local = ?")
+            parametres.append(type_local)
+        requete = f"""SELECT
+            {", ".join(groupes)},
+            count(*) AS nb_lignes,
+            count(prix_m2) AS nb_prix_m2,
+            sum(prix_m2) AS somme_prix_m2,
+            count(surface_reelle_bati) AS nb_surface,
+            sum(surface_reelle_bati) AS somme_surface,
+            count(NULLIF(surface_terrain, 0)) AS nb_terrain,
+            sum(surface_terrain) AS somme_terrain
+        FROM dvf WHERE {' AND '.join(conditions)} GROUP BY {', '.join(groupes)}"""
+        resultat = curseur.execute(requete, parametres)
+        noms = [description[0] for description in resultat.description]
+        return [dict(zip(noms, ligne)) for ligne in resultat.fetchall()]
@@ -0,0 +1,209 @@
+import bisect
+import re
+import sys
+import unicodedata
+from collections import namedtuple
+
+import numpy as np
+
+import agregation
+import indexes
+
+# Résolution des lieux demandés à l'API. Les endpoints identifient une commune par son nom
+# exact dans DVF et un département par son code ; le résolveur accepte aussi les noms sans
+# accents, en minuscules, avec des tirets ou des espaces, « St » / « Ste » pour Saint /
+# Sainte, le code INSEE ou un code postal de la commune, et les codes de département 2A, 2B
+# et 971 à 976. Un lieu inconnu est rejeté sans requête sur la base.
+#
+# Les codes postaux de chaque commune et son nombre de ventes sont calculés à l'ingestion, par
+# partition (année, département), dans communes_codes_postaux (calcul dans agregation.py). L'API en construit un index en
+# mémoire : dictionnaires pour la résolution exacte, et liste triée des clés (noms normalisés,
+# fins de noms à partir de chaque mot, codes) parcourue par dichotomie pour l'autocomplétion.
+
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS communes_codes_postaux (
+    annee INTEGER,
+    code_departement TEXT,
+    commune_id INTEGER,
+    code_postal TEXT,
+    nb_ventes INTEGER
+)"""
+
+# Communes avec leurs codes postaux, de la plus vendue à la moins vendue
+SELECT_COMMUNES = """SELECT communes.nom_commune, communes.code_commune, departements.code_departement,
+    group_concat(DISTINCT codes.code_postal), sum(codes.nb_ventes) AS nb_ventes
+FROM communes_codes_postaux AS codes
+JOIN communes ON communes.id = codes.commune_id
+JOIN departements ON departements.id = communes.departement_id
+WHERE communes.nom_commune IS NOT NULL
+GROUP BY communes.id
+ORDER BY nb_ventes DESC, communes.nom_commune"""
+
+ABREVIATIONS = {"st": "saint", "ste": "sainte", "sts": "saints", "stes": "saintes"}
+
+Commune = namedtuple("Commune", "nom_commune code_commune code_departement codes_postaux nb_ventes")
+
+
+# Lieu canonique : une commune, identifiée par son nom dans DVF et le code de son département
+# (deux communes homonymes, comme Saint-Denis en Seine-Saint-Denis et à La Réunion, sont dans
+# deux départements), ou un département (nom_commune None). Les requêtes filtrent sur les deux.
+class Lieu(namedtuple("Lieu", "nom_commune code_departement")):
+    __slots__ = ()
+
+    @property
+    def departement(self):
+        return self.nom_commune is None
+
+    # Valeur de la colonne lieu des tables d'agrégats (nom de la commune ou code du département)
+    @property
+    def nom(self):
+        return self.code_departement if self.nom_commune is None else self.nom_commune
+
+
+# Lignes d'une requête groupée par lieu (colonnes nom_commune et code_departement, ou
+# code_departement seul pour des départements), rangées par Lieu pour les seuls lieux demandés
+def par_lieu(lignes, lieux, departements):
+    demandes = set(lieux)
+    resultats = {}
+    for ligne in lignes:
+        lieu = Lieu(None if departements else ligne["nom_commune"], ligne["code_departement"])
+        if lieu in demandes:
+            resultats[lieu] = ligne
+    return resultats
+
+
+# Vrai pour un code de département tel qu'il est écrit dans DVF : deux chiffres, 2A, 2B, ou
+# trois chiffres pour les départements d'outre-mer
+def est_code_departement(code):
+    return (code.isdigit() and len(code) in (2, 3)) or code in ("2A", "2B")
+
+
+# Nom sans accents, en minuscules, mots séparés par une espace et abréviations développées.
+# Pour une saisie en cours, le dernier mot peut être incomplet et n'est pas développé.
+def normaliser(texte, dernier_mot_complet=True):
+    texte = unicodedata.normalize("NFKD", texte.replace("œ", "oe").replace("Œ", "Oe"))
+    texte = "".join(caractere for caractere in texte if not unicodedata.combining(caractere)).lower()
+    mots = [mot for mot in re.split(r"[^a-z0-9]+", texte) if mot]
+    fin = len(mots) if dernier_mot_complet or not re.search(r"[a-z0-9]$", texte) else len(mots) - 1
+    return " ".join([ABREVIATIONS.get(mot, mot) for mot in mots[:fin]] + mots[fin:])
+
+
+class Resolveur:
+    # communes : liste de Commune de la plus vendue à la moins vendue (la première l'emporte
+    # pour un nom normalisé ou un code postal partagé) ; departements : codes des départements
+    def __init__(self, communes, departements):
+        self.communes = communes
+        self.departements = set(departements)
+        self.par_nom = {}
+        self.par_code = {}
+        self.par_code_postal = {}
+        # (clé, 0 pour un début de nom ou un code et 1 pour un mot suivant, rang de la commune)
+        cles = []
+        for rang, commune in enumerate(communes):
+            nom = normaliser(commune.nom_commune)
+            self.par_nom.setdefault(nom, rang)
+            mots = nom.split(" ")
+            cles.append((nom, 0, rang))
+            cles.extend((" ".join(mots[debut:]), 1, rang) for debut in range(1, len(mots)))
+            if commune.code_commune:
+                self.par_code.setdefault(commune.code_commune, rang)
+                cles.append((commune.code_commune.lower(), 0, rang))
+            for code_postal in commune.codes_postaux:
+                self.par_code_postal.setdefault(code_postal, rang)
+                cles.append((code_postal, 0, rang))
+        cles.sort()
+        self.cles = [cle for cle, _, _ in cles]
+        self.ordres = [(ordre, rang) for _, ordre, rang in cles]
+
+    # Lieu canonique d'une saisie, None si inconnu. Un nom partagé par plusieurs communes
+    # désigne la plus vendue ; le code INSEE ou un code postal désigne une commune précise.
+    def resoudre(self, texte):
+        code = texte.strip().upper()
+        if len(code) == 1 and code.isdigit():
+            code = "0" + code
+        if code in self.departements:
+            return Lieu(None, code)
+        rang = self.par_code.get(code)
+        if rang is None:
+            rang = self.par_code_postal.get(code)
+        if rang is None:
+            rang = self.par_nom.get(normaliser(texte))
+        if rang is None:
+            return None
+        commune = self.communes[rang]
+        return Lieu(commune.nom_commune, commune.code_departement)
+
+    # Communes dont le nom, un mot du nom, le code INSEE ou un code postal commence par la
+    # saisie (normalisée, codes en minuscules) : débuts de nom et codes d'abord, puis par
+    # nombre de ventes décroissant
+    def completer(self, debut, limite=10):
+        prefixe = normaliser(debut, dernier_mot_complet=False)
+        if not prefixe:
+            return []
+        premier = bisect.bisect_left(self.cles, prefixe)
+        dernier = bisect.bisect_left(self.cles, prefixe + "\uffff", premier)
+        meilleurs = {}
+        for ordre, rang in self.ordres[premier:dernier]:
+            if ordre < meilleurs.get(rang, 2):
+                meilleurs[rang] = ordre
+        rangs = sorted(meilleurs, key=lambda rang: (meilleurs[rang], rang))[:limite]
+        return [self.communes[rang] for rang in rangs]
+
+
+def creer_table(conn):
+    conn.execute(CREATE_TABLE)
+    indexes.creer_index_codes_postaux(conn)
+
+
+# Nombre de ventes (toutes natures) par année, commune et code postal, en agrégats partiels
+# d'un bloc de ventes (agregation.Agregats)
+CLES = ["annee", "departement_id", "commune_id", "code_postal"]
+
+OPERATIONS = [("nb_ventes", "commune_id", "size")]
+
+
+def partiel(ventes):
+    return agregation.regrouper(ventes[ventes["commune_id"].notna()], CLES, OPERATIONS)
+
+
+def calculer(conn, partiels):
+    lignes = agregation.fusionner(partiels, CLES, OPERATIONS)
+    agregation.ajouter_libelle(conn, lignes, "departement_id", "departements", "code_departement")
+    lignes["commune_id"] = lignes["commune_id"].astype(np.int64)
+    return lignes[["annee", "code_departement", "commune_id", "code_postal", "nb_ventes"]]
+
+
+# Vrai si les codes postaux n'ont jamais été calculés
+def absents(conn):
+    creer_table(conn)
+    return conn.execute("SELECT NOT EXISTS (SELECT 1 FROM communes_codes_postaux)").fetchone()[0] == 1
+
+
+def reconstruire(conn, partiels):
+    creer_table(conn)
+    with conn:
+        conn.execute("DELETE FROM communes_codes_postaux")
+        agregation.inserer(conn, "communes_codes_postaux", calculer(conn, partiels))
+    print("Codes postaux des communes calculés", file=sys.stderr)
+
+
+# Recalcule les partitions (année, département) données à partir des agrégats partiels de
+# leurs ventes
+def mettre_a_jour(conn, partitions, partiels):
+    creer_table(conn)
+    with conn:
+        conn.executemany(
+            "DELETE FROM communes_codes_postaux WHERE code_departement = ? AND annee = ?",
+            [(code_departement, int(annee)) for annee, code_departement in partitions],
+        )
+        agregation.inserer(conn, "communes_codes_postaux", calculer(conn, partiels))
+    print(f"Codes postaux des communes mis à jour pour {len(partitions)} partitions", file=sys.stderr)
+
+
+# Résolveur construit à partir de la base (lue sans modification)
+def charger(conn):
+    communes = [
+        Commune(nom_commune, code_commune, code_departement, sorted(codes_postaux.split(",")) if codes_postaux else [], nb_ventes)
+        for nom_commune, code_commune, code_departement, codes_postaux, nb_ventes in conn.execute(SELECT_COMMUNES)
+    ]
+    departements = [code for (code,) in conn.execute("SELECT code_departement FROM departements WHERE code_departement IS NOT NULL")]
+    return Resolveur(communes, departements)
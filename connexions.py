@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import pysqlite
+
+# Pool de connexions SQLite en lecture seule pour l'API, utilisable à la place de
+# databases.Database (mêmes méthodes fetch_all, fetch_one, fetch_val et iterate) : databases
+# ouvre une connexion aiosqlite, avec son thread, pour chaque requête et ne permet de régler
+# ni la concurrence ni les PRAGMA. Ici, les connexions sont ouvertes une fois (à la demande,
+# la base peut ne pas exister au démarrage) en lecture seule (mode=ro et query_only), avec le
+# fichier projeté en mémoire (mmap_size) : les pages sont partagées par les connexions et les
+# processus au travers du cache du système. La base est en WAL (voir createdb.py), les
+# lectures ne bloquent donc ni les autres lectures ni un chargement en cours. Les requêtes
+# s'exécutent dans un pool de threads de la taille du pool : SQLite relâche le GIL pendant
+# l'exécution et plusieurs requêtes avancent en parallèle.
+
+MMAP_SIZE = 1 << 30  # 1 Go
+CACHE_SIZE = -65536  # 64 Mo de cache de pages par connexion
+# Nombre de lignes lues à la fois par iterate
+TAILLE_PAQUET = 1000
+# Instructions de la machine virtuelle de SQLite entre deux appels du compteur d'instructions
+PAS_INSTRUCTIONS = 100
+
+
+class PoolLecture:
+    def __init__(self, chemin, taille=4, mmap_size=MMAP_SIZE):
+        self.chemin = chemin
+        self.taille = taille
+        self.mmap_size = mmap_size
+        # Même compilation des requêtes SQLAlchemy que databases
+        self.dialecte = pysqlite.dialect(paramstyle="qmark")
+        self.dialecte.supports_native_decimal = False
+        self.connexions = []
+        # Connexions ouvertes ou en cours d'ouverture : la place est réservée avant d'attendre
+        # l'ouverture, pour que des requêtes simultanées n'ouvrent pas plus de taille connexions
+        self.ouvertes = 0
+        self.libres = None
+        self.executeur = None
+        # Fonction appelée avec le nombre d'instructions exécutées par SQLite pour chaque requête
+        # (à PAS_INSTRUCTIONS près), dans le contexte de la requête (voir metriques.py)
+        self.compter_instructions = None
+
+    async def connect(self):
+        self.libres = asyncio.Queue()
+        self.executeur = ThreadPoolExecutor(max_workers=self.taille, thread_name_prefix="sqlite-lecture")
+
+    async def disconnect(self):
+        self.executeur.shutdown(wait=True)
+        for conn in self.connexions:
+            conn.close()
+        self.connexions = []
+        self.ouvertes = 0
+
+    def ouvrir(self):
+        conn = sqlite3.connect(f"file:{self.chemin}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    # Les fonctions exécutées dans le pool de threads gardent le contexte de la requête
+    def executer(self, fonction, *args):
+        contexte = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(self.executeur, contexte.run, fonction, *args)
+
+    # Connexion libre, ou nouvelle connexion tant que le pool n'est pas plein
+    async def acquerir(self):
+        if self.libres.empty() and self.ouvertes < self.taille:
+            self.ouvertes += 1
+            try:
+                conn = await self.executer(self.ouvrir)
+            except BaseException:
+                self.ouvertes -= 1
+                raise
+            self.connexions.append(conn)
+            return conn
+        return await self.libres.get()
+
+    def liberer(self, conn):
+        self.libres.put_nowait(conn)
+
+    # Compte les instructions exécutées sur la connexion jusqu'à fin_suivi
+    def suivre(self, conn):
+        if self.compter_instructions is None:
+            return None
+        compteur = [0]
+
+        def progression():
+            compteur[0] += 1
+            return 0
+
+        conn.set_progress_handler(progression, PAS_INSTRUCTIONS)
+        return compteur
+
+    def fin_suivi(self, conn, compteur):
+        if compteur is not None:
+            conn.set_progress_handler(None, PAS_INSTRUCTIONS)
+            self.compter_instructions(compteur[0] * PAS_INSTRUCTIONS)
+
+    def compiler(self, requete):
+        if isinstance(requete, str):
+            requete = text(requete)
+        compilee = requete.compile(dialect=self.dialecte, compile_kwargs={"render_postcompile": True})
+        valeurs = compilee.construct_params()
+        parametres = []
+        for nom in compilee.positiontup:
+            conversion = compilee._bind_processors.get(nom)
+            parametres.append(conversion(valeurs[nom]) if conversion else valeurs[nom])
+        return compilee.string, parametres
+
+    async def lire(self, requete, lecture):
+        sql, parametres = self.compiler(requete)
+        conn = await self.acquerir()
+
+        def lecture_suivie():
+            compteur = self.suivre(conn)
+            try:
+                return lecture(conn.execute(sql, parametres))
+            finally:
+                self.fin_suivi(conn, compteur)
+
+        try:
+            return await self.executer(lecture_suivie)
+        finally:
+            self.liberer(conn)
+
+    async def fetch_all(self, requete):
+        return await self.lire(requete, sqlite3.Cursor.fetchall)
+
+    async def fetch_one(self, requete):
+        return await self.lire(requete, sqlite3.Cursor.fetchone)
+
+    async def fetch_val(self, requete):
+        ligne = await self.fetch_one(requete)
+        return None if ligne is None else ligne[0]
+
+    # Lignes lues par paquets, la connexion restant réservée jusqu'à la fin du parcours
+    async def iterate(self, requete):
+        sql, parametres = self.compiler(requete)
+        conn = await self.acquerir()
+        compteur = self.suivre(conn)
+        try:
+            curseur = await self.executer(conn.execute, sql, parametres)
+            try:
+                while True:
+                    lignes = await self.executer(curseur.fetchmany, TAILLE_PAQUET)
+                    if not lignes:
+                        break
+                    for ligne in lignes:
+                        yield ligne
+            finally:
+                curseur.close()
+        finally:
+            self.fin_suivi(conn, compteur)
+            self.liberer(conn)
@@ -1,71 +1,608 @@
-import sqlite3
+import argparse
+import contextlib
 import csv
+import datetime
+import gc
+import gzip
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
 
-# Chemin vers le fichier CSV
+import agregation
+import communes
+import indexes
+import quantiles
+import robustes
+import rollups
+import schema
+import series
+import spatial
+
+# Chemin vers le fichier CSV (le fichier full.csv.gz de geo-dvf peut être donné directement)
 csv_file = "data.csv"
 
 # Chemin vers la base de données SQLite
 db_file = "dvf.db"
 
-# Connexion à la base de données SQLite
-conn = sqlite3.connect(db_file)
-cursor = conn.cursor()
-
-
-# Création de la table dans la base de données SQLite
-cursor.execute('''CREATE TABLE IF NOT EXISTS dvf (
-                    id_mutation TEXT,
-                    date_mutation TEXT,
-                    numero_disposition TEXT,
-                    nature_mutation TEXT,
-                    valeur_fonciere INTEGER,
-                    adresse_numero TEXT,
-                    adresse_suffixe TEXT,
-                    adresse_nom_voie TEXT,
-                    adresse_code_voie TEXT,
-                    code_postal TEXT,
-                    code_commune TEXT,
-                    nom_commune TEXT,
-                    code_departement TEXT,
-                    ancien_code_commune TEXT,
-                    ancien_nom_commune TEXT,
-                    id_parcelle TEXT,
-                    ancien_id_parcelle TEXT,
-                    numero_volume TEXT,
-                    lot1_numero TEXT,
-                    lot1_surface_carrez TEXT,
-                    lot2_numero TEXT,
-                    lot2_surface_carrez TEXT,
-                    lot3_numero TEXT,
-                    lot3_surface_carrez TEXT,
-                    lot4_numero TEXT,
-                    lot4_surface_carrez TEXT,
-                    lot5_numero TEXT,
-                    lot5_surface_carrez TEXT,
-                    nombre_lots INTEGER,
-                    code_type_local TEXT,
-                    type_local TEXT,
-                    surface_reelle_bati INTEGER,
-                    nombre_pieces_principales INTEGER,
-                    code_nature_culture TEXT,
-                    nature_culture TEXT,
-                    code_nature_culture_speciale TEXT,
-                    nature_culture_speciale TEXT,
-                    surface_terrain INTEGER,
-                    longitude REAL,
-                    latitude REAL,
-                    CONSTRAINT unique_row UNIQUE (id_mutation, date_mutation, numero_disposition)
-                )''')
-
-# Lecture du fichier CSV et insertion des données dans la base de données SQLite
-with open(csv_file, newline='', encoding='utf-8') as csvfile:
-    csvreader = csv.reader(csvfile, delimiter=',')
-    next(csvreader)  # Skip header row
-    for row in csvreader:
-        cursor.execute('''INSERT OR IGNORE INTO dvf VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', row)
-
-# Commit des changements et fermeture de la connexion
-conn.commit()
-conn.close()
-
-print("La base de données SQLite a été créée avec succès à partir du fichier CSV, en excluant les valeurs en double.")
+# Nombre de lignes insérées par executemany / par transaction
+TAILLE_LOT = 50_000
+
+NOMS_COLONNES = schema.NOMS_COLONNES
+
+# Tables calculées à partir des agrégats partiels des ventes (agregation.py) ; la grille
+# spatiale l'est aussi, avec l'index R*Tree, après les autres agrégats
+TABLES_VENTES = (rollups, series, communes)
+MODULES_VENTES = (*TABLES_VENTES, spatial)
+
+# Colonnes numériques converties à l'ingestion (les valeurs vides ou invalides deviennent NULL)
+COLONNES_REELLES = [nom for nom, type_sql in schema.COLONNES if type_sql == "REAL"]
+COLONNES_ENTIERES = [nom for nom, type_sql in schema.COLONNES if type_sql == "INTEGER"]
+
+# Position des colonnes qui définissent une partition (année, département)
+POSITION_DATE = NOMS_COLONNES.index("date_mutation")
+POSITION_DEPARTEMENT = NOMS_COLONNES.index("code_departement")
+# Colonnes sans lesquelles une ligne n'a pas de partition
+COLONNES_OBLIGATOIRES = ["date_mutation", "code_departement"]
+
+
+# Tables de suivi du chargement incrémental : les fichiers sources déjà chargés et
+# l'empreinte de chaque partition (année, département) qu'ils contiennent
+def creer_tables_suivi(conn):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS sources (
+               chemin TEXT PRIMARY KEY,
+               taille INTEGER,
+               mtime REAL,
+               sha256 TEXT,
+               annees TEXT,
+               nb_lignes INTEGER,
+               charge_le TEXT
+           )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS partitions (
+               annee TEXT,
+               code_departement TEXT,
+               sha256 TEXT,
+               nb_lignes INTEGER,
+               source TEXT,
+               PRIMARY KEY (annee, code_departement)
+           )"""
+    )
+    # Version des données, incrémentée à chaque chargement qui modifie la base (cache de l'API)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (cle TEXT PRIMARY KEY, valeur)")
+
+
+def version_donnees(conn):
+    ligne = conn.execute("SELECT valeur FROM meta WHERE cle = 'version'").fetchone()
+    return ligne[0] if ligne else 0
+
+
+def incrementer_version(conn):
+    conn.execute(
+        "INSERT INTO meta (cle, valeur) VALUES ('version', 1) ON CONFLICT (cle) DO UPDATE SET valeur = valeur + 1"
+    )
+
+
+# Réglages SQLite pour un chargement en masse
+def configurer_chargement(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 Mo
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+# Réglages SQLite pour l'utilisation normale de la base une fois chargée
+def configurer_lecture(conn):
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+# Ouvre un fichier CSV en flux, compressé (.gz) ou non
+def ouvrir_csv(chemin):
+    if str(chemin).endswith(".gz"):
+        return gzip.open(chemin, "rt", newline="", encoding="utf-8")
+    return open(chemin, newline="", encoding="utf-8")
+
+
+# Date AAAA-MM-JJ existante (fromisoformat seul accepte aussi AAAAMMJJ ou 2022-W01-1)
+def date_valide(texte):
+    if not texte or len(texte) != 10 or texte[4] != "-" or texte[7] != "-":
+        return False
+    try:
+        datetime.date.fromisoformat(texte)
+    except ValueError:
+        return False
+    return True
+
+
+# Lit le fichier en flux et renvoie les lignes par lots, dans l'ordre des colonnes de la table.
+# Les lignes sans partition (date AAAA-MM-JJ invalide, département vide) ou au nombre de
+# colonnes incorrect sont écartées et comptées dans progression.rejetees.
+def lire_lots(chemin, taille_lot=TAILLE_LOT, progression=None):
+    with ouvrir_csv(chemin) as fichier:
+        lecteur = csv.reader(fichier, delimiter=",")
+        entete = next(lecteur, [])
+        manquantes = [nom for nom in COLONNES_OBLIGATOIRES if nom not in entete]
+        if manquantes:
+            raise ValueError(f"{chemin} : colonnes obligatoires absentes de l'en-tête : {', '.join(manquantes)}")
+        if entete == NOMS_COLONNES:
+            convertir = None
+        else:
+            # Colonnes dans un autre ordre ou manquantes : on les replace par nom
+            positions = [entete.index(nom) if nom in entete else None for nom in NOMS_COLONNES]
+
+            def convertir(ligne):
+                return [ligne[i] if i is not None and i < len(ligne) else None for i in positions]
+
+        # Les dates distinctes (quelques centaines par fichier) ne sont vérifiées qu'une fois
+        dates = {}
+        lot = []
+        rejetees = 0
+        for ligne in lecteur:
+            if convertir is not None:
+                ligne = convertir(ligne)
+            elif len(ligne) != len(NOMS_COLONNES):
+                rejetees += 1
+                continue
+            date = ligne[POSITION_DATE]
+            valide = dates.get(date)
+            if valide is None:
+                valide = dates[date] = date_valide(date)
+            if not valide or not ligne[POSITION_DEPARTEMENT]:
+                rejetees += 1
+                continue
+            lot.append(ligne)
+            if len(lot) >= taille_lot:
+                yield lot
+                lot = []
+        if lot:
+            yield lot
+        if progression is not None:
+            progression.rejetees += rejetees
+
+
+NAN = float("nan")
+
+
+def en_reel(valeur):
+    try:
+        return float(valeur)
+    except ValueError:
+        return NAN
+
+
+def en_entier(valeur):
+    try:
+        return int(float(valeur))
+    except (ValueError, OverflowError):
+        return NAN
+
+
+# Conversion d'une colonne entière d'un lot : d'abord en une seule passe, et valeur par
+# valeur seulement si la colonne contient une valeur invalide. Les valeurs vides ou
+# invalides deviennent NaN, que SQLite enregistre comme NULL : un None passe par le
+# mécanisme d'adaptation du module sqlite3 et se lie plusieurs fois plus lentement.
+def convertir_colonne(valeurs, conversion, conversion_sure):
+    try:
+        return [conversion(v) if v else NAN for v in valeurs]
+    except ValueError:
+        return [conversion_sure(v) if v else NAN for v in valeurs]
+
+
+# Dates texte AAAA-MM-JJ d'un lot -> entiers AAAAMMJJ (NaN si vide ou invalide)
+def convertir_dates(valeurs):
+    dates = pd.to_datetime(pd.Series(valeurs, dtype=object), format="%Y-%m-%d", errors="coerce")
+    return (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).tolist()
+
+
+CONVERSIONS = (
+    [(nom, float, en_reel) for nom in COLONNES_REELLES]
+    + [(nom, int, en_entier) for nom in COLONNES_ENTIERES]
+    + [("numero_disposition", int, en_entier)]
+)
+
+
+# Valeur d'une clé de dimension telle qu'enregistrée : chaîne vide ou NaN -> None,
+# identifiant d'une autre dimension en entier
+def valeur_cle(valeur):
+    if valeur is None or valeur == "" or valeur != valeur:
+        return None
+    if isinstance(valeur, float):
+        return int(valeur)
+    return valeur
+
+
+# Table de dimension gardée en mémoire pendant le chargement : clé -> identifiant,
+# les nouvelles entrées sont insérées au fil de l'eau
+class Dimension:
+    def __init__(self, conn, table):
+        self.conn = conn
+        self.table = table
+        self.colonnes = schema.DIMENSIONS[table]
+        self.ids = {
+            tuple(ligne[1:]): ligne[0]
+            for ligne in conn.execute(f"SELECT id, {', '.join(self.colonnes)} FROM {table}")
+        }
+
+    # Identifiants (NaN pour une clé toute vide) des clés formées par les colonnes d'un lot.
+    # Les clés distinctes du lot sont numérotées par pandas.factorize, colonne après colonne ;
+    # seules ces clés (quelques milliers au plus par lot) sont cherchées dans le dictionnaire.
+    def encoder(self, *colonnes):
+        codes = np.zeros(len(colonnes[0]), dtype=np.int64)
+        for colonne in colonnes:
+            codes_colonne, valeurs = pd.factorize(np.asarray(colonne, dtype=object))
+            codes, _ = pd.factorize(codes * (len(valeurs) + 1) + codes_colonne + 1)
+        _, premieres, codes = np.unique(codes, return_index=True, return_inverse=True)
+        requete = f"INSERT INTO {self.table} ({', '.join(self.colonnes)}) VALUES ({', '.join('?' * len(self.colonnes))})"
+        ids = np.full(len(premieres), np.nan)
+        for rang, ligne in enumerate(premieres):
+            cle = tuple(valeur_cle(colonne[ligne]) for colonne in colonnes)
+            if all(valeur is None for valeur in cle):
+                continue
+            identifiant = self.ids.get(cle)
+            if identifiant is None:
+                identifiant = self.ids[cle] = self.conn.execute(requete, cle).lastrowid
+            ids[rang] = identifiant
+        return ids[codes].tolist()
+
+
+def charger_dimensions(conn):
+    return {table: Dimension(conn, table) for table in schema.DIMENSIONS}
+
+
+# Conversion d'un lot colonne par colonne vers les colonnes de la table mutations : le lot
+# est transposé par numpy (deux fois plus vite que zip(*lot)), chaque colonne numérique ou
+# date est convertie d'un bloc et les libellés sont remplacés par l'identifiant de leur
+# dimension. Les colonnes texte restent telles que lues, les chaînes vides deviennent NULL
+# dans la requête d'insertion (INSERT_MUTATIONS).
+def encoder_lot(lot, dimensions):
+    colonnes = dict(zip(NOMS_COLONNES, np.array(lot, dtype=object).T.tolist()))
+    for nom, conversion, conversion_sure in CONVERSIONS:
+        colonnes[nom] = convertir_colonne(colonnes[nom], conversion, conversion_sure)
+    colonnes["date_mutation"] = convertir_dates(colonnes["date_mutation"])
+    colonnes["departement_id"] = dimensions["departements"].encoder(colonnes["code_departement"])
+    for table, cles in schema.DIMENSIONS.items():
+        if table != "departements":
+            colonnes[schema.REFERENCES[table]] = dimensions[table].encoder(*(colonnes[nom] for nom in cles))
+    return colonnes
+
+
+INSERT_MUTATIONS = "INSERT INTO mutations ({}) VALUES ({}) ON CONFLICT DO NOTHING".format(
+    ", ".join(schema.NOMS_MUTATIONS),
+    ", ".join("NULLIF(?, '')" if type_sql == "TEXT" else "?" for _, type_sql in schema.COLONNES_MUTATIONS)
+)
+
+
+def base_vide(conn):
+    return conn.execute("SELECT NOT EXISTS (SELECT 1 FROM mutations)").fetchone()[0] == 1
+
+
+# Doublons d'un chargement en masse, inséré sans la clé unique : comme avec ON CONFLICT DO
+# NOTHING, seule la première ligne lue (plus petit id) de chaque clé est gardée. Une clé
+# avec une valeur NULL n'a jamais de doublon, comme pour l'index unique.
+SUPPRIMER_DOUBLONS = """DELETE FROM mutations WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (PARTITION BY id_mutation, date_mutation, numero_disposition ORDER BY id) AS rang
+        FROM mutations
+        WHERE id_mutation IS NOT NULL AND date_mutation IS NOT NULL AND numero_disposition IS NOT NULL
+    )
+    WHERE rang > 1
+)"""
+
+
+# Crée la clé unique après un chargement en masse et renvoie le nombre de doublons supprimés.
+# Le dédoublonnage (un tri de toute la table) n'est fait que si la création échoue.
+def creer_cle_unique(conn):
+    try:
+        indexes.creer_index_unique(conn)
+        return 0
+    except sqlite3.IntegrityError:
+        doublons = conn.execute(SUPPRIMER_DOUBLONS).rowcount
+        indexes.creer_index_unique(conn)
+        return doublons
+
+
+def vider(conn):
+    conn.execute("DELETE FROM mutations")
+    conn.execute("DELETE FROM sources")
+    conn.execute("DELETE FROM partitions")
+
+
+# Partition (année, département) d'une ligne retenue par lire_lots
+def cle_partition(ligne):
+    return (ligne[POSITION_DATE][:4], ligne[POSITION_DEPARTEMENT])
+
+
+# Empreinte sha256 du contenu d'un fichier, lue par blocs
+def empreinte_fichier(chemin):
+    empreinte = hashlib.sha256()
+    with open(chemin, "rb") as fichier:
+        for bloc in iter(lambda: fichier.read(1 << 20), b""):
+            empreinte.update(bloc)
+    return empreinte.hexdigest()
+
+
+# Empreinte et nombre de lignes de chaque partition (année, département)
+class EmpreintesPartitions:
+    def __init__(self):
+        self.partitions = {}
+
+    # Les lignes d'un lot sont regroupées par partition, puis chaque partition est mise à jour
+    # en une fois avec les mêmes octets que ligne par ligne (valeurs séparées par \x1f, puis \n)
+    def ajouter(self, lot):
+        par_partition = {}
+        for ligne in lot:
+            try:
+                texte = "\x1f".join(ligne)
+            except TypeError:
+                texte = "\x1f".join(v or "" for v in ligne)
+            par_partition.setdefault(cle_partition(ligne), []).append(texte)
+        for cle, lignes in par_partition.items():
+            partition = self.partitions.get(cle)
+            if partition is None:
+                partition = self.partitions[cle] = [hashlib.sha256(), 0]
+            partition[0].update(("\n".join(lignes) + "\n").encode("utf-8"))
+            partition[1] += len(lignes)
+
+    def resultat(self):
+        return {cle: (empreinte.hexdigest(), nb) for cle, (empreinte, nb) in self.partitions.items()}
+
+
+# Suivi du débit de chargement affiché sur la sortie d'erreur
+class Progression:
+    def __init__(self):
+        self.debut = time.perf_counter()
+        self.total = 0
+        self.doublons = 0
+        # Lignes écartées à la lecture, faute de partition valide
+        self.rejetees = 0
+        # Durée de chaque étape du chargement (benchmarks/chargement.py les affiche)
+        self.etapes = {}
+
+    def avancer(self, chemin, nb):
+        self.total += nb
+        duree = time.perf_counter() - self.debut
+        print(f"{chemin} : {self.total} lignes chargées ({self.total / duree:.0f} lignes/s)", file=sys.stderr)
+
+    @contextlib.contextmanager
+    def etape(self, nom):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapes[nom] = self.etapes.get(nom, 0) + time.perf_counter() - debut
+
+
+def supprimer_partition(conn, annee, code_departement):
+    conn.execute(
+        """DELETE FROM mutations
+           WHERE departement_id = (SELECT id FROM departements WHERE code_departement = ?)
+           AND date_mutation BETWEEN ? AND ?""",
+        (code_departement, *schema.bornes_annee(annee)),
+    )
+
+
+# Insère des lots de lignes ; les agrégats partiels des lots insérés sont ajoutés à agregats
+def inserer(conn, lots, chemin, progression, agregats, empreintes=None):
+    dimensions = charger_dimensions(conn)
+    for lot in lots:
+        if empreintes is not None:
+            empreintes.ajouter(lot)
+        colonnes = encoder_lot(lot, dimensions)
+        with conn:
+            inserees = conn.executemany(INSERT_MUTATIONS, zip(*(colonnes[nom] for nom in schema.NOMS_MUTATIONS))).rowcount
+        agregats.ajouter(pd.DataFrame({nom: colonnes[nom] for nom in agregation.COLONNES_VENTES}))
+        progression.doublons += len(lot) - inserees
+        progression.avancer(chemin, len(lot))
+
+
+# Charge un fichier source en ne remplaçant que les partitions qui ont changé depuis
+# le dernier chargement. Renvoie l'ensemble des partitions modifiées ; les empreintes du
+# fichier et de ses partitions sont ajoutées à suivis, pour n'être enregistrées qu'une fois
+# les agrégats recalculés (enregistrer_suivi), et les agrégats partiels des lignes insérées
+# à agregats.
+def charger_fichier(conn, chemin, taille_lot, progression, suivis, agregats):
+    cle_source = os.path.abspath(chemin)
+    infos = os.stat(chemin)
+    connue = conn.execute("SELECT taille, mtime, sha256 FROM sources WHERE chemin = ?", (cle_source,)).fetchone()
+    if connue and connue[0] == infos.st_size and connue[1] == infos.st_mtime:
+        print(f"{chemin} : inchangé depuis le dernier chargement", file=sys.stderr)
+        return set()
+
+    empreinte = empreinte_fichier(chemin)
+    if connue and connue[2] == empreinte:
+        with conn:
+            conn.execute("UPDATE sources SET taille = ?, mtime = ? WHERE chemin = ?", (infos.st_size, infos.st_mtime, cle_source))
+        print(f"{chemin} : contenu inchangé depuis le dernier chargement", file=sys.stderr)
+        return set()
+
+    anciennes = {
+        (annee, code_departement): sha256
+        for annee, code_departement, sha256 in conn.execute(
+            "SELECT annee, code_departement, sha256 FROM partitions WHERE source = ?", (cle_source,)
+        )
+    }
+    if not anciennes:
+        # Nouveau fichier : un seul passage, les empreintes sont calculées pendant l'insertion
+        empreintes = EmpreintesPartitions()
+        inserer(conn, lire_lots(chemin, taille_lot, progression), chemin, progression, agregats, empreintes)
+        partitions = empreintes.resultat()
+        modifiees = set(partitions)
+        supprimees = set()
+    else:
+        # Fichier déjà chargé mais modifié : un premier passage calcule les empreintes des
+        # partitions, le second ne réinsère que les partitions qui ont changé
+        empreintes = EmpreintesPartitions()
+        for lot in lire_lots(chemin, taille_lot, progression):
+            empreintes.ajouter(lot)
+        partitions = empreintes.resultat()
+        modifiees = {cle for cle, (sha256, _) in partitions.items() if anciennes.get(cle) != sha256}
+        supprimees = set(anciennes) - set(partitions)
+        print(f"{chemin} : {len(modifiees)} partitions modifiées, {len(supprimees)} supprimées sur {len(partitions)}", file=sys.stderr)
+        with conn:
+            for annee, code_departement in modifiees | supprimees:
+                supprimer_partition(conn, annee, code_departement)
+        if modifiees:
+            lots = (
+                [ligne for ligne in lot if cle_partition(ligne) in modifiees]
+                for lot in lire_lots(chemin, taille_lot)
+            )
+            inserer(conn, (lot for lot in lots if lot), chemin, progression, agregats)
+
+    suivis.append((cle_source, infos, empreinte, partitions, modifiees, supprimees))
+    return modifiees | supprimees
+
+
+# Enregistre les empreintes d'un fichier chargé et de ses partitions modifiées. Tant qu'elles
+# ne le sont pas, le fichier est rechargé à la relance : un chargement interrompu avant la
+# fin du calcul des agrégats n'est pas pris pour un fichier inchangé.
+def enregistrer_suivi(conn, cle_source, infos, empreinte, partitions, modifiees, supprimees):
+    conn.executemany("DELETE FROM partitions WHERE annee = ? AND code_departement = ?", sorted(supprimees))
+    conn.executemany(
+        "INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?, ?)",
+        [(annee, code_departement, sha256, nb, cle_source) for (annee, code_departement), (sha256, nb) in partitions.items() if (annee, code_departement) in modifiees],
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            cle_source,
+            infos.st_size,
+            infos.st_mtime,
+            empreinte,
+            ",".join(sorted({annee for annee, _ in partitions})),
+            sum(nb for _, nb in partitions.values()),
+            datetime.datetime.now().isoformat(timespec="seconds"),
+        ),
+    )
+
+
+# Chargement d'un ou plusieurs fichiers. Sur une base vide, l'insertion se fait en masse
+# sans aucun index, construits après le chargement ; les doublons sont alors supprimés avant
+# la création de la clé unique. Sur une base déjà remplie, seules les partitions modifiées
+# sont remplacées, avec les index en place, et les doublons écartés dès l'insertion.
+def charger(conn, chemins, taille_lot=TAILLE_LOT, complet=False, progression=None):
+    progression = progression or Progression()
+    schema.creer_schema(conn)
+    creer_tables_suivi(conn)
+    configurer_chargement(conn)
+    if complet:
+        spatial.supprimer(conn)
+        vider(conn)
+    en_masse = base_vide(conn)
+    if en_masse:
+        indexes.supprimer_index(conn)
+        spatial.supprimer(conn)
+    else:
+        # Base migrée ou index supprimés : l'index unique doit exister pour ignorer les doublons
+        indexes.creer_index(conn)
+    conn.commit()
+
+    # Les lots lus ne forment pas de cycles : le ramasse-miettes, que les millions de listes
+    # créées déclenchent sans cesse, est suspendu pendant la lecture des fichiers
+    ramasse_miettes = gc.isenabled()
+    gc.disable()
+    modifiees = set()
+    suivis = []
+    agregats = agregation.Agregats(MODULES_VENTES)
+    try:
+        with progression.etape("lignes"):
+            for chemin in chemins:
+                modifiees |= charger_fichier(conn, chemin, taille_lot, progression, suivis, agregats)
+    finally:
+        if ramasse_miettes:
+            gc.enable()
+    if en_masse:
+        with progression.etape("lignes"), conn:
+            progression.doublons += creer_cle_unique(conn)
+    if progression.doublons:
+        print(f"{progression.doublons} doublons ignorés", file=sys.stderr)
+    if progression.rejetees:
+        print(f"{progression.rejetees} lignes rejetées (date ou département invalide)", file=sys.stderr)
+
+    with progression.etape("index"), conn:
+        indexes.creer_index(conn)
+    # Agrégats par commune, agrégats mensuels des séries temporelles, codes postaux et nombre
+    # de ventes des communes (pour la résolution des lieux par l'API) et grille spatiale :
+    # tous calculés à partir des agrégats partiels des lots insérés, fusionnés. Ils sont
+    # relus dans mutations si des doublons ont été écartés (les lots ne sont plus les lignes
+    # de la table) ou si une table doit être reconstruite après un chargement incrémental.
+    toutes = en_masse or not spatial.existe(conn) or any(module.absents(conn) for module in TABLES_VENTES)
+    if progression.doublons or (toutes and not en_masse):
+        with progression.etape("lecture des ventes"):
+            agregats = agregation.Agregats.lire(conn, MODULES_VENTES, None if toutes else modifiees)
+    with progression.etape("agrégats"):
+        for module in TABLES_VENTES:
+            if toutes:
+                module.reconstruire(conn, agregats.de(module))
+            elif modifiees:
+                module.mettre_a_jour(conn, modifiees, agregats.de(module))
+    # Statistiques robustes (médiane, MAD...) : recalculées pour les départements modifiés
+    with progression.etape("statistiques robustes"):
+        if en_masse or robustes.absentes(conn):
+            robustes.reconstruire(conn)
+        elif modifiees:
+            robustes.mettre_a_jour(conn, modifiees)
+    # t-digests du prix au m², par partition
+    with progression.etape("quantiles"):
+        if en_masse or quantiles.absents(conn):
+            quantiles.reconstruire(conn)
+        elif modifiees:
+            quantiles.mettre_a_jour(conn, modifiees)
+    # Index spatial : l'index R*Tree suit les insertions par triggers, il n'est reconstruit
+    # qu'après un chargement en masse
+    with progression.etape("index spatial"):
+        if toutes:
+            spatial.reconstruire(conn, agregats.de(spatial))
+        elif modifiees:
+            spatial.mettre_a_jour(conn, modifiees, agregats.de(spatial))
+    del agregats
+    # Empreintes et version des données enregistrées ensemble, une fois tous les agrégats à jour
+    with conn:
+        for suivi in suivis:
+            enregistrer_suivi(conn, *suivi)
+        if modifiees or complet:
+            incrementer_version(conn)
+    with progression.etape("ANALYZE"):
+        if modifiees:
+            with conn:
+                indexes.analyser(conn)
+    configurer_lecture(conn)
+
+    duree = time.perf_counter() - progression.debut
+    print(f"{progression.total} lignes chargées en {duree:.1f} s, {len(modifiees)} partitions modifiées", file=sys.stderr)
+    print(", ".join(f"{nom} {duree:.1f} s" for nom, duree in progression.etapes.items()), file=sys.stderr)
+    return modifiees
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Création de la base SQLite à partir des fichiers DVF")
+    parser.add_argument("fichiers", nargs="*", default=[csv_file], help="Fichiers CSV DVF (.csv ou .csv.gz)")
+    parser.add_argument("--db", default=db_file, help="Chemin de la base SQLite")
+    parser.add_argument("--taille-lot", type=int, default=TAILLE_LOT, help="Nombre de lignes par lot d'insertion")
+    parser.add_argument("--complet", action="store_true", help="Vide la base et recharge tous les fichiers")
+    parser.add_argument("--parquet", metavar="DOSSIER", help="Écrit aussi les données en Parquet par année et département (moteur en colonnes de l'API)")
+    args = parser.parse_args()
+
+    # Connexion à la base de données SQLite
+    conn = sqlite3.connect(args.db)
+    try:
+        modifiees = charger(conn, args.fichiers, args.taille_lot, args.complet)
+        if args.parquet:
+            # pyarrow et duckdb ne sont nécessaires qu'avec cette option
+            import colonnes
+
+            colonnes.mettre_a_jour(conn, args.parquet, None if args.complet else modifiees)
+    finally:
+        conn.close()
+
+    print("La base de données SQLite a été créée avec succès à partir du fichier CSV, en excluant les valeurs en double.")
+
+
+if __name__ == "__main__":
+    main()
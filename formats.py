@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+
+import schema
+
+# Encodage en flux des lignes renvoyées par la base (itérateur asynchrone d'enregistrements)
+# pour les réponses volumineuses : liste JSON, NDJSON, CSV ou flux Arrow IPC. Les lignes sont
+# regroupées par paquets de TAILLE_PAQUET pour limiter le nombre d'écritures.
+
+TAILLE_PAQUET = 1000
+
+TYPES_CONTENU = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+TYPES_COLONNES = dict(schema.COLONNES)
+
+
+async def paquets(lignes, taille=TAILLE_PAQUET):
+    paquet = []
+    async for ligne in lignes:
+        paquet.append(ligne)
+        if len(paquet) >= taille:
+            yield paquet
+            paquet = []
+    if paquet:
+        yield paquet
+
+
+# Même encodage que les réponses JSON de FastAPI
+def en_json(ligne, colonnes):
+    return json.dumps({nom: ligne[nom] for nom in colonnes}, ensure_ascii=False, separators=(",", ":"))
+
+
+async def liste_json(lignes, colonnes):
+    premier = True
+    yield "["
+    async for paquet in paquets(lignes):
+        morceau = ",".join(en_json(ligne, colonnes) for ligne in paquet)
+        yield morceau if premier else "," + morceau
+        premier = False
+    yield "]"
+
+
+async def ndjson(lignes, colonnes):
+    async for paquet in paquets(lignes):
+        yield "".join(en_json(ligne, colonnes) + "\n" for ligne in paquet)
+
+
+async def en_csv(lignes, colonnes):
+    tampon = io.StringIO()
+    ecrivain = csv.writer(tampon)
+    ecrivain.writerow(colonnes)
+    async for paquet in paquets(lignes):
+        ecrivain.writerows([ligne[nom] for nom in colonnes] for ligne in paquet)
+        yield vider(tampon)
+    if tampon.tell():
+        yield vider(tampon)
+
+
+# Flux Arrow IPC : le schéma puis un lot d'enregistrements par paquet de lignes
+async def arrow(lignes, colonnes):
+    import pyarrow as pa
+
+    types = {"TEXT": pa.string(), "REAL": pa.float64(), "INTEGER": pa.int64()}
+    schema_arrow = pa.schema([(nom, types[TYPES_COLONNES[nom]]) for nom in colonnes])
+    tampon = io.BytesIO()
+    ecrivain = pa.ipc.new_stream(tampon, schema_arrow)
+    async for paquet in paquets(lignes):
+        valeurs = [pa.array([ligne[nom] for ligne in paquet], type=schema_arrow.field(nom).type) for nom in colonnes]
+        ecrivain.write_batch(pa.record_batch(valeurs, schema=schema_arrow))
+        yield vider(tampon)
+    ecrivain.close()
+    yield vider(tampon)
+
+
+def vider(tampon):
+    contenu = tampon.getvalue()
+    tampon.seek(0)
+    tampon.truncate()
+    return contenu
+
+
+# Vrai si le format peut être produit (pyarrow est optionnel)
+def disponible(format_sortie):
+    if format_sortie != "arrow":
+        return True
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+ENCODEURS = {"json": liste_json, "ndjson": ndjson, "csv": en_csv, "arrow": arrow}
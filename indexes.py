@@ -0,0 +1,180 @@
+import argparse
+import re
+import sqlite3
+import sys
+
+# Index de la table mutations. La clé de dédoublonnage ; l'index par département et date,
+# pour le remplacement d'une partition ; l'index par commune, type de local et date, qui se
+# termine implicitement par id et donne donc les ventes d'une commune dans l'ordre de
+# pagination de /maisons-par-commune/ (date, id), sans tri. Les moyennes
+# sont lues dans dvf_stats : les requêtes sur mutations, seulement tant que les agrégats ne
+# sont pas calculés, passent par ces deux derniers index puis lisent les lignes (des index
+# couvrants les éviteraient, pour environ un cinquième de la taille de la base).
+INDEX_MUTATIONS = {
+    "unique_row": "CREATE UNIQUE INDEX IF NOT EXISTS unique_row ON mutations (id_mutation, date_mutation, numero_disposition)",
+    "idx_mutations_partition": "CREATE INDEX IF NOT EXISTS idx_mutations_partition ON mutations (departement_id, date_mutation)",
+    "idx_mutations_commune_type_date": "CREATE INDEX IF NOT EXISTS idx_mutations_commune_type_date ON mutations (commune_id, type_local_id, date_mutation)",
+}
+
+# Index de la table d'agrégats dvf_stats ; le remplacement d'une partition passe par l'index
+# par département
+INDEX_STATS = {
+    "idx_dvf_stats_commune": "CREATE INDEX IF NOT EXISTS idx_dvf_stats_commune ON dvf_stats (nom_commune, type_local, nature_mutation)",
+    "idx_dvf_stats_departement": "CREATE INDEX IF NOT EXISTS idx_dvf_stats_departement ON dvf_stats (code_departement, type_local, nature_mutation)",
+}
+
+# Index de la table des statistiques robustes dvf_robuste
+INDEX_ROBUSTE = {
+    "idx_dvf_robuste_lieu": "CREATE INDEX IF NOT EXISTS idx_dvf_robuste_lieu ON dvf_robuste (lieu, type_local)",
+    "idx_dvf_robuste_departement": "CREATE INDEX IF NOT EXISTS idx_dvf_robuste_departement ON dvf_robuste (code_departement)",
+}
+
+# Index de la table des t-digests dvf_quantiles
+INDEX_QUANTILES = {
+    "idx_dvf_quantiles_lieu": "CREATE INDEX IF NOT EXISTS idx_dvf_quantiles_lieu ON dvf_quantiles (lieu, type_local, annee)",
+    "idx_dvf_quantiles_partition": "CREATE INDEX IF NOT EXISTS idx_dvf_quantiles_partition ON dvf_quantiles (code_departement, annee)",
+}
+
+# Index des agrégats mensuels dvf_mensuel
+INDEX_MENSUEL = {
+    "idx_dvf_mensuel_lieu": "CREATE INDEX IF NOT EXISTS idx_dvf_mensuel_lieu ON dvf_mensuel (lieu, type_local, mois)",
+    "idx_dvf_mensuel_partition": "CREATE INDEX IF NOT EXISTS idx_dvf_mensuel_partition ON dvf_mensuel (code_departement, mois)",
+}
+
+# Index de la table des codes postaux des communes (voir communes.py)
+INDEX_CODES_POSTAUX = {
+    "idx_communes_codes_postaux_partition": "CREATE INDEX IF NOT EXISTS idx_communes_codes_postaux_partition ON communes_codes_postaux (code_departement, annee)",
+}
+
+# Index des versions précédentes, supprimés à la création des index
+ANCIENS_INDEX = [
+    "idx_dvf_commune",
+    "idx_dvf_departement",
+    "idx_dvf_commune_couvrant",
+    "idx_dvf_departement_couvrant",
+    "idx_mutations_commune_couvrant",
+    "idx_mutations_departement_couvrant",
+    "idx_mutations_commune_date",
+    "idx_dvf_stats_partition",
+]
+
+# Tables sur lesquelles un parcours complet est refusé
+TABLES_SURVEILLEES = {"mutations", "communes", "dvf_stats", "dvf_robuste", "dvf_quantiles", "dvf_grille", "dvf_mensuel"}
+
+
+class ScanComplet(Exception):
+    pass
+
+
+# Index supprimés avant un chargement en masse puis reconstruits d'un bloc, clé de
+# dédoublonnage comprise (createdb.creer_cle_unique écarte les doublons avant de la créer)
+def supprimer_index(conn):
+    for nom in list(INDEX_MUTATIONS) + ANCIENS_INDEX:
+        conn.execute(f"DROP INDEX IF EXISTS {nom}")
+
+
+def creer_index_unique(conn):
+    conn.execute(INDEX_MUTATIONS["unique_row"])
+
+
+def creer_index(conn):
+    for nom in ANCIENS_INDEX:
+        conn.execute(f"DROP INDEX IF EXISTS {nom}")
+    for requete in INDEX_MUTATIONS.values():
+        conn.execute(requete)
+
+
+def creer_index_stats(conn):
+    for requete in INDEX_STATS.values():
+        conn.execute(requete)
+
+
+def creer_index_robuste(conn):
+    for requete in INDEX_ROBUSTE.values():
+        conn.execute(requete)
+
+
+def creer_index_quantiles(conn):
+    for requete in INDEX_QUANTILES.values():
+        conn.execute(requete)
+
+
+def creer_index_mensuel(conn):
+    for requete in INDEX_MENSUEL.values():
+        conn.execute(requete)
+
+
+def creer_index_codes_postaux(conn):
+    for requete in INDEX_CODES_POSTAUX.values():
+        conn.execute(requete)
+
+
+# Vrai si un des index de mutations n'existe pas (base créée par une version précédente)
+def index_manquants(conn):
+    existants = {nom for (nom,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return sorted(set(INDEX_MUTATIONS) - existants)
+
+
+# Statistiques utilisées par le planificateur de requêtes de SQLite
+def analyser(conn):
+    conn.execute("ANALYZE")
+
+
+def plan(conn, requete):
+    return [detail for _, _, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {requete}")]
+
+
+# Renvoie les étapes du plan qui parcourent entièrement une table surveillée
+# (« SCAN mutations », y compris le parcours complet d'un index)
+def scans_complets(conn, requete):
+    scans = []
+    for detail in plan(conn, requete):
+        trouve = re.match(r"SCAN (\w+)", detail)
+        if trouve and trouve.group(1) in TABLES_SURVEILLEES:
+            scans.append(detail)
+    return scans
+
+
+# Vérifie le plan de chaque requête (nom -> SQL) et lève ScanComplet si une
+# d'entre elles parcourt une table entière
+def verifier_plans(conn, requetes):
+    erreurs = []
+    for nom, requete in requetes.items():
+        for detail in scans_complets(conn, requete):
+            erreurs.append(f"{nom} : {detail}")
+    if erreurs:
+        raise ScanComplet("Parcours complets détectés :\n" + "\n".join(erreurs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Création des index et vérification des plans de requêtes de l'API")
+    parser.add_argument("--db", default="dvf.db", help="Chemin de la base SQLite")
+    parser.add_argument("--creer", action="store_true", help="Crée les index manquants et lance ANALYZE avant la vérification")
+    args = parser.parse_args()
+
+    # Les requêtes vérifiées sont celles construites par les endpoints de l'API
+    from main import requetes_endpoints
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.creer:
+            with conn:
+                creer_index(conn)
+                creer_index_stats(conn)
+                analyser(conn)
+        requetes = requetes_endpoints()
+        for nom, requete in requetes.items():
+            print(f"{nom} :")
+            for detail in plan(conn, requete):
+                print(f"    {detail}")
+        verifier_plans(conn, requetes)
+    except ScanComplet as erreur:
+        print(erreur, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+    print("Aucun parcours complet de table.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,37 @@
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlmodel import Field, SQLModel, create_engine, Session, select, func
 from databases import DatabaseURL, Database
-import csv
+from sqlalchemy import join, or_, tuple_
+from sqlalchemy.dialects import sqlite as dialecte_sqlite
+import asyncio
+import base64
+import binascii
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
 from pathlib import Path
 from fastapi.middleware.cors import CORSMiddleware
+import agregation
+import cache
+import communes
+import connexions
+import createdb
+import formats
+import indexes
+import metriques
+import quantiles
+import robustes
+import rollups
+import schema
+import series
+import spatial
 
-# Définition du modèle SQLModel pour les données DVF
+# Définition du modèle SQLModel pour les données DVF : la vue dvf de schema.py, qui
+# reconstitue les colonnes des fichiers DVF à partir de la table mutations
 class Dvf(SQLModel, table=True):
     id_mutation: str = Field(primary_key=True)
     date_mutation: str
@@ -47,362 +73,1068 @@ class Dvf(SQLModel, table=True):
     surface_terrain: float
     longitude: float
     latitude: float
+    # Colonnes techniques de la vue (clés entières de mutations), absentes des réponses
+    commune_id: int
+    type_local_id: int
+    date_mutation_entier: int
+    id: int
+
+# Modèles de la table mutations (seulement les colonnes lues par l'API) et des tables de
+# dimension, utilisés quand les agrégats ne sont pas encore calculés
+class Mutation(SQLModel, table=True):
+    __tablename__ = "mutations"
+    id: int = Field(primary_key=True)
+    id_mutation: str
+    date_mutation: int
+    numero_disposition: int
+    nature_mutation_id: int
+    valeur_fonciere: float
+    commune_id: int
+    departement_id: int
+    type_local_id: int
+    surface_reelle_bati: float
+    surface_terrain: float
+    longitude: float
+    latitude: float
+
+class Commune(SQLModel, table=True):
+    __tablename__ = "communes"
+    id: int = Field(primary_key=True)
+    code_commune: str
+    nom_commune: str
+    departement_id: int
+
+class Departement(SQLModel, table=True):
+    __tablename__ = "departements"
+    id: int = Field(primary_key=True)
+    code_departement: str
+
+class NatureMutation(SQLModel, table=True):
+    __tablename__ = "natures_mutation"
+    id: int = Field(primary_key=True)
+    nature_mutation: str
+
+class TypeLocal(SQLModel, table=True):
+    __tablename__ = "types_local"
+    id: int = Field(primary_key=True)
+    code_type_local: str
+    type_local: str
+
+# Modèle des agrégats précalculés à l'ingestion (voir rollups.py)
+class DvfStats(SQLModel, table=True):
+    __tablename__ = "dvf_stats"
+    annee: int = Field(primary_key=True)
+    code_departement: str = Field(primary_key=True)
+    code_commune: str = Field(primary_key=True)
+    nom_commune: str
+    type_local: str = Field(primary_key=True)
+    nature_mutation: str = Field(primary_key=True)
+    nb_lignes: int
+    nb_prix_m2: int
+    somme_prix_m2: float
+    somme_carres_prix_m2: float
+    min_prix_m2: float
+    max_prix_m2: float
+    nb_surface: int
+    somme_surface: float
+    nb_terrain: int
+    somme_terrain: float
+
+# Modèle des statistiques robustes du prix au m² (voir robustes.py). type_local vaut None
+# pour la ligne tous types confondus, code_commune pour les lignes de département ; une
+# commune peut avoir une ligne par département.
+class DvfRobuste(SQLModel, table=True):
+    __tablename__ = "dvf_robuste"
+    code_departement: str = Field(primary_key=True)
+    code_commune: str = Field(primary_key=True)
+    lieu: str = Field(primary_key=True)
+    type_local: str = Field(primary_key=True)
+    nb_prix_m2: int
+    moyenne: float
+    mediane: float
+    mad: float
+    moyenne_tronquee: float
+    moyenne_filtree: float
+    nb_exclus: int
+
+# Modèle des t-digests du prix au m² par année, lieu et type de local (voir quantiles.py)
+class DvfQuantiles(SQLModel, table=True):
+    __tablename__ = "dvf_quantiles"
+    annee: int = Field(primary_key=True)
+    code_departement: str = Field(primary_key=True)
+    lieu: str = Field(primary_key=True)
+    type_local: str = Field(primary_key=True)
+    nb_prix_m2: int
+    digest: bytes
+
+# Modèle des agrégats mensuels par lieu et type de local (voir series.py)
+class DvfMensuel(SQLModel, table=True):
+    __tablename__ = "dvf_mensuel"
+    code_departement: str
+    lieu: str = Field(primary_key=True)
+    type_local: str = Field(primary_key=True)
+    mois: int = Field(primary_key=True)
+    nb_ventes: int
+    nb_prix_m2: int
+    somme_prix_m2: float
+    somme_valeur: float
+    somme_surface: float
+
+# Modèles de l'index spatial (voir spatial.py) : table R*Tree des coordonnées des ventes
+# (id = id de mutations) et agrégats par case de la grille des tuiles de carte
+class MutationRtree(SQLModel, table=True):
+    __tablename__ = "mutations_rtree"
+    id: int = Field(primary_key=True)
+    min_lon: float
+    max_lon: float
+    min_lat: float
+    max_lat: float
+
+class DvfGrille(SQLModel, table=True):
+    __tablename__ = "dvf_grille"
+    zoom: int = Field(primary_key=True)
+    x: int = Field(primary_key=True)
+    y: int = Field(primary_key=True)
+    annee: int = Field(primary_key=True)
+    code_departement: str = Field(primary_key=True)
+    nb_prix_m2: int
+    somme_prix_m2: float
+
+NATURES_VENTE = schema.NATURES_VENTE
+
+# Nombre maximal de lieux par clause IN (limite de paramètres de SQLite)
+TAILLE_IN = 500
 
 # Configuration de la base de données
 DATABASE_URL = "sqlite:///./dvf.db"
-database = Database(DATABASE_URL)
+DB_FILE = "dvf.db"
+CSV_FILE = "donnees_dvf.csv"
+
+# Connexions à la base : DVF_CONNEXIONS=0 (par défaut) passe par databases ; au-delà, pool de
+# DVF_CONNEXIONS connexions SQLite en lecture seule (voir connexions.py)
+CONNEXIONS = int(os.environ.get("DVF_CONNEXIONS", 0))
+if CONNEXIONS > 0:
+    database = connexions.PoolLecture(DB_FILE, CONNEXIONS)
+else:
+    database = Database(DATABASE_URL)
+
+# Mesures par requête exposées par /metrics (voir metriques.py), DVF_METRIQUES=0 pour les désactiver
+METRIQUES = os.environ.get("DVF_METRIQUES", "1") == "1"
+mesures_api = metriques.Metriques()
+if METRIQUES:
+    database = metriques.BaseMesuree(database)
+
+# Positionnée par serve.py, qui charge et prépare la base une seule fois avant de lancer les
+# workers : chaque worker l'ouvre alors sans la modifier
+BASE_PREPAREE = os.environ.get("DVF_BASE_PREPAREE") == "1"
+
+# Moteur des endpoints de moyennes : "sqlite" (dvf_stats, ou mutations à défaut) ou "colonnes"
+# (fichiers Parquet par année et département interrogés avec DuckDB, voir colonnes.py)
+BACKEND = os.environ.get("DVF_BACKEND", "sqlite")
+PARQUET_DIR = os.environ.get("DVF_PARQUET", "dvf_parquet")
+if BACKEND not in ("sqlite", "colonnes"):
+    raise ValueError(f"DVF_BACKEND inconnu : {BACKEND} (sqlite ou colonnes)")
+entrepot = None
+if BACKEND == "colonnes":
+    import colonnes
+    entrepot = colonnes.EntrepotColonnes(PARQUET_DIR)
+
+# État du chargement des données au démarrage, exposé par /sante/
+etat_chargement = {"statut": "en attente", "moteur": BACKEND, "partitions_modifiees": 0, "erreur": None, "agregats": False}
+
+# Cache des réponses (voir cache.py) : "memoire" (par défaut), "sqlite" pour un fichier
+# partagé par les workers uvicorn, ou "aucun". Taille maximale en octets, durée de vie en secondes.
+CACHE = os.environ.get("DVF_CACHE", "memoire")
+CACHE_FICHIER = os.environ.get("DVF_CACHE_FICHIER", "cache_reponses.db")
+CACHE_TAILLE = int(os.environ.get("DVF_CACHE_TAILLE", 64 * 1024 * 1024))
+CACHE_TTL = int(os.environ.get("DVF_CACHE_TTL", 3600))
+CACHE_MAX_AGE = int(os.environ.get("DVF_CACHE_MAX_AGE", 60))
+if CACHE not in ("memoire", "sqlite", "aucun"):
+    raise ValueError(f"DVF_CACHE inconnu : {CACHE} (memoire, sqlite ou aucun)")
+
+# Endpoints dont la réponse ne dépend que des paramètres et des données
+CHEMINS_CACHE = [
+    "/prix-moyen-m2-par-ville-maisons/",
+    "/prix-moyen-m2-par-ville-appartement/",
+    "/prix-moyen-m2-par-ville/",
+    "/moyenne-m2-maison-par-commune/",
+    "/moyenne-m2-appartement-par-commune/",
+    "/prix-moyen-m2-par-villes/",
+    "/maisons-par-commune/",
+    "/moyenne-m2-terrain-maison-par-commune/",
+    "/profil-commune/",
+    "/prix-m2-robuste/",
+    "/quantiles-prix-m2/",
+    "/serie-temporelle/",
+    "/prix-moyen-m2-zone/",
+    "/prix-moyen-m2-rayon/",
+    "/carte-chaleur/",
+    "/autocompletion-communes/",
+]
+
+# La version des données est relue dans la table meta au plus une fois par seconde, pour
+# voir un rechargement fait par un autre processus
+VERIFICATION_VERSION = 1.0
+version_lue = {"valeur": None, "lue_le": 0.0}
+
+# Version des données servie par le cache, None tant que le chargement n'est pas terminé
+async def version_donnees():
+    if etat_chargement["statut"] != "ok":
+        return None
+    # Le moteur fait partie de la version : les deux ne donnent pas exactement les mêmes arrondis
+    return f"{BACKEND}-{await version_base()}"
+
+async def version_base():
+    if time.monotonic() - version_lue["lue_le"] > VERIFICATION_VERSION:
+        version = await database.fetch_val("SELECT valeur FROM meta WHERE cle = 'version'")
+        version_lue["valeur"] = version or 0
+        version_lue["lue_le"] = time.monotonic()
+    return version_lue["valeur"]
+
+# Résolveur des lieux demandés (voir communes.py), reconstruit quand la version des données change
+resolution = {"version": None, "resolveur": None}
+verrou_resolution = asyncio.Lock()
+
+def charger_resolveur():
+    conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True)
+    try:
+        return communes.charger(conn)
+    finally:
+        conn.close()
+
+async def resolveur():
+    if etat_chargement["statut"] != "ok":
+        raise HTTPException(status_code=503, detail="Données en cours de chargement")
+    version = await version_base()
+    if resolution["version"] != version:
+        async with verrou_resolution:
+            if resolution["version"] != version:
+                resolution["resolveur"] = await asyncio.to_thread(charger_resolveur)
+                resolution["version"] = version
+    return resolution["resolveur"]
+
+# Lieu canonique d'une saisie (communes.Lieu : commune et son département, ou département),
+# None si inconnu
+async def resoudre(texte):
+    return (await resolveur()).resoudre(texte)
+
+if CACHE == "sqlite":
+    stockage_cache = cache.CacheSQLite(CACHE_FICHIER, CACHE_TAILLE, CACHE_TTL)
+elif CACHE == "memoire":
+    stockage_cache = cache.CacheMemoire(CACHE_TAILLE, CACHE_TTL)
+else:
+    stockage_cache = None
 
 # Création de l'API FastAPI
 app = FastAPI()
 
+# Le cache est ajouté avant CORS pour que les réponses servies depuis le cache reçoivent
+# aussi les en-têtes CORS
+if stockage_cache is not None:
+    app.add_middleware(cache.CacheReponses, stockage=stockage_cache, version=version_donnees, chemins=CHEMINS_CACHE, max_age=CACHE_MAX_AGE)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Curseur-Suivant"],
 )
 
-# Fonction pour se connecter à la base de données
+# Ajoutée en dernier, la mesure englobe les autres middlewares : les réponses servies par le
+# cache sont comptées avec leur durée
+if METRIQUES:
+    app.add_middleware(metriques.MesureRequetes, metriques=mesures_api, routes=app.routes, exclus=["/metrics"])
+
+# Fonction pour se connecter à la base de données. Le chargement du CSV tourne en
+# tâche de fond pour que l'API réponde (notamment /sante/) pendant le chargement.
 @app.on_event("startup")
 async def startup():
     await database.connect()
-    await create_db_if_not_exists()
+    app.state.chargement = asyncio.create_task(create_db_if_not_exists())
 
 # Fonction pour se déconnecter de la base de données
 @app.on_event("shutdown")
 async def shutdown():
     await database.disconnect()
 
-# Fonction pour créer la base de données et insérer les données du CSV si elle n'existe pas déjà
+# Fonction pour créer la base de données et insérer les données du CSV. Le chargement est
+# incrémental : un CSV déjà chargé et inchangé ne coûte qu'un stat du fichier.
 async def create_db_if_not_exists():
-    db_path = Path("dvf.db")
-    if not db_path.exists():
-        async with database.transaction():
-            await database.execute("CREATE TABLE IF NOT EXISTS dvf (id_mutation TEXT PRIMARY KEY, date_mutation TEXT, numero_disposition TEXT, nature_mutation TEXT, valeur_fonciere REAL, adresse_numero TEXT, adresse_suffixe TEXT, adresse_nom_voie TEXT, adresse_code_voie TEXT, code_postal TEXT, code_commune TEXT, nom_commune TEXT, code_departement TEXT, ancien_code_commune TEXT, ancien_nom_commune TEXT, id_parcelle TEXT, ancien_id_parcelle TEXT, numero_volume TEXT, lot1_numero TEXT, lot1_surface_carrez REAL, lot2_numero TEXT, lot2_surface_carrez REAL, lot3_numero TEXT, lot3_surface_carrez REAL, lot4_numero TEXT, lot4_surface_carrez REAL, lot5_numero TEXT, lot5_surface_carrez REAL, nombre_lots INTEGER, code_type_local TEXT, type_local TEXT, surface_reelle_bati REAL, nombre_pieces_principales INTEGER, code_nature_culture TEXT, nature_culture TEXT, code_nature_culture_speciale TEXT, nature_culture_speciale TEXT, surface_terrain REAL, longitude REAL, latitude REAL)")
-            await insert_data_from_csv()
-
-# Fonction pour insérer les données du CSV dans la base de données
-async def insert_data_from_csv():
-    with open('donnees_dvf.csv', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        reader = csv.DictReader(csvfile)
-        async with database.transaction():
-            for row in reader:
-                query_values = {}
-                for key, value in row.items():
-                    # Vérifie si la valeur est vide et la remplace par None
-                    if value == "":
-                        query_values[key] = None
-                    else:
-                        query_values[key] = value
-
-                    # Si la colonne n'est pas présente dans le fichier CSV, insère None
-                    if key not in query_values:
-                        query_values[key] = None
-                        
-                    # Convertit les nombres décimaux
-                    if key in ["valeur_fonciere", "lot1_surface_carrez", "lot2_surface_carrez", "lot3_surface_carrez", "lot4_surface_carrez", "lot5_surface_carrez", "surface_reelle_bati", "surface_terrain", "longitude", "latitude"]:
-                        if query_values[key] is not None:
-                            try:
-                                query_values[key] = float(query_values[key])
-                            except ValueError:
-                                query_values[key] = None
-
-                    # Convertit les nombres entiers
-                    if key in ["nombre_lots", "nombre_pieces_principales"]:
-                        if query_values[key] is not None:
-                            try:
-                                query_values[key] = int(query_values[key])
-                            except ValueError:
-                                query_values[key] = None
-
-                # Vérifie si une entrée avec la même id_mutation existe déjà dans la base de données
-                existing_entry = await database.fetch_one(Dvf.__table__.select().where(Dvf.id_mutation == query_values["id_mutation"]))
-                if existing_entry is None:
-                    query = Dvf.__table__.insert().values(**query_values)
-                    await database.execute(query=query)
-                else:
-                    continue
+    if Path(CSV_FILE).exists() and not BASE_PREPAREE:
+        etat_chargement["statut"] = "chargement"
+        try:
+            modifiees = await asyncio.to_thread(insert_data_from_csv)
+        except Exception as erreur:
+            etat_chargement["statut"] = "erreur"
+            etat_chargement["erreur"] = str(erreur)
+            return
+        etat_chargement["partitions_modifiees"] = len(modifiees)
+    etat_chargement["statut"] = "preparation"
+    try:
+        etat_chargement["agregats"] = await asyncio.to_thread(ouvrir_base if BASE_PREPAREE else preparer_base)
+        if entrepot is not None:
+            await asyncio.to_thread(entrepot.charger)
+    except Exception as erreur:
+        etat_chargement["statut"] = "erreur"
+        etat_chargement["erreur"] = str(erreur)
+        return
+    etat_chargement["statut"] = "ok"
+    await resolveur()
+
+# Met la base au schéma courant (schema.py, avec migration d'une base construite par une
+# version précédente), crée les index et agrégats manquants puis signale les requêtes des
+# endpoints qui parcourent une table entière. Renvoie vrai si les agrégats sont disponibles ;
+# sinon les endpoints calculent les moyennes directement sur dvf. Avec le moteur en colonnes,
+# les fichiers Parquet sont exportés s'ils n'existent pas.
+def preparer_base():
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        schema.creer_schema(conn)
+        createdb.creer_tables_suivi(conn)
+        if indexes.index_manquants(conn):
+            with conn:
+                indexes.creer_index(conn)
+                indexes.analyser(conn)
+        # Tables d'agrégats absentes, calculées à partir d'une seule lecture des ventes
+        absentes = [] if createdb.base_vide(conn) else [module for module in createdb.TABLES_VENTES if module.absents(conn)]
+        if not spatial.existe(conn):
+            absentes.append(spatial)
+        if absentes:
+            agregats_ventes = agregation.Agregats.lire(conn, absentes)
+            for module in absentes:
+                module.reconstruire(conn, agregats_ventes.de(module))
+        agregats = not rollups.absents(conn)
+        if robustes.absentes(conn) and not createdb.base_vide(conn):
+            robustes.reconstruire(conn)
+        if quantiles.absents(conn) and not createdb.base_vide(conn):
+            quantiles.reconstruire(conn)
+        # Un parcours complet ralentit un endpoint sans le rendre faux : il est signalé sans
+        # arrêter le service (`python indexes.py` échoue, lui, pour la CI)
+        try:
+            indexes.verifier_plans(conn, requetes_endpoints(agregats))
+        except indexes.ScanComplet as erreur:
+            print(f"Avertissement : {erreur}", file=sys.stderr)
+        if entrepot is not None and not colonnes.existe(PARQUET_DIR) and not createdb.base_vide(conn):
+            colonnes.exporter(conn, PARQUET_DIR)
+        return agregats
+    finally:
+        conn.close()
+
+# Ouverture d'une base déjà préparée par serve.py, en lecture seule
+def ouvrir_base():
+    conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True)
+    try:
+        return schema.existe(conn, "dvf_stats") and conn.execute("SELECT EXISTS (SELECT 1 FROM dvf_stats)").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+# Fonction pour insérer les données du CSV dans la base de données, hors de la boucle
+# d'événements : conversion des types colonne par colonne et insertion par lots
+def insert_data_from_csv():
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        modifiees = createdb.charger(conn, [CSV_FILE])
+        if entrepot is not None and modifiees:
+            colonnes.mettre_a_jour(conn, PARQUET_DIR, modifiees)
+        return modifiees
+    finally:
+        conn.close()
+
+# Endpoint de santé, disponible pendant le chargement des données
+@app.get("/sante/")
+async def sante():
+    return etat_chargement
+
+# Compteurs du cache des réponses (hits, misses, revalidations par ETag)
+@app.get("/cache/")
+async def statistiques_cache():
+    if stockage_cache is None:
+        return {"cache": CACHE}
+    return {"cache": CACHE, **(await asyncio.to_thread(stockage_cache.statistiques))}
+
+# Mesures par endpoint (nombre de requêtes, p50 et p99, temps SQL, lignes renvoyées et
+# instructions SQLite, cache) et dernières requêtes, pour ce processus
+@app.get("/metrics")
+async def mesures():
+    return {"metriques": METRIQUES, **mesures_api.resume()}
+
+# Endpoint d'autocomplétion des communes à partir du début du nom (sans accents ni tirets,
+# « St » pour Saint), d'un mot du nom, du code INSEE ou d'un code postal, les communes dont
+# le nom commence par la saisie d'abord, puis les plus vendues
+@app.get("/autocompletion-communes/")
+async def autocompletion_communes(
+    debut: str = Query(..., min_length=1, description="Début du nom, du code INSEE ou du code postal"),
+    limite: int = Query(10, ge=1, le=100, description="Nombre maximal de communes"),
+):
+    return [commune._asdict() for commune in (await resolveur()).completer(debut, limite)]
+
+# Vrai si la saisie est un code de département (pour les messages d'erreur) ; les fonctions de
+# lecture reçoivent des lieux déjà résolus (voir resoudre)
+def est_departement(texte):
+    return communes.est_code_departement(texte)
+
+# Colonnes d'agrégats, lues dans dvf_stats ou calculées directement sur dvf. Dans ce
+# dernier cas seules les colonnes nécessaires sont lues et les sommes sont faites par
+# SQLite, sans ramener les lignes dans Python.
+def colonnes_stats(table):
+    if table is DvfStats:
+        return [
+            func.sum(DvfStats.nb_lignes).label("nb_lignes"),
+            func.sum(DvfStats.nb_prix_m2).label("nb_prix_m2"),
+            func.sum(DvfStats.somme_prix_m2).label("somme_prix_m2"),
+            func.sum(DvfStats.nb_surface).label("nb_surface"),
+            func.sum(DvfStats.somme_surface).label("somme_surface"),
+            func.sum(DvfStats.nb_terrain).label("nb_terrain"),
+            func.sum(DvfStats.somme_terrain).label("somme_terrain"),
+        ]
+    prix_m2 = Mutation.valeur_fonciere / func.nullif(Mutation.surface_reelle_bati, 0)
+    return [
+        func.count().label("nb_lignes"),
+        func.count(prix_m2).label("nb_prix_m2"),
+        func.sum(prix_m2).label("somme_prix_m2"),
+        func.count(Mutation.surface_reelle_bati).label("nb_surface"),
+        func.sum(Mutation.surface_reelle_bati).label("somme_surface"),
+        func.count(func.nullif(Mutation.surface_terrain, 0)).label("nb_terrain"),
+        func.sum(Mutation.surface_terrain).label("somme_terrain"),
+    ]
+
+# Table lue, colonnes du lieu (nom de la commune et code de son département, ou code du
+# département) et conditions d'une requête d'agrégats. Sans dvf_stats, la table mutations
+# n'est jointe qu'aux dimensions utilisées par le filtre.
+def source_stats(table, par_departement, type_local):
+    if table is DvfStats:
+        colonnes = [DvfStats.code_departement] if par_departement else [DvfStats.nom_commune, DvfStats.code_departement]
+        conditions = [DvfStats.nature_mutation.in_(NATURES_VENTE)]
+        if type_local is not None:
+            conditions.append(DvfStats.type_local == type_local)
+        return DvfStats, colonnes, conditions
+    if par_departement:
+        source = join(Mutation, Departement, Departement.id == Mutation.departement_id)
+        colonnes = [Departement.code_departement]
+    else:
+        source = join(Mutation, Commune, Commune.id == Mutation.commune_id).join(Departement, Departement.id == Commune.departement_id)
+        colonnes = [Commune.nom_commune, Departement.code_departement]
+    source = source.join(NatureMutation, NatureMutation.id == Mutation.nature_mutation_id)
+    conditions = [NatureMutation.nature_mutation.in_(NATURES_VENTE)]
+    if type_local is not None:
+        source = source.join(TypeLocal, TypeLocal.id == Mutation.type_local_id)
+        conditions.append(TypeLocal.type_local == type_local)
+    return source, colonnes, conditions
+
+# Conditions sur les colonnes du lieu (voir source_stats)
+def conditions_lieu(colonnes, lieu):
+    if lieu.departement:
+        return [colonnes[0] == lieu.code_departement]
+    return [colonnes[0] == lieu.nom_commune, colonnes[1] == lieu.code_departement]
+
+# Requête sur les agrégats pour une commune ou un département, tous types de local
+# confondus ou pour un seul type
+def requete_stats(lieu, type_local=None, table=DvfStats):
+    source, colonnes, conditions = source_stats(table, lieu.departement, type_local)
+    return select(*colonnes_stats(table)).select_from(source).where(*conditions, *conditions_lieu(colonnes, lieu))
+
+def requete_stats_dvf(lieu, type_local=None):
+    return requete_stats(lieu, type_local, Mutation)
+
+# Requête groupée pour une liste de communes ou une liste de départements. Pour les communes,
+# le filtre porte sur les noms et sur les départements : il peut ramener une homonyme d'un des
+# départements, écartée par communes.par_lieu.
+def requete_stats_groupees(lieux, departements, type_local=None, table=DvfStats):
+    source, colonnes, conditions = source_stats(table, departements, type_local)
+    noms = ["code_departement"] if departements else ["nom_commune", "code_departement"]
+    filtres = [colonne.in_(list(dict.fromkeys(getattr(lieu, nom) for lieu in lieux))) for colonne, nom in zip(colonnes, noms)]
+    return (
+        select(*(colonne.label(nom) for colonne, nom in zip(colonnes, noms)), *colonnes_stats(table))
+        .select_from(source)
+        .where(*conditions, *filtres)
+        .group_by(*colonnes)
+    )
+
+def table_stats():
+    return DvfStats if etat_chargement["agregats"] else Mutation
+
+# Lit les agrégats d'un lieu, None si aucune vente ne correspond
+async def lire_stats(texte, type_local=None):
+    lieu = await resoudre(texte)
+    if lieu is None:
+        return None
+    if entrepot is not None:
+        stats = (await asyncio.to_thread(entrepot.stats_groupees, [lieu], lieu.departement, type_local)).get(lieu)
+    else:
+        stats = await database.fetch_one(requete_stats(lieu, type_local, table_stats()))
+    if stats is None or not stats["nb_lignes"]:
+        return None
+    return stats
+
+# Lit les agrégats d'une liste de lieux avec une requête groupée pour les communes et une
+# pour les départements (découpées par TAILLE_IN lieux). Renvoie un dictionnaire lieu demandé
+# -> agrégats, sans entrée pour un lieu inconnu.
+async def lire_stats_groupees(lieux, type_local=None):
+    table = table_stats()
+    resultats = {}
+    resolveur_lieux = await resolveur()
+    canoniques = {lieu: resolveur_lieux.resoudre(lieu) for lieu in lieux}
+    departements = list(dict.fromkeys(canonique for canonique in canoniques.values() if canonique and canonique.departement))
+    communes_demandees = list(dict.fromkeys(canonique for canonique in canoniques.values() if canonique and not canonique.departement))
+    for groupe, par_departement in ((departements, True), (communes_demandees, False)):
+        for debut in range(0, len(groupe), TAILLE_IN):
+            morceau = groupe[debut:debut + TAILLE_IN]
+            if entrepot is not None:
+                resultats.update(await asyncio.to_thread(entrepot.stats_groupees, morceau, par_departement, type_local))
+                continue
+            lignes = await database.fetch_all(requete_stats_groupees(morceau, par_departement, type_local, table))
+            resultats.update(communes.par_lieu(lignes, morceau, par_departement))
+    return {lieu: resultats[canonique] for lieu, canonique in canoniques.items() if canonique in resultats}
+
+# Requête du profil d'un lieu : les agrégats de chaque type de local en une seule requête.
+# Sans dvf_stats, les types de local sont joints à gauche pour garder les ventes sans local.
+def requete_profil(lieu, table=DvfStats):
+    source, colonnes, conditions = source_stats(table, lieu.departement, None)
+    if table is DvfStats:
+        type_local = DvfStats.type_local
+    else:
+        source = source.outerjoin(TypeLocal, TypeLocal.id == Mutation.type_local_id)
+        type_local = TypeLocal.type_local
+    return (
+        select(type_local.label("type_local"), *colonnes_stats(table))
+        .select_from(source)
+        .where(*conditions, *conditions_lieu(colonnes, lieu))
+        .group_by(type_local)
+    )
+
+# Lit les agrégats d'un lieu résolu par type de local. Renvoie un dictionnaire type de local -> agrégats.
+async def lire_profil(lieu):
+    if entrepot is not None:
+        lignes = await asyncio.to_thread(entrepot.profil, lieu)
+    else:
+        lignes = await database.fetch_all(requete_profil(lieu, table_stats()))
+    return {ligne["type_local"]: ligne for ligne in lignes if ligne["nb_lignes"]}
+
+def moyenne(somme, nombre):
+    return somme / nombre if nombre else None
+
+# Moyenne d'une colonne d'agrégats, None s'il n'y en a pas (aucune vente de ce type)
+def moyenne_stats(stats, somme, nombre):
+    return moyenne(stats[somme], stats[nombre]) if stats else None
 
 # Endpoint pour récupérer les prix moyens au mètre carré par nom de ville pour les maisons uniquement
 @app.get("/prix-moyen-m2-par-ville-maisons/")
 async def lire_prix_moyen_m2_par_ville_maisons(nom_ville: str = Query(..., description="Nom de la ville")):
-    if len(nom_ville) == 2 and nom_ville.isdigit():
-        query = (
-            select(
-                Dvf.code_departement,
-                func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-            )
-            .where(
-                (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                (Dvf.type_local == "Maison") &
-                (Dvf.code_departement == nom_ville)
-            )
-            .group_by(Dvf.code_departement)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            return {result[0]["code_departement"]: result[0]["prix_moyen_m2"]}
-        else:
-            raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré pour les maisons non trouvé pour la ville : {nom_ville}")
-    else:
-        query = (
-            select(
-                Dvf.nom_commune,
-                func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-            )
-            .where(
-                (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                (Dvf.type_local == "Maison") &
-                (Dvf.nom_commune == nom_ville)
-            )
-            .group_by(Dvf.nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            print(result[0]["nom_commune"])
-            return {result[0]["nom_commune"]: result[0]["prix_moyen_m2"]}
-        else:
-            raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré pour les maisons non trouvé pour la ville : {nom_ville}")
+    stats = await lire_stats(nom_ville, "Maison")
+    if stats is None:
+        raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré pour les maisons non trouvé pour la ville : {nom_ville}")
+    return {nom_ville: moyenne(stats["somme_prix_m2"], stats["nb_prix_m2"])}
 
 @app.get("/prix-moyen-m2-par-ville-appartement/")
 async def lire_prix_moyen_m2_par_ville_appartement(nom_ville: str = Query(..., description="Nom de la ville")):
-    if len(nom_ville) == 2 and nom_ville.isdigit():
-        query = (
-            select(
-                Dvf.code_departement,
-                func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-            )
-            .where(
-                (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                (Dvf.type_local == "Appartement") &
-                (Dvf.code_departement == nom_ville)
-            )
-            .group_by(Dvf.code_departement)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            return {result[0]["code_departement"]: result[0]["prix_moyen_m2"]}
-        else:
-            raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré pour les appartements non trouvé pour la ville : {nom_ville}")
-    else:
-        query = (
-            select(
-                Dvf.nom_commune,
-                func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-            )
-            .where(
-                (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                (Dvf.type_local == "Appartement") &
-                (Dvf.nom_commune == nom_ville)
-            )
-            .group_by(Dvf.nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            return {result[0]["nom_commune"]: result[0]["prix_moyen_m2"]}
-        else:
-            raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré pour les appartements non trouvé pour la ville : {nom_ville}")
+    stats = await lire_stats(nom_ville, "Appartement")
+    if stats is None:
+        raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré pour les appartements non trouvé pour la ville : {nom_ville}")
+    return {nom_ville: moyenne(stats["somme_prix_m2"], stats["nb_prix_m2"])}
 
 @app.get("/prix-moyen-m2-par-ville/")
 async def lire_prix_moyen_m2_par_ville(nom_ville: str = Query(..., description="Nom de la ville")):
-    if len(nom_ville) == 2 and nom_ville.isdigit():
-        query = (
-            select(
-                Dvf.code_departement,
-                func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-            )
-            .where(
-                (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                (Dvf.code_departement == nom_ville)
-            )
-            .group_by(Dvf.code_departement)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            return {result[0]["code_departement"]: result[0]["prix_moyen_m2"]}
-        else:
+    stats = await lire_stats(nom_ville)
+    if stats is None:
+        if est_departement(nom_ville):
             raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré non trouvé pour le département : {nom_ville}")
-    else:
-        query = (
-            select(
-                Dvf.nom_commune,
-                func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-            )
-            .where(
-                (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                (Dvf.nom_commune == nom_ville)
-            )
-            .group_by(Dvf.nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            return {result[0]["nom_commune"]: result[0]["prix_moyen_m2"]}
-        else:
-            raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré non trouvé pour la ville : {nom_ville}")
+        raise HTTPException(status_code=404, detail=f"Prix moyen au mètre carré non trouvé pour la ville : {nom_ville}")
+    return {nom_ville: moyenne(stats["somme_prix_m2"], stats["nb_prix_m2"])}
 
 
 # Endpoint pour récupérer la moyenne de nombres de m2 par maison par commune
 @app.get("/moyenne-m2-maison-par-commune/")
 async def moyenne_m2_maison_par_commune(nom_commune: str = Query(..., description="Nom de la commune")):
-    if len(nom_commune) == 2 and nom_commune.isdigit():
-        query = select(Dvf).where(
-            (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-            (Dvf.type_local == "Maison") &
-            (Dvf.code_departement == nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            total_surface = 0
-            for row in result:
-                total_surface += row.surface_reelle_bati
-            return {nom_commune: total_surface / len(result)}
-        else:
-            raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen par maison non trouvé pour la commune : {nom_commune}")
-    else:
-        query = select(Dvf).where(
-            (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-            (Dvf.type_local == "Maison") &
-            (Dvf.nom_commune == nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            total_surface = 0
-            for row in result:
-                total_surface += row.surface_reelle_bati
-            return {nom_commune: total_surface / len(result)}
-        else:
-            raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen par maison non trouvé pour la commune : {nom_commune}")
+    stats = await lire_stats(nom_commune, "Maison")
+    if stats is None:
+        raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen par maison non trouvé pour la commune : {nom_commune}")
+    return {nom_commune: moyenne(stats["somme_surface"], stats["nb_surface"])}
 
 # Endpoint pour récupérer la moyenne de nombres de m2 par maison par commune
 @app.get("/moyenne-m2-appartement-par-commune/")
 async def moyenne_m2_appartement_par_commune(nom_commune: str = Query(..., description="Nom de la commune")):
-    if len(nom_commune) == 2 and nom_commune.isdigit():
-        query = select(Dvf).where(
-            (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-            (Dvf.type_local == "Appartement") &
-            (Dvf.code_departement == nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            total_surface = 0
-            for row in result:
-                total_surface += row.surface_reelle_bati
-            return {nom_commune: total_surface / len(result)}
-        else:
-            raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen par appartement non trouvé pour la commune : {nom_commune}")
-    else:
-        query = select(Dvf).where(
-            (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-            (Dvf.type_local == "Appartement") &
-            (Dvf.nom_commune == nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            total_surface = 0
-            for row in result:
-                total_surface += row.surface_reelle_bati
-            return {nom_commune: total_surface / len(result)}
-        else:
-            raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen par appartement non trouvé pour la commune : {nom_commune}")
+    stats = await lire_stats(nom_commune, "Appartement")
+    if stats is None:
+        raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen par appartement non trouvé pour la commune : {nom_commune}")
+    return {nom_commune: moyenne(stats["somme_surface"], stats["nb_surface"])}
 
-# Endpoint pour récupérer les prix moyens au mètre carré par liste de villes
+# Endpoint pour récupérer les prix moyens au mètre carré par liste de villes. Toute la
+# liste est résolue en une requête groupée et renvoyée dans l'ordre demandé.
 @app.get("/prix-moyen-m2-par-villes/")
 async def lire_prix_moyen_m2_par_villes(villes: str = Query(..., description="Liste de villes séparées par des virgules")):
-    villes_list = villes.split(",")
+    villes_list = list(dict.fromkeys(villes.split(",")))
+    stats_par_ville = await lire_stats_groupees(villes_list)
     prix_moyen_m2_par_ville = {}
     for ville in villes_list:
-        if len(ville) == 2 and ville.isdigit():  # Si le paramètre est un code départemental
-            query = (
-                select(
-                    Dvf.nom_commune,
-                    func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-                )
-                .where(
-                    (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                    (Dvf.code_departement == ville)
-                )
-                .group_by(Dvf.nom_commune)
-            )
-            result = await database.fetch_all(query)
-            if result:
-                prix_moyen_m2_par_ville[ville] = result[0]["prix_moyen_m2"]
-            else:
-                prix_moyen_m2_par_ville[ville] = None
-        else:  # Si le paramètre est le nom de la ville
-            query = (
-                select(
-                    Dvf.nom_commune,
-                    func.avg(Dvf.valeur_fonciere / Dvf.surface_reelle_bati).label("prix_moyen_m2")
-                )
-                .where(
-                    (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-                    (Dvf.nom_commune == ville)
-                )
-                .group_by(Dvf.nom_commune)
-            )
-            result = await database.fetch_all(query)
-            if result:
-                prix_moyen_m2_par_ville[ville] = result[0]["prix_moyen_m2"]
-            else:
-                prix_moyen_m2_par_ville[ville] = None
+        stats = stats_par_ville.get(ville)
+        prix_moyen_m2_par_ville[ville] = moyenne(stats["somme_prix_m2"], stats["nb_prix_m2"]) if stats else None
     return prix_moyen_m2_par_ville
 
-@app.get("/maisons-par-commune/")
-async def maisons_par_commune(nom_commune: str = Query(..., description="Nom de la commune")):
-    query = select(Dvf).where(
-        (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-        (Dvf.type_local == "Maison") &
-        (Dvf.nom_commune == nom_commune)
+def requete_robuste(lieu):
+    return select(DvfRobuste).where(DvfRobuste.lieu == lieu.nom, DvfRobuste.code_departement == lieu.code_departement)
+
+# Statistiques robustes d'un lieu résolu par type de local (None : tous types). Deux communes
+# homonymes d'un même département ont chacune leurs lignes, jamais mélangées : celles de la
+# commune qui a le plus de prix sont renvoyées.
+async def lire_robuste(lieu):
+    lignes = await database.fetch_all(requete_robuste(lieu))
+    nb_prix = {ligne["code_commune"]: ligne["nb_prix_m2"] for ligne in lignes if ligne["type_local"] is None}
+    commune = max(nb_prix, key=lambda code: (nb_prix[code], code or ""), default=None)
+    return {ligne["type_local"]: ligne for ligne in lignes if ligne["code_commune"] == commune}
+
+def stats_robustes(ligne):
+    return {
+        "nb_prix_m2": ligne["nb_prix_m2"],
+        "moyenne": ligne["moyenne"],
+        "mediane": ligne["mediane"],
+        "mad": ligne["mad"],
+        "moyenne_tronquee": ligne["moyenne_tronquee"],
+        "moyenne_filtree": ligne["moyenne_filtree"],
+        "nb_exclus": ligne["nb_exclus"],
+    }
+
+# Endpoint des statistiques robustes du prix au m² d'une commune ou d'un département : moyenne
+# des prix valides (valeur et surface positives), médiane, écart absolu médian, moyenne
+# tronquée à 10 % et moyenne sans les valeurs aberrantes, tous types et par type de local
+@app.get("/prix-m2-robuste/")
+async def prix_m2_robuste(nom_ville: str = Query(..., description="Nom de la ville ou code du département")):
+    lieu = await resoudre(nom_ville)
+    par_type = await lire_robuste(lieu) if lieu is not None else {}
+    if not par_type:
+        raise HTTPException(status_code=404, detail=f"Statistiques du prix au mètre carré non trouvées pour : {nom_ville}")
+    resultat = {"code_departement": par_type[None]["code_departement"], "tous": stats_robustes(par_type[None])}
+    for type_local, ligne in par_type.items():
+        if type_local is not None:
+            resultat[type_local] = stats_robustes(ligne)
+    return {nom_ville: resultat}
+
+# Conditions sur les tables d'agrégats dont la colonne lieu vaut le nom de la commune ou le code
+# du département : noms et départements des lieux demandés. Elles peuvent ramener une homonyme
+# d'un des départements, écartée par lignes_demandees.
+def filtre_lieux(table, lieux):
+    return [
+        table.lieu.in_(list(dict.fromkeys(lieu.nom for lieu in lieux))),
+        table.code_departement.in_(list(dict.fromkeys(lieu.code_departement for lieu in lieux))),
+    ]
+
+def lignes_demandees(lignes, lieux):
+    cles = {(lieu.nom, lieu.code_departement) for lieu in lieux}
+    return [ligne for ligne in lignes if (ligne["lieu"], ligne["code_departement"]) in cles]
+
+# Lieux demandés sans recouvrement : une commune dont le département est aussi demandé y est
+# déjà comptée et n'est pas ajoutée une seconde fois
+def lieux_distincts(lieux):
+    departements = {lieu.code_departement for lieu in lieux if lieu.departement}
+    return [lieu for lieu in lieux if lieu.departement or lieu.code_departement not in departements]
+
+def requete_quantiles(lieux, type_local=None, annee=None):
+    requete = select(DvfQuantiles.lieu, DvfQuantiles.code_departement, DvfQuantiles.digest).where(*filtre_lieux(DvfQuantiles, lieux))
+    if type_local is not None:
+        requete = requete.where(DvfQuantiles.type_local == type_local)
+    if annee is not None:
+        requete = requete.where(DvfQuantiles.annee == annee)
+    return requete
+
+def noms_quantiles(niveaux):
+    try:
+        valeurs = [float(niveau) for niveau in niveaux.split(",")]
+    except ValueError:
+        valeurs = []
+    if not valeurs or any(not 0 <= valeur <= 1 for valeur in valeurs):
+        raise HTTPException(status_code=400, detail=f"Quantiles invalides : {niveaux} (nombres entre 0 et 1 séparés par des virgules)")
+    return {f"p{valeur * 100:g}": valeur for valeur in valeurs}
+
+# Endpoint des quantiles du prix au m² (p10, médiane, p90 par défaut) pour une ou plusieurs
+# communes ou départements, un type de local et une année : les t-digests précalculés sont
+# fusionnés (une fois par lieu, voir lieux_distincts), l'erreur de rang reste inférieure à 1 %
+@app.get("/quantiles-prix-m2/")
+async def quantiles_prix_m2(
+    lieux: str = Query(..., description="Communes ou codes de départements séparés par des virgules"),
+    type_local: str = Query(None, description="Type de local (Maison, Appartement...), tous par défaut"),
+    annee: int = Query(None, description="Année des ventes, toutes par défaut"),
+    niveaux: str = Query("0.1,0.5,0.9", alias="quantiles", description="Quantiles entre 0 et 1 séparés par des virgules"),
+):
+    noms = noms_quantiles(niveaux)
+    lieux_list = list(dict.fromkeys(lieux.split(",")))
+    resolveur_lieux = await resolveur()
+    canoniques = [canonique for canonique in map(resolveur_lieux.resoudre, lieux_list) if canonique is not None]
+    canoniques = lieux_distincts(list(dict.fromkeys(canoniques)))
+    digests = []
+    for debut in range(0, len(canoniques), TAILLE_IN):
+        morceau = canoniques[debut:debut + TAILLE_IN]
+        lignes = await database.fetch_all(requete_quantiles(morceau, type_local, annee))
+        digests.extend(ligne["digest"] for ligne in lignes_demandees(lignes, morceau))
+    digest = await asyncio.to_thread(quantiles.fusionner, digests)
+    if not digest.nombre():
+        raise HTTPException(status_code=404, detail=f"Prix au mètre carré non trouvés pour : {lieux}")
+    return {
+        "lieux": lieux_list,
+        "type_local": type_local,
+        "annee": annee,
+        "nb_prix_m2": int(digest.nombre()),
+        "quantiles": {nom: digest.quantile(valeur) for nom, valeur in noms.items()},
+    }
+
+# Sommes mensuelles par lieu de plusieurs lieux, tous types de local ou un seul, entre deux
+# mois AAAAMM
+def requete_serie(lieux, type_local=None, debut=None, fin=None):
+    requete = select(
+        DvfMensuel.lieu,
+        DvfMensuel.code_departement,
+        DvfMensuel.mois,
+        *(func.sum(getattr(DvfMensuel, colonne)).label(colonne) for colonne in series.COLONNES[1:]),
+    ).where(*filtre_lieux(DvfMensuel, lieux))
+    if type_local is not None:
+        requete = requete.where(DvfMensuel.type_local == type_local)
+    if debut is not None:
+        requete = requete.where(DvfMensuel.mois >= debut)
+    if fin is not None:
+        requete = requete.where(DvfMensuel.mois <= fin)
+    return requete.group_by(DvfMensuel.lieu, DvfMensuel.code_departement, DvfMensuel.mois)
+
+# Mois AAAAMM d'un paramètre AAAA-MM ou AAAA (premier ou dernier mois de l'année)
+def mois_parametre(valeur, nom, dernier=False):
+    if valeur is None:
+        return None
+    try:
+        if len(valeur) == 4:
+            return int(valeur) * 100 + (12 if dernier else 1)
+        annee, mois = valeur.split("-")
+        if len(annee) == 4 and 1 <= int(mois) <= 12:
+            return int(annee) * 100 + int(mois)
+    except ValueError:
+        pass
+    raise HTTPException(status_code=400, detail=f"{nom} invalide : {valeur} (AAAA-MM ou AAAA)")
+
+# Endpoint de la série temporelle du prix au m² d'une ou plusieurs communes ou départements :
+# sommes mensuelles précalculées (une fois par lieu, voir lieux_distincts), regroupées par mois,
+# trimestre ou année, avec en option une moyenne glissante sur `lissage` périodes
+@app.get("/serie-temporelle/")
+async def serie_temporelle(
+    lieux: str = Query(..., description="Communes ou codes de départements séparés par des virgules"),
+    type_local: str = Query(None, description="Type de local (Maison, Appartement...), tous par défaut"),
+    pas: str = Query("mois", description="Pas de la série : mois, trimestre ou annee"),
+    debut: str = Query(None, description="Premier mois (AAAA-MM ou AAAA)"),
+    fin: str = Query(None, description="Dernier mois (AAAA-MM ou AAAA)"),
+    lissage: int = Query(1, ge=1, le=24, description="Nombre de périodes de la moyenne glissante (1 : sans lissage)"),
+):
+    if pas not in series.PAS:
+        raise HTTPException(status_code=400, detail=f"Pas invalide : {pas} ({', '.join(series.PAS)})")
+    mois_debut = mois_parametre(debut, "debut")
+    mois_fin = mois_parametre(fin, "fin", dernier=True)
+    lieux_list = list(dict.fromkeys(lieux.split(",")))
+    resolveur_lieux = await resolveur()
+    canoniques = [canonique for canonique in map(resolveur_lieux.resoudre, lieux_list) if canonique is not None]
+    canoniques = lieux_distincts(list(dict.fromkeys(canoniques)))
+    lignes = []
+    for premier in range(0, len(canoniques), TAILLE_IN):
+        morceau = canoniques[premier:premier + TAILLE_IN]
+        resultat = await database.fetch_all(requete_serie(morceau, type_local, mois_debut, mois_fin))
+        lignes.extend([ligne[colonne] for colonne in series.COLONNES] for ligne in lignes_demandees(resultat, morceau))
+    serie = await asyncio.to_thread(series.calculer, lignes, pas, lissage)
+    if not serie:
+        raise HTTPException(status_code=404, detail=f"Ventes non trouvées pour : {lieux}")
+    return {"lieux": lieux_list, "type_local": type_local, "pas": pas, "lissage": lissage, "serie": serie}
+
+# Kilomètres par degré de latitude (et de longitude à l'équateur)
+KM_PAR_DEGRE = 111.32
+RAYON_MAX_KM = 50
+# Nombre maximal de cases renvoyées par /carte-chaleur/
+MAX_CELLULES = 10_000
+
+def verifier_zone(ouest, sud, est, nord):
+    if ouest >= est or sud >= nord:
+        raise HTTPException(status_code=400, detail="Zone invalide : ouest doit être inférieur à est et sud inférieur à nord")
+
+# Nombre de ventes et prix au m² des ventes dont le point est dans le rectangle : candidates
+# trouvées par l'index R*Tree (coordonnées arrondies en float32 vers l'extérieur), lues dans
+# mutations par leur clé puis filtrées sur leurs coordonnées exactes
+def requete_zone(ouest, sud, est, nord, type_local=None):
+    prix_m2 = Mutation.valeur_fonciere / func.nullif(Mutation.surface_reelle_bati, 0)
+    source = join(MutationRtree, Mutation, Mutation.id == MutationRtree.id)
+    requete = select(
+        func.count().label("nb_ventes"),
+        func.count(prix_m2).label("nb_prix_m2"),
+        func.sum(prix_m2).label("somme_prix_m2"),
+    ).select_from(source).where(
+        MutationRtree.max_lon >= ouest,
+        MutationRtree.min_lon <= est,
+        MutationRtree.max_lat >= sud,
+        MutationRtree.min_lat <= nord,
+        Mutation.longitude.between(ouest, est),
+        Mutation.latitude.between(sud, nord),
+        Mutation.nature_mutation_id.in_(select(NatureMutation.id).where(NatureMutation.nature_mutation.in_(NATURES_VENTE))),
+    )
+    if type_local is not None:
+        requete = requete.where(Mutation.type_local_id.in_(select(TypeLocal.id).where(TypeLocal.type_local == type_local)))
+    return requete
+
+# Ventes à moins de rayon_km du point : rectangle englobant par l'index R*Tree, puis distance
+# en projection équirectangulaire (écart inférieur à 0,1 % sous RAYON_MAX_KM)
+def requete_rayon(longitude, latitude, rayon_km, type_local=None):
+    km_par_degre_lon = KM_PAR_DEGRE * math.cos(math.radians(latitude))
+    ecart_lon = rayon_km / km_par_degre_lon
+    ecart_lat = rayon_km / KM_PAR_DEGRE
+    dx = (Mutation.longitude - longitude) * km_par_degre_lon
+    dy = (Mutation.latitude - latitude) * KM_PAR_DEGRE
+    requete = requete_zone(longitude - ecart_lon, latitude - ecart_lat, longitude + ecart_lon, latitude + ecart_lat, type_local)
+    return requete.where(dx * dx + dy * dy <= rayon_km * rayon_km)
+
+async def prix_zone(requete, description):
+    ligne = await database.fetch_one(requete)
+    if not ligne["nb_prix_m2"]:
+        raise HTTPException(status_code=404, detail=f"Aucune vente avec un prix au mètre carré trouvée {description}")
+    return {
+        "nb_ventes": ligne["nb_ventes"],
+        "nb_prix_m2": ligne["nb_prix_m2"],
+        "prix_moyen_m2": ligne["somme_prix_m2"] / ligne["nb_prix_m2"],
+    }
+
+# Endpoint du prix moyen au m² des ventes situées dans un rectangle (longitudes et latitudes en degrés)
+@app.get("/prix-moyen-m2-zone/")
+async def prix_moyen_m2_zone(
+    ouest: float = Query(..., ge=-180, le=180, description="Longitude minimale"),
+    sud: float = Query(..., ge=-90, le=90, description="Latitude minimale"),
+    est: float = Query(..., ge=-180, le=180, description="Longitude maximale"),
+    nord: float = Query(..., ge=-90, le=90, description="Latitude maximale"),
+    type_local: str = Query(None, description="Type de local (Maison, Appartement...), tous par défaut"),
+):
+    verifier_zone(ouest, sud, est, nord)
+    return await prix_zone(requete_zone(ouest, sud, est, nord, type_local), "dans la zone")
+
+# Endpoint du prix moyen au m² des ventes situées à moins de rayon_km kilomètres d'un point
+@app.get("/prix-moyen-m2-rayon/")
+async def prix_moyen_m2_rayon(
+    longitude: float = Query(..., ge=-180, le=180, description="Longitude du centre"),
+    latitude: float = Query(..., ge=-85, le=85, description="Latitude du centre"),
+    rayon_km: float = Query(1.0, gt=0, le=RAYON_MAX_KM, description="Rayon en kilomètres"),
+    type_local: str = Query(None, description="Type de local (Maison, Appartement...), tous par défaut"),
+):
+    return await prix_zone(requete_rayon(longitude, latitude, rayon_km, type_local), f"à moins de {rayon_km:g} km")
+
+# Niveau de la grille précalculée utilisé pour un zoom de carte : le plus fin qui ne dépasse pas le zoom
+def zoom_grille(zoom):
+    return max((niveau for niveau in spatial.ZOOMS if niveau <= zoom), default=spatial.ZOOMS[0])
+
+def requete_grille(zoom, x_min, x_max, y_min, y_max):
+    return select(
+        DvfGrille.x,
+        DvfGrille.y,
+        func.sum(DvfGrille.nb_prix_m2).label("nb_prix_m2"),
+        func.sum(DvfGrille.somme_prix_m2).label("somme_prix_m2"),
+    ).where(
+        DvfGrille.zoom == zoom,
+        DvfGrille.x.between(x_min, x_max),
+        DvfGrille.y.between(y_min, y_max),
+    ).group_by(DvfGrille.x, DvfGrille.y)
+
+# Endpoint de la carte de chaleur du prix au m² : cases de la grille des tuiles (Web Mercator)
+# qui recouvrent le rectangle, au niveau précalculé le plus proche du zoom demandé, avec leurs
+# bornes, le nombre de prix et le prix moyen au m², toutes années confondues
+@app.get("/carte-chaleur/")
+async def carte_chaleur(
+    zoom: int = Query(..., ge=0, le=22, description="Niveau de zoom de la carte"),
+    ouest: float = Query(..., ge=-180, le=180, description="Longitude minimale"),
+    sud: float = Query(..., ge=-90, le=90, description="Latitude minimale"),
+    est: float = Query(..., ge=-180, le=180, description="Longitude maximale"),
+    nord: float = Query(..., ge=-90, le=90, description="Latitude maximale"),
+):
+    verifier_zone(ouest, sud, est, nord)
+    niveau = zoom_grille(zoom)
+    x_min, x_max = spatial.tuile_x(ouest, niveau), spatial.tuile_x(est, niveau)
+    # Les lignes de tuiles sont numérotées du nord vers le sud
+    y_min, y_max = spatial.tuile_y(nord, niveau), spatial.tuile_y(sud, niveau)
+    if (x_max - x_min + 1) * (y_max - y_min + 1) > MAX_CELLULES:
+        raise HTTPException(status_code=400, detail=f"Zone trop grande pour le zoom {zoom} (plus de {MAX_CELLULES} cases)")
+    cellules = []
+    for ligne in await database.fetch_all(requete_grille(niveau, x_min, x_max, y_min, y_max)):
+        if not ligne["nb_prix_m2"]:
+            continue
+        bornes = spatial.bornes_tuile(ligne["x"], ligne["y"], niveau)
+        cellules.append({
+            "x": ligne["x"],
+            "y": ligne["y"],
+            **dict(zip(("ouest", "sud", "est", "nord"), bornes)),
+            "nb_prix_m2": ligne["nb_prix_m2"],
+            "prix_moyen_m2": ligne["somme_prix_m2"] / ligne["nb_prix_m2"],
+        })
+    return {"zoom": niveau, "cellules": cellules}
+
+def mediane_robuste(ligne):
+    return ligne["mediane"] if ligne else None
+
+# Endpoint pour récupérer en une requête toutes les moyennes affichées par le dashboard pour
+# une commune ou un département, avec les prix médians. Le lieu est résolu une fois : moyennes
+# et médianes portent sur la même commune. Une valeur sans vente correspondante vaut None.
+@app.get("/profil-commune/")
+async def profil_commune(nom_commune: str = Query(..., description="Nom de la commune ou code du département")):
+    lieu = await resoudre(nom_commune)
+    par_type = await lire_profil(lieu) if lieu is not None else {}
+    if not par_type:
+        raise HTTPException(status_code=404, detail=f"Aucune vente trouvée pour : {nom_commune}")
+    total = {cle: sum(stats[cle] or 0 for stats in par_type.values()) for cle in ("nb_prix_m2", "somme_prix_m2")}
+    maisons = par_type.get("Maison")
+    appartements = par_type.get("Appartement")
+    robuste = await lire_robuste(lieu)
+    return {
+        nom_commune: {
+            "nb_ventes": sum(stats["nb_lignes"] for stats in par_type.values()),
+            "prix_moyen_m2": moyenne(total["somme_prix_m2"], total["nb_prix_m2"]),
+            "prix_moyen_m2_maisons": moyenne_stats(maisons, "somme_prix_m2", "nb_prix_m2"),
+            "prix_moyen_m2_appartements": moyenne_stats(appartements, "somme_prix_m2", "nb_prix_m2"),
+            "surface_moyenne_maisons": moyenne_stats(maisons, "somme_surface", "nb_surface"),
+            "surface_moyenne_appartements": moyenne_stats(appartements, "somme_surface", "nb_surface"),
+            "surface_terrain_moyenne_maisons": moyenne_stats(maisons, "somme_terrain", "nb_terrain"),
+            "prix_median_m2": mediane_robuste(robuste.get(None)),
+            "prix_median_m2_maisons": mediane_robuste(robuste.get("Maison")),
+            "prix_median_m2_appartements": mediane_robuste(robuste.get("Appartement")),
+        }
+    }
+
+# Nombre de ventes par page quand un curseur est donné sans limite, et limite maximale
+LIMITE_DEFAUT = 1000
+LIMITE_MAX = 100_000
+
+# Clé de pagination de /maisons-par-commune/ : date de la vente, puis id de mutations, unique
+# et jamais NULL (id_mutation ou numero_disposition peuvent l'être, et une comparaison avec
+# NULL écarterait la ligne)
+COLONNES_CLE = ["date_mutation_entier", "id"]
+
+def requete_ids_communes(lieu):
+    return select(Commune.id).select_from(join(Commune, Departement, Departement.id == Commune.departement_id)).where(
+        Commune.nom_commune == lieu.nom_commune,
+        Departement.code_departement == lieu.code_departement,
     )
-    result = await database.fetch_all(query)
-    maisons = [row for row in result]
-    return maisons
+
+def requete_ids_maisons():
+    return select(TypeLocal.id).where(TypeLocal.type_local == "Maison")
+
+# Ventes de maisons des communes données, triées par (date, id) et lues après la clé `apres`.
+# Les ventes sans date (bases migrées d'une version qui les acceptait) viennent en premier,
+# comme NULL dans ORDER BY ; après une clé sans date, elles sont suivies de toutes les ventes
+# datées. Avec une seule commune, l'index idx_mutations_commune_type_date donne les lignes
+# dans l'ordre : une page ne lit que ses propres lignes.
+def requete_maisons(ids_communes, ids_maisons, colonnes=None, apres=None, limite=None):
+    date, identifiant = Dvf.date_mutation_entier, Dvf.id
+    requete = select(*[getattr(Dvf, nom) for nom in colonnes or schema.NOMS_COLONNES]).where(
+        Dvf.commune_id.in_(ids_communes),
+        Dvf.type_local_id.in_(ids_maisons),
+        Dvf.nature_mutation.in_(NATURES_VENTE),
+    )
+    if apres is not None:
+        date_apres, id_apres = apres
+        if date_apres is None:
+            requete = requete.where(or_(date.is_not(None), identifiant > id_apres))
+        else:
+            requete = requete.where(tuple_(date, identifiant) > tuple_(date_apres, id_apres))
+    requete = requete.order_by(date, identifiant)
+    if limite is not None:
+        requete = requete.limit(limite)
+    return requete
+
+def encoder_curseur(ligne):
+    cle = [ligne[nom] for nom in COLONNES_CLE]
+    return base64.urlsafe_b64encode(json.dumps(cle).encode("utf-8")).decode("ascii")
+
+def decoder_curseur(curseur):
+    try:
+        cle = json.loads(base64.urlsafe_b64decode(curseur.encode("ascii")))
+    except (ValueError, binascii.Error, UnicodeError):
+        cle = None
+    # Date entière ou NULL puis id entier, comme dans les curseurs donnés par l'API
+    if (
+        not isinstance(cle, list)
+        or len(cle) != len(COLONNES_CLE)
+        or not (cle[0] is None or type(cle[0]) is int)
+        or type(cle[1]) is not int
+    ):
+        raise HTTPException(status_code=400, detail=f"Curseur invalide : {curseur}")
+    return cle
+
+def colonnes_demandees(colonnes):
+    if colonnes is None:
+        return schema.NOMS_COLONNES
+    noms = list(dict.fromkeys(nom.strip() for nom in colonnes.split(",") if nom.strip()))
+    inconnues = [nom for nom in noms if nom not in schema.NOMS_COLONNES]
+    if not noms or inconnues:
+        raise HTTPException(status_code=400, detail=f"Colonnes inconnues : {', '.join(inconnues) or colonnes}")
+    return noms
+
+# Endpoint des ventes de maisons d'une commune, envoyées en flux (les lignes sont lues et
+# encodées au fur et à mesure) en JSON, NDJSON, CSV ou Arrow. Avec `limite` ou `curseur`, une
+# page est renvoyée et l'en-tête X-Curseur-Suivant donne le curseur de la page suivante.
+@app.get("/maisons-par-commune/")
+async def maisons_par_commune(
+    nom_commune: str = Query(..., description="Nom de la commune"),
+    colonnes: str = Query(None, description="Colonnes renvoyées, séparées par des virgules (toutes par défaut)"),
+    format: str = Query("json", description="json, ndjson, csv ou arrow"),
+    limite: int = Query(None, ge=1, le=LIMITE_MAX, description="Nombre de ventes par page"),
+    curseur: str = Query(None, description="Curseur de la page, donné par l'en-tête X-Curseur-Suivant"),
+):
+    if format not in formats.ENCODEURS:
+        raise HTTPException(status_code=400, detail=f"Format inconnu : {format} (json, ndjson, csv ou arrow)")
+    if not formats.disponible(format):
+        raise HTTPException(status_code=501, detail=f"Format {format} indisponible : pyarrow n'est pas installé")
+    noms = colonnes_demandees(colonnes)
+    apres = decoder_curseur(curseur) if curseur is not None else None
+    if limite is None and curseur is not None:
+        limite = LIMITE_DEFAUT
+
+    # Une commune inconnue (ou un département) donne une liste vide sans requête
+    lieu = await resoudre(nom_commune)
+    ids_communes = []
+    if lieu is not None and not lieu.departement:
+        ids_communes = [ligne["id"] for ligne in await database.fetch_all(requete_ids_communes(lieu))]
+    ids_maisons = [ligne["id"] for ligne in await database.fetch_all(requete_ids_maisons())]
+    entetes = {}
+    if limite is not None and ids_communes:
+        # Clés de la dernière ligne de la page et de la suivante : s'il y en a une après la
+        # page, la clé de sa dernière ligne est le curseur de la page suivante
+        cles = await database.fetch_all(
+            requete_maisons(ids_communes, ids_maisons, COLONNES_CLE, apres).offset(limite - 1).limit(2)
+        )
+        if len(cles) == 2:
+            entetes["X-Curseur-Suivant"] = encoder_curseur(cles[0])
+    lignes = database.iterate(requete_maisons(ids_communes, ids_maisons, noms, apres, limite))
+    return StreamingResponse(formats.ENCODEURS[format](lignes, noms), media_type=formats.TYPES_CONTENU[format], headers=entetes)
 
 # Endpoint pour récupérer la moyenne de nombres de m2 de terrain des maisons par commune
 @app.get("/moyenne-m2-terrain-maison-par-commune/")
 async def moyenne_m2_terrain_maison_par_commune(nom_commune: str = Query(..., description="Nom de la commune")):
-    if len(nom_commune) == 2 and nom_commune.isdigit():
-        query = select(Dvf).where(
-            (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-            (Dvf.type_local == "Maison") &
-            (Dvf.code_departement == nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            total_surface = 0
-            total_count = 0
-            for row in result:
-                if row.surface_terrain:
-                    total_surface += row.surface_terrain
-                    total_count += 1
-            if total_count > 0:
-                return {nom_commune: total_surface / total_count}
-            else:
-                raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen de terrain par maison non trouvé pour la commune : {nom_commune}")
-        else:
-            raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen de terrain par maison non trouvé pour la commune : {nom_commune}")
-    else:
-        query = select(Dvf).where(
-            (Dvf.nature_mutation.in_(["Vente", "Vente en l'état futur d'achèvement"])) &
-            (Dvf.type_local == "Maison") &
-            (Dvf.nom_commune == nom_commune)
-        )
-        result = await database.fetch_all(query)
-        if result:
-            total_surface = 0
-            total_count = 0
-            for row in result:
-                if row.surface_terrain:
-                    total_surface += row.surface_terrain
-                    total_count += 1
-            if total_count > 0:
-                return {nom_commune: total_surface / total_count}
-            else:
-                raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen de terrain par maison non trouvé pour la commune : {nom_commune}")
-        else:
-            raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen de terrain par maison non trouvé pour la commune : {nom_commune}")
+    stats = await lire_stats(nom_commune, "Maison")
+    if stats is None or not stats["nb_terrain"]:
+        raise HTTPException(status_code=404, detail=f"Nombre de mètres carrés moyen de terrain par maison non trouvé pour la commune : {nom_commune}")
+    return {nom_commune: stats["somme_terrain"] / stats["nb_terrain"]}
+
+def en_sql(requete):
+    return str(requete.compile(dialect=dialecte_sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+# Requêtes des endpoints avec des valeurs d'exemple, dont le plan est vérifié au
+# démarrage et par `python indexes.py`
+def requetes_endpoints(agregats=True):
+    paris, lyon = communes.Lieu("Paris", "75"), communes.Lieu("Lyon", "69")
+    departements = [communes.Lieu(None, "75"), communes.Lieu(None, "69")]
+    requetes = {}
+    for table in (DvfStats, Mutation) if agregats else (Mutation,):
+        for lieu in (paris, departements[0]):
+            for type_local in (None, "Maison", "Appartement"):
+                requetes[f"stats {table.__tablename__} {lieu.nom} {type_local or 'tous'}"] = en_sql(requete_stats(lieu, type_local, table))
+        requetes[f"stats groupées {table.__tablename__} communes"] = en_sql(requete_stats_groupees([paris, lyon], False, None, table))
+        requetes[f"stats groupées {table.__tablename__} départements"] = en_sql(requete_stats_groupees(departements, True, None, table))
+        for lieu in (paris, departements[0]):
+            requetes[f"profil {table.__tablename__} {lieu.nom}"] = en_sql(requete_profil(lieu, table))
+    requetes["prix robuste"] = en_sql(requete_robuste(paris))
+    requetes["quantiles"] = en_sql(requete_quantiles([paris, departements[0]], "Appartement", 2023))
+    requetes["série temporelle"] = en_sql(requete_serie([paris, departements[0]], "Appartement", 202001, 202312))
+    requetes["communes d'un lieu"] = en_sql(requete_ids_communes(paris))
+    requetes["prix zone"] = en_sql(requete_zone(2.25, 48.81, 2.42, 48.90, "Appartement"))
+    requetes["prix rayon"] = en_sql(requete_rayon(2.35, 48.85, 2.0))
+    requetes["carte de chaleur"] = en_sql(requete_grille(12, 2070, 2080, 1400, 1410))
+    requetes["maisons par commune"] = en_sql(requete_maisons([1], [1]))
+    requetes["maisons par commune, page suivante"] = en_sql(requete_maisons([1], [1], ["id_mutation"], [20230101, 1], 100))
+    return requetes
 
 if __name__ == "__main__":
     import uvicorn
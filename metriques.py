@@ -0,0 +1,237 @@
+import contextvars
+import os
+import statistics
+import time
+from collections import deque
+
+from starlette.routing import Match
+
+# Mesures par requête HTTP, exposées par /metrics : durée totale, temps passé dans les
+# requêtes SQL, nombre de requêtes SQL et de lignes qu'elles renvoient, travail fait par SQLite
+# (instructions de sa machine virtuelle, avec le pool de connexions.py seulement : databases ne
+# donne pas accès à la connexion), réponse servie par le cache ou non. Les lignes renvoyées ne
+# disent rien des lignes parcourues : une moyenne sur toute une table renvoie une ligne, mais
+# exécute un nombre d'instructions proportionnel à la table. Les mesures sont regroupées par
+# route (/metrics n'a qu'une entrée par endpoint, quels que soient les chemins demandés), les
+# chemins sans route dans une seule entrée. La mesure de la requête en cours est rangée dans une variable de contexte,
+# que la base instrumentée (BaseMesuree, à la place de databases.Database ou du pool de
+# connexions) complète à chaque lecture. Le middleware est un middleware ASGI : la mesure se
+# termine avec le dernier morceau du corps, les réponses en flux comprises. Les mesures sont
+# propres à chaque processus (un worker uvicorn n'expose que les siennes).
+
+# Nombre de durées gardées par endpoint pour les centiles, et de dernières requêtes exposées
+TAILLE_ECHANTILLON = 1000
+NB_DERNIERES = 100
+# Entrée des chemins qui ne correspondent à aucune route
+NON_RECONNU = "(non reconnu)"
+
+mesure_courante = contextvars.ContextVar("mesure_courante", default=None)
+
+
+class Mesure:
+    __slots__ = ("debut", "duree_sql", "nb_sql", "lignes", "instructions")
+
+    def __init__(self):
+        self.debut = time.perf_counter()
+        self.duree_sql = 0.0
+        self.nb_sql = 0
+        self.lignes = 0
+        # None tant que la base ne compte pas les instructions
+        self.instructions = None
+
+
+class Endpoint:
+    def __init__(self):
+        self.nb_requetes = 0
+        self.nb_erreurs = 0
+        self.duree_totale = 0.0
+        self.duree_sql = 0.0
+        self.nb_sql = 0
+        self.lignes = 0
+        self.instructions = None
+        self.cache = {"hits": 0, "misses": 0, "revalidations": 0}
+        self.durees = deque(maxlen=TAILLE_ECHANTILLON)
+
+    def ajouter(self, mesure, duree, statut, cache):
+        self.nb_requetes += 1
+        self.nb_erreurs += statut >= 500
+        self.duree_totale += duree
+        self.duree_sql += mesure.duree_sql
+        self.nb_sql += mesure.nb_sql
+        self.lignes += mesure.lignes
+        if mesure.instructions is not None:
+            self.instructions = (self.instructions or 0) + mesure.instructions
+        if cache is not None:
+            self.cache[cache] += 1
+        self.durees.append(duree)
+
+    def resume(self):
+        durees = sorted(self.durees)
+        centiles = statistics.quantiles(durees, n=100, method="inclusive") if len(durees) > 1 else durees * 99
+        return {
+            "nb_requetes": self.nb_requetes,
+            "nb_erreurs": self.nb_erreurs,
+            "duree_moyenne_ms": self.duree_totale / self.nb_requetes * 1000,
+            "p50_ms": centiles[49] * 1000,
+            "p99_ms": centiles[98] * 1000,
+            "duree_sql_moyenne_ms": self.duree_sql / self.nb_requetes * 1000,
+            "requetes_sql": self.nb_sql,
+            "lignes_renvoyees": self.lignes,
+            "instructions_sqlite": self.instructions,
+            "cache": self.cache,
+        }
+
+
+class Metriques:
+    def __init__(self):
+        self.debut = time.time()
+        self.endpoints = {}
+        self.dernieres = deque(maxlen=NB_DERNIERES)
+
+    # route : chemin de la route (/items/{id}) ou NON_RECONNU ; chemin : chemin demandé
+    def enregistrer(self, route, chemin, mesure, statut, cache):
+        duree = time.perf_counter() - mesure.debut
+        endpoint = self.endpoints.get(route)
+        if endpoint is None:
+            endpoint = self.endpoints[route] = Endpoint()
+        endpoint.ajouter(mesure, duree, statut, cache)
+        self.dernieres.append({
+            "route": route,
+            "chemin": chemin,
+            "statut": statut,
+            "duree_ms": duree * 1000,
+            "duree_sql_ms": mesure.duree_sql * 1000,
+            "requetes_sql": mesure.nb_sql,
+            "lignes_renvoyees": mesure.lignes,
+            "instructions_sqlite": mesure.instructions,
+            "cache": cache,
+        })
+
+    def resume(self):
+        return {
+            "pid": os.getpid(),
+            "depuis": self.debut,
+            "endpoints": {chemin: endpoint.resume() for chemin, endpoint in sorted(self.endpoints.items())},
+            "dernieres_requetes": list(self.dernieres),
+        }
+
+
+# Cache d'une réponse d'après le middleware de cache.py : en-tête X-Cache, ou 304 d'une revalidation
+def etat_cache(statut, entetes):
+    if statut == 304:
+        return "revalidations"
+    for nom, valeur in entetes:
+        if nom == b"x-cache":
+            return "hits" if valeur == b"HIT" else "misses"
+    return None
+
+
+class MesureRequetes:
+    # metriques : Metriques où sont enregistrées les requêtes ; routes : routes de l'application
+    # (app.routes), qui donnent l'entrée de chaque requête ; exclus : chemins non mesurés
+    def __init__(self, app, metriques, routes=(), exclus=()):
+        self.app = app
+        self.metriques = metriques
+        self.routes = routes
+        self.exclus = set(exclus)
+
+    # La route est cherchée avant l'appel : une réponse servie par le cache ne passe pas par le routeur
+    def route(self, scope):
+        for route in self.routes:
+            correspondance, _ = route.matches(scope)
+            if correspondance != Match.NONE:
+                return route.path
+        return NON_RECONNU
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclus:
+            await self.app(scope, receive, send)
+            return
+        route = self.route(scope)
+        mesure = Mesure()
+        jeton = mesure_courante.set(mesure)
+        reponse = {"statut": 500, "cache": None, "terminee": False}
+
+        async def envoyer(message):
+            if message["type"] == "http.response.start":
+                reponse["statut"] = message["status"]
+                reponse["cache"] = etat_cache(message["status"], message.get("headers", []))
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                reponse["terminee"] = True
+                self.metriques.enregistrer(route, scope["path"], mesure, reponse["statut"], reponse["cache"])
+
+        try:
+            await self.app(scope, receive, envoyer)
+        except Exception:
+            if not reponse["terminee"]:
+                self.metriques.enregistrer(route, scope["path"], mesure, 500, None)
+            raise
+        finally:
+            mesure_courante.reset(jeton)
+
+
+def ajouter_instructions(nombre):
+    mesure = mesure_courante.get()
+    if mesure is not None:
+        mesure.instructions = (mesure.instructions or 0) + nombre
+
+
+# Base de données qui mesure les lectures (durée, nombre de lignes, instructions si la base
+# les compte) pour la requête HTTP en cours ; mêmes méthodes que databases.Database et
+# connexions.PoolLecture
+class BaseMesuree:
+    def __init__(self, base):
+        self.base = base
+        if hasattr(base, "compter_instructions"):
+            base.compter_instructions = ajouter_instructions
+
+    async def connect(self):
+        await self.base.connect()
+
+    async def disconnect(self):
+        await self.base.disconnect()
+
+    async def lire(self, lecture, requete, compter):
+        mesure = mesure_courante.get()
+        if mesure is None:
+            return await lecture(requete)
+        debut = time.perf_counter()
+        try:
+            resultat = await lecture(requete)
+        finally:
+            mesure.duree_sql += time.perf_counter() - debut
+            mesure.nb_sql += 1
+        mesure.lignes += compter(resultat)
+        return resultat
+
+    async def fetch_all(self, requete):
+        return await self.lire(self.base.fetch_all, requete, len)
+
+    async def fetch_one(self, requete):
+        return await self.lire(self.base.fetch_one, requete, lambda ligne: ligne is not None)
+
+    async def fetch_val(self, requete):
+        return await self.lire(self.base.fetch_val, requete, lambda valeur: 1)
+
+    # Seul le temps passé à attendre les lignes compte, pas celui de leur envoi au client
+    async def iterate(self, requete):
+        mesure = mesure_courante.get()
+        if mesure is not None:
+            mesure.nb_sql += 1
+        lignes = self.base.iterate(requete)
+        try:
+            while True:
+                debut = time.perf_counter()
+                try:
+                    ligne = await lignes.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    if mesure is not None:
+                        mesure.duree_sql += time.perf_counter() - debut
+                if mesure is not None:
+                    mesure.lignes += 1
+                yield ligne
+        finally:
+            await lignes.aclose()
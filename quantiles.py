@@ -0,0 +1,90 @@
+import sys
+from itertools import groupby
+from operator import itemgetter
+
+import indexes
+import schema
+from tdigest import TDigest
+
+# Quantiles du prix au m² : un t-digest (tdigest.py) par année, commune et type de local, et
+# par année, département et type de local, calculés à l'ingestion pour chaque partition
+# (année, département). L'API fusionne à la demande les digests d'un ou plusieurs lieux, d'un
+# type de local et d'une année, au lieu de trier les prix à chaque requête.
+
+# lieu : nom de la commune, ou code du département pour les digests de département
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS dvf_quantiles (
+    annee INTEGER,
+    code_departement TEXT,
+    lieu TEXT,
+    type_local TEXT,
+    nb_prix_m2 INTEGER,
+    digest BLOB
+)"""
+
+# Prix au m² des ventes d'une partition, valeur et surface strictement positives
+SELECT_PRIX = f"""SELECT communes.nom_commune, types_local.type_local, mutations.valeur_fonciere / mutations.surface_reelle_bati AS prix_m2
+FROM mutations
+LEFT JOIN communes ON communes.id = mutations.commune_id
+LEFT JOIN types_local ON types_local.id = mutations.type_local_id
+WHERE mutations.departement_id = (SELECT id FROM departements WHERE code_departement = ?)
+AND mutations.date_mutation BETWEEN ? AND ?
+AND mutations.nature_mutation_id IN (SELECT id FROM natures_mutation WHERE nature_mutation IN ({", ".join("?" * len(schema.NATURES_VENTE))}))
+AND mutations.valeur_fonciere > 0 AND mutations.surface_reelle_bati > 0
+ORDER BY communes.nom_commune, types_local.type_local, prix_m2"""
+
+
+def creer_table(conn):
+    conn.execute(CREATE_TABLE)
+    indexes.creer_index_quantiles(conn)
+
+
+# Digests d'une partition : un par commune et type de local, lus en flux, puis ceux du
+# département obtenus en fusionnant les digests de ses communes
+def calculer_partition(conn, annee, code_departement):
+    lignes = []
+    par_type = {}
+    curseur = conn.execute(SELECT_PRIX, (code_departement, *schema.bornes_annee(annee), *schema.NATURES_VENTE))
+    for (nom_commune, type_local), groupe in groupby(curseur, key=itemgetter(0, 1)):
+        digest = TDigest.depuis_valeurs([prix_m2 for _, _, prix_m2 in groupe])
+        if nom_commune is not None:
+            lignes.append((int(annee), code_departement, nom_commune, type_local, digest.nombre(), digest.en_octets()))
+        par_type.setdefault(type_local, []).append(digest)
+    for type_local, digests in par_type.items():
+        digest = TDigest.fusionner(digests)
+        lignes.append((int(annee), code_departement, code_departement, type_local, digest.nombre(), digest.en_octets()))
+    return lignes
+
+
+def remplacer_partitions(conn, partitions):
+    creer_table(conn)
+    with conn:
+        for annee, code_departement in partitions:
+            conn.execute("DELETE FROM dvf_quantiles WHERE code_departement = ? AND annee = ?", (code_departement, int(annee)))
+            conn.executemany(
+                "INSERT INTO dvf_quantiles VALUES (?, ?, ?, ?, ?, ?)", calculer_partition(conn, annee, code_departement)
+            )
+
+
+# Vrai si les digests n'ont jamais été calculés
+def absents(conn):
+    creer_table(conn)
+    return conn.execute("SELECT NOT EXISTS (SELECT 1 FROM dvf_quantiles)").fetchone()[0] == 1
+
+
+def reconstruire(conn):
+    creer_table(conn)
+    with conn:
+        conn.execute("DELETE FROM dvf_quantiles")
+    partitions = schema.toutes_partitions(conn)
+    remplacer_partitions(conn, partitions)
+    print(f"Quantiles calculés pour {len(partitions)} partitions", file=sys.stderr)
+
+
+def mettre_a_jour(conn, partitions):
+    remplacer_partitions(conn, partitions)
+    print(f"Quantiles mis à jour pour {len(partitions)} partitions", file=sys.stderr)
+
+
+# Fusion des digests lus dans dvf_quantiles
+def fusionner(digests):
+    return TDigest.fusionner([TDigest.depuis_octets(octets) for octets in digests])
@@ -0,0 +1,164 @@
+import sys
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+import indexes
+import schema
+
+# Statistiques robustes du prix au m², calculées à l'ingestion. Le prix au m² brut contient
+# des valeurs aberrantes (ventes en bloc, surfaces mal renseignées) qui tirent les moyennes :
+# on garde pour chaque commune et chaque département, par type de local et tous types
+# confondus, la médiane, l'écart absolu médian (MAD), la moyenne tronquée et la moyenne des
+# prix dont le z-score robuste ne dépasse pas SEUIL_Z.
+#
+# Le calcul se fait département par département, en deux lectures en flux. Les prix des
+# communes sont lus triés par commune (identifiant : deux communes homonymes d'un département
+# restent distinctes), type de local et prix, et chaque commune est traitée dès qu'elle est
+# complète. Ceux du département sont lus triés par type de local et prix, dans des tableaux
+# numpy (8 octets par prix) : la médiane et le MAD d'un département demandent tous ses prix.
+
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS dvf_robuste (
+    code_departement TEXT,
+    code_commune TEXT,
+    lieu TEXT,
+    type_local TEXT,
+    nb_prix_m2 INTEGER,
+    moyenne REAL,
+    mediane REAL,
+    mad REAL,
+    moyenne_tronquee REAL,
+    moyenne_filtree REAL,
+    nb_exclus INTEGER
+)"""
+
+# lieu : nom de la commune, ou code du département pour les lignes de département (code_commune
+# NULL) ; type_local NULL : tous types de local confondus
+
+# Part des prix retirée de chaque côté pour la moyenne tronquée
+PROPORTION_TRONQUEE = 0.1
+# Seuil du z-score robuste |prix - médiane| / (1,4826 × MAD), comme le |z| > 3 de l'analyse
+SEUIL_Z = 3.0
+# Facteur qui rend le MAD comparable à un écart type pour une loi normale
+FACTEUR_MAD = 1.4826
+
+# Prix au m² des ventes d'un département, valeur et surface strictement positives
+WHERE_PRIX = f"""WHERE departement_id = (SELECT id FROM departements WHERE code_departement = ?)
+AND nature_mutation_id IN (SELECT id FROM natures_mutation WHERE nature_mutation IN ({", ".join("?" * len(schema.NATURES_VENTE))}))
+AND valeur_fonciere > 0 AND surface_reelle_bati > 0"""
+
+SELECT_PRIX_COMMUNES = f"""SELECT commune_id, type_local_id, valeur_fonciere / surface_reelle_bati AS prix_m2
+FROM mutations
+{WHERE_PRIX} AND commune_id IS NOT NULL
+ORDER BY commune_id, type_local_id, prix_m2"""
+
+SELECT_PRIX_DEPARTEMENT = f"""SELECT type_local_id, valeur_fonciere / surface_reelle_bati AS prix_m2
+FROM mutations
+{WHERE_PRIX}
+ORDER BY type_local_id, prix_m2"""
+
+
+def creer_table(conn):
+    # Table des versions précédentes, sans code_commune : recalculée
+    if schema.existe(conn, "dvf_robuste") and "code_commune" not in {ligne[1] for ligne in conn.execute("PRAGMA table_info(dvf_robuste)")}:
+        conn.execute("DROP TABLE dvf_robuste")
+    conn.execute(CREATE_TABLE)
+    indexes.creer_index_robuste(conn)
+
+
+def mediane(valeurs_triees):
+    milieu = len(valeurs_triees) // 2
+    if len(valeurs_triees) % 2:
+        return float(valeurs_triees[milieu])
+    return float(valeurs_triees[milieu - 1] + valeurs_triees[milieu]) / 2
+
+
+# Statistiques d'un tableau numpy de prix trié
+def statistiques(prix):
+    nombre = len(prix)
+    centre = mediane(prix)
+    ecarts = np.abs(prix - centre)
+    mad = mediane(np.sort(ecarts))
+    coupe = int(nombre * PROPORTION_TRONQUEE)
+    gardes = prix[ecarts <= SEUIL_Z * FACTEUR_MAD * mad] if mad > 0 else prix
+    return (
+        nombre,
+        float(prix.mean()),
+        centre,
+        mad,
+        float(prix[coupe:nombre - coupe].mean()),
+        float(gardes.mean()),
+        nombre - len(gardes),
+    )
+
+
+def tableau(lignes):
+    return np.fromiter((ligne[-1] for ligne in lignes), dtype=float)
+
+
+# Libellé de chaque identifiant d'une table de dimension
+def libelles(conn, table, *colonnes):
+    return {ligne[0]: ligne[1:] for ligne in conn.execute(f"SELECT id, {', '.join(colonnes)} FROM {table}")}
+
+
+# Lignes de dvf_robuste des communes d'un département puis du département, prix lus en flux
+def calculer_departement(conn, code_departement):
+    communes = libelles(conn, "communes", "code_commune", "nom_commune")
+    types_local = {identifiant: type_local for identifiant, (type_local,) in libelles(conn, "types_local", "type_local").items()}
+    parametres = (code_departement, *schema.NATURES_VENTE)
+    lignes = []
+    for commune_id, lignes_commune in groupby(conn.execute(SELECT_PRIX_COMMUNES, parametres), key=itemgetter(0)):
+        code_commune, nom_commune = communes[commune_id]
+        if nom_commune is None:
+            continue
+        par_type = []
+        for type_local_id, lignes_type in groupby(lignes_commune, key=itemgetter(1)):
+            prix = tableau(lignes_type)
+            if type_local_id is not None:
+                lignes.append((code_departement, code_commune, nom_commune, types_local[type_local_id], *statistiques(prix)))
+            par_type.append(prix)
+        lignes.append((code_departement, code_commune, nom_commune, None, *statistiques(np.sort(np.concatenate(par_type)))))
+
+    par_type = []
+    for type_local_id, lignes_type in groupby(conn.execute(SELECT_PRIX_DEPARTEMENT, parametres), key=itemgetter(0)):
+        prix = tableau(lignes_type)
+        if type_local_id is not None:
+            lignes.append((code_departement, None, code_departement, types_local[type_local_id], *statistiques(prix)))
+        par_type.append(prix)
+    if par_type:
+        lignes.append((code_departement, None, code_departement, None, *statistiques(np.sort(np.concatenate(par_type)))))
+    return lignes
+
+
+def remplacer_departements(conn, departements):
+    creer_table(conn)
+    with conn:
+        for code_departement in departements:
+            conn.execute("DELETE FROM dvf_robuste WHERE code_departement = ?", (code_departement,))
+            conn.executemany(
+                "INSERT INTO dvf_robuste VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                calculer_departement(conn, code_departement),
+            )
+
+
+# Vrai si les statistiques robustes n'ont jamais été calculées
+def absentes(conn):
+    creer_table(conn)
+    return conn.execute("SELECT NOT EXISTS (SELECT 1 FROM dvf_robuste)").fetchone()[0] == 1
+
+
+def reconstruire(conn):
+    creer_table(conn)
+    with conn:
+        conn.execute("DELETE FROM dvf_robuste")
+    departements = [code for (code,) in conn.execute("SELECT code_departement FROM departements ORDER BY code_departement")]
+    remplacer_departements(conn, departements)
+    print(f"Statistiques robustes calculées pour {len(departements)} départements", file=sys.stderr)
+
+
+# Recalcule les départements des partitions (année, département) modifiées
+def mettre_a_jour(conn, partitions):
+    departements = sorted({code_departement for _, code_departement in partitions})
+    remplacer_departements(conn, departements)
+    print(f"Statistiques robustes mises à jour pour {len(departements)} départements", file=sys.stderr)
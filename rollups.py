@@ -0,0 +1,105 @@
+import sys
+
+import agregation
+import indexes
+
+# Table d'agrégats précalculés à l'ingestion : une ligne par (année, commune, type de local,
+# nature de mutation) avec de quoi recalculer moyennes, variances, min et max sans relire dvf
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS dvf_stats (
+    annee INTEGER,
+    code_departement TEXT,
+    code_commune TEXT,
+    nom_commune TEXT,
+    type_local TEXT,
+    nature_mutation TEXT,
+    nb_lignes INTEGER,
+    nb_prix_m2 INTEGER,
+    somme_prix_m2 REAL,
+    somme_carres_prix_m2 REAL,
+    min_prix_m2 REAL,
+    max_prix_m2 REAL,
+    nb_surface INTEGER,
+    somme_surface REAL,
+    nb_terrain INTEGER,
+    somme_terrain REAL
+)"""
+
+# Agrégats calculés par agregation.py, par groupe de ventes de même année, département,
+# commune, type de local et nature de mutation. Les groupes sont ensuite fusionnés par libellé
+# du type de local : deux codes de même libellé forment un seul groupe.
+CLES = ["annee", "departement_id", "commune_id", "type_local_id", "nature_mutation_id"]
+
+OPERATIONS = [
+    ("nb_lignes", "prix_m2", "size"),
+    ("nb_prix_m2", "prix_m2", "count"),
+    ("somme_prix_m2", "prix_m2", "sum"),
+    ("somme_carres_prix_m2", "carre_prix_m2", "sum"),
+    ("min_prix_m2", "prix_m2", "min"),
+    ("max_prix_m2", "prix_m2", "max"),
+    ("nb_surface", "surface_reelle_bati", "count"),
+    ("somme_surface", "surface_reelle_bati", "sum"),
+    ("nb_terrain", "surface_terrain_non_nulle", "count"),
+    ("somme_terrain", "surface_terrain", "sum"),
+]
+
+COLONNES_TABLE = [
+    "annee",
+    "code_departement",
+    "code_commune",
+    "nom_commune",
+    "type_local",
+    "nature_mutation",
+    *(nom for nom, _, _ in OPERATIONS),
+]
+
+
+def creer_table(conn):
+    conn.execute(CREATE_TABLE)
+    indexes.creer_index_stats(conn)
+
+
+# Vrai si les agrégats n'ont jamais été calculés (base créée avant leur ajout)
+def absents(conn):
+    creer_table(conn)
+    return conn.execute("SELECT NOT EXISTS (SELECT 1 FROM dvf_stats)").fetchone()[0] == 1
+
+
+# Agrégats partiels d'un bloc de ventes (agregation.Agregats)
+def partiel(ventes):
+    valeurs = ventes.assign(
+        carre_prix_m2=ventes["prix_m2"] * ventes["prix_m2"],
+        surface_terrain_non_nulle=ventes["surface_terrain"].where(ventes["surface_terrain"] != 0),
+    )
+    return agregation.regrouper(valeurs, CLES, OPERATIONS)
+
+
+# Lignes de dvf_stats à partir des agrégats partiels
+def calculer(conn, partiels):
+    agregation.ajouter_libelle(conn, partiels, "type_local_id", "types_local", "type_local")
+    stats = agregation.fusionner(partiels, ["annee", "departement_id", "commune_id", "type_local", "nature_mutation_id"], OPERATIONS)
+    agregation.ajouter_libelle(conn, stats, "departement_id", "departements", "code_departement")
+    agregation.ajouter_libelle(conn, stats, "commune_id", "communes", "code_commune")
+    agregation.ajouter_libelle(conn, stats, "commune_id", "communes", "nom_commune")
+    agregation.ajouter_libelle(conn, stats, "nature_mutation_id", "natures_mutation", "nature_mutation")
+    return stats[COLONNES_TABLE]
+
+
+# Recalcule tous les agrégats, à partir des agrégats partiels des ventes de toute la table
+def reconstruire(conn, partiels):
+    creer_table(conn)
+    with conn:
+        conn.execute("DELETE FROM dvf_stats")
+        agregation.inserer(conn, "dvf_stats", calculer(conn, partiels))
+
+
+# Recalcule seulement les agrégats des partitions (année, département) données, après un
+# chargement incrémental, à partir des agrégats partiels des ventes de ces partitions
+def mettre_a_jour(conn, partitions, partiels):
+    creer_table(conn)
+    with conn:
+        conn.executemany(
+            "DELETE FROM dvf_stats WHERE code_departement = ? AND annee = ?",
+            [(code_departement, int(annee)) for annee, code_departement in partitions],
+        )
+        agregation.inserer(conn, "dvf_stats", calculer(conn, partiels))
+    print(f"Agrégats mis à jour pour {len(partitions)} partitions", file=sys.stderr)
@@ -0,0 +1,273 @@
+import sys
+
+# Schéma de stockage partagé par le chargement (createdb.py) et l'API (main.py).
+#
+# Les ventes sont stockées dans la table mutations : valeurs numériques en REAL/INTEGER,
+# dates en entiers AAAAMMJJ, et les libellés répétés sur chaque ligne (communes,
+# départements, natures de mutation, types de local, natures de culture) remplacés par
+# l'identifiant d'une table de dimension. La vue dvf redonne les colonnes des fichiers DVF.
+
+# Colonnes des fichiers DVF et de la vue dvf, dans l'ordre du fichier geo-dvf
+COLONNES = [
+    ("id_mutation", "TEXT"),
+    ("date_mutation", "TEXT"),
+    ("numero_disposition", "TEXT"),
+    ("nature_mutation", "TEXT"),
+    ("valeur_fonciere", "REAL"),
+    ("adresse_numero", "TEXT"),
+    ("adresse_suffixe", "TEXT"),
+    ("adresse_nom_voie", "TEXT"),
+    ("adresse_code_voie", "TEXT"),
+    ("code_postal", "TEXT"),
+    ("code_commune", "TEXT"),
+    ("nom_commune", "TEXT"),
+    ("code_departement", "TEXT"),
+    ("ancien_code_commune", "TEXT"),
+    ("ancien_nom_commune", "TEXT"),
+    ("id_parcelle", "TEXT"),
+    ("ancien_id_parcelle", "TEXT"),
+    ("numero_volume", "TEXT"),
+    ("lot1_numero", "TEXT"),
+    ("lot1_surface_carrez", "REAL"),
+    ("lot2_numero", "TEXT"),
+    ("lot2_surface_carrez", "REAL"),
+    ("lot3_numero", "TEXT"),
+    ("lot3_surface_carrez", "REAL"),
+    ("lot4_numero", "TEXT"),
+    ("lot4_surface_carrez", "REAL"),
+    ("lot5_numero", "TEXT"),
+    ("lot5_surface_carrez", "REAL"),
+    ("nombre_lots", "INTEGER"),
+    ("code_type_local", "TEXT"),
+    ("type_local", "TEXT"),
+    ("surface_reelle_bati", "REAL"),
+    ("nombre_pieces_principales", "INTEGER"),
+    ("code_nature_culture", "TEXT"),
+    ("nature_culture", "TEXT"),
+    ("code_nature_culture_speciale", "TEXT"),
+    ("nature_culture_speciale", "TEXT"),
+    ("surface_terrain", "REAL"),
+    ("longitude", "REAL"),
+    ("latitude", "REAL"),
+]
+NOMS_COLONNES = [nom for nom, _ in COLONNES]
+
+# Tables de dimension : nom de la table -> colonnes qui forment la clé d'une entrée
+DIMENSIONS = {
+    "departements": ["code_departement"],
+    "communes": ["code_commune", "nom_commune", "departement_id"],
+    "natures_mutation": ["nature_mutation"],
+    "types_local": ["code_type_local", "type_local"],
+    "natures_culture": ["code_nature_culture", "nature_culture"],
+    "natures_culture_speciale": ["code_nature_culture_speciale", "nature_culture_speciale"],
+}
+
+# Colonne de mutations qui référence chaque dimension
+REFERENCES = {
+    "departements": "departement_id",
+    "communes": "commune_id",
+    "natures_mutation": "nature_mutation_id",
+    "types_local": "type_local_id",
+    "natures_culture": "nature_culture_id",
+    "natures_culture_speciale": "nature_culture_speciale_id",
+}
+
+# Colonnes de la table mutations
+COLONNES_MUTATIONS = [
+    ("id_mutation", "TEXT"),
+    ("date_mutation", "INTEGER"),
+    ("numero_disposition", "INTEGER"),
+    ("nature_mutation_id", "INTEGER"),
+    ("valeur_fonciere", "REAL"),
+    ("adresse_numero", "TEXT"),
+    ("adresse_suffixe", "TEXT"),
+    ("adresse_nom_voie", "TEXT"),
+    ("adresse_code_voie", "TEXT"),
+    ("code_postal", "TEXT"),
+    ("commune_id", "INTEGER"),
+    ("departement_id", "INTEGER"),
+    ("ancien_code_commune", "TEXT"),
+    ("ancien_nom_commune", "TEXT"),
+    ("id_parcelle", "TEXT"),
+    ("ancien_id_parcelle", "TEXT"),
+    ("numero_volume", "TEXT"),
+    ("lot1_numero", "TEXT"),
+    ("lot1_surface_carrez", "REAL"),
+    ("lot2_numero", "TEXT"),
+    ("lot2_surface_carrez", "REAL"),
+    ("lot3_numero", "TEXT"),
+    ("lot3_surface_carrez", "REAL"),
+    ("lot4_numero", "TEXT"),
+    ("lot4_surface_carrez", "REAL"),
+    ("lot5_numero", "TEXT"),
+    ("lot5_surface_carrez", "REAL"),
+    ("nombre_lots", "INTEGER"),
+    ("type_local_id", "INTEGER"),
+    ("surface_reelle_bati", "REAL"),
+    ("nombre_pieces_principales", "INTEGER"),
+    ("nature_culture_id", "INTEGER"),
+    ("nature_culture_speciale_id", "INTEGER"),
+    ("surface_terrain", "REAL"),
+    ("longitude", "REAL"),
+    ("latitude", "REAL"),
+]
+NOMS_MUTATIONS = [nom for nom, _ in COLONNES_MUTATIONS]
+
+# Natures de mutation retenues pour les prix
+NATURES_VENTE = ["Vente", "Vente en l'état futur d'achèvement"]
+
+
+# Bornes (entières) des dates d'une année
+def bornes_annee(annee):
+    annee = int(annee)
+    return annee * 10000 + 101, annee * 10000 + 1231
+
+
+# Partitions (année, département) présentes dans mutations
+def toutes_partitions(conn):
+    return conn.execute(
+        """SELECT DISTINCT mutations.date_mutation / 10000, departements.code_departement
+           FROM mutations JOIN departements ON departements.id = mutations.departement_id
+           WHERE mutations.date_mutation IS NOT NULL"""
+    ).fetchall()
+
+
+def creer_dimensions(conn):
+    for table, colonnes in DIMENSIONS.items():
+        definitions = ", ".join(f"{nom} {'INTEGER' if nom.endswith('_id') else 'TEXT'}" for nom in colonnes)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, {definitions}, UNIQUE ({', '.join(colonnes)}))"
+        )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_communes_nom ON communes (nom_commune)")
+
+
+# Clé explicite id : l'index R*Tree des coordonnées (spatial.py) y fait référence, et
+# contrairement au rowid implicite elle n'est pas renumérotée par VACUUM
+def creer_table_mutations(conn, table="mutations"):
+    colonnes = ",\n    ".join(f"{nom} {type_sql}" for nom, type_sql in COLONNES_MUTATIONS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (\n    id INTEGER PRIMARY KEY,\n    {colonnes}\n)")
+
+
+# Colonnes ajoutées à la vue dvf après celles des fichiers DVF : clés entières de mutations,
+# qui permettent de filtrer et trier la vue en utilisant les index de mutations
+COLONNES_TECHNIQUES_VUE = {
+    "commune_id": "mutations.commune_id",
+    "type_local_id": "mutations.type_local_id",
+    "date_mutation_entier": "mutations.date_mutation",
+    "id": "mutations.id",
+}
+
+
+# Vue dvf : les colonnes des fichiers DVF reconstituées à partir de mutations et des dimensions.
+# Elle est recréée à chaque fois pour suivre les changements de définition.
+def creer_vue(conn):
+    expressions = {nom: f"mutations.{nom}" for nom in NOMS_COLONNES if nom in NOMS_MUTATIONS}
+    expressions["date_mutation"] = (
+        "CASE WHEN mutations.date_mutation IS NOT NULL THEN printf('%04d-%02d-%02d', mutations.date_mutation / 10000, "
+        "mutations.date_mutation / 100 % 100, mutations.date_mutation % 100) END"
+    )
+    expressions["numero_disposition"] = (
+        "CASE WHEN mutations.numero_disposition IS NOT NULL THEN printf('%06d', mutations.numero_disposition) END"
+    )
+    jointures = []
+    for table, colonnes in DIMENSIONS.items():
+        for nom in colonnes:
+            if not nom.endswith("_id"):
+                expressions[nom] = f"{table}.{nom}"
+        jointures.append(f"LEFT JOIN {table} ON {table}.id = mutations.{REFERENCES[table]}")
+    expressions.update(COLONNES_TECHNIQUES_VUE)
+    selection = ",\n    ".join(f"{expressions[nom]} AS {nom}" for nom in NOMS_COLONNES + list(COLONNES_TECHNIQUES_VUE))
+    conn.execute("DROP VIEW IF EXISTS dvf")
+    conn.execute(f"CREATE VIEW dvf AS SELECT\n    {selection}\nFROM mutations\n" + "\n".join(jointures))
+
+
+def existe(conn, nom, type_objet="table"):
+    return conn.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?)", (type_objet, nom)).fetchone()[0] == 1
+
+
+# Création du schéma complet, avec migration d'une table dvf créée par une version précédente
+def creer_schema(conn):
+    if existe(conn, "dvf", "table"):
+        migrer(conn)
+    elif existe(conn, "mutations") and "id" not in {ligne[1] for ligne in conn.execute("PRAGMA table_info(mutations)")}:
+        ajouter_cle_mutations(conn)
+    creer_dimensions(conn)
+    creer_table_mutations(conn)
+    creer_vue(conn)
+
+
+# Migration d'une ancienne table dvf (libellés en texte sur chaque ligne) vers mutations et
+# les tables de dimension. Les agrégats sont supprimés pour être recalculés.
+def migrer(conn):
+    print("Migration de l'ancienne table dvf vers le schéma normalisé", file=sys.stderr)
+    with conn:
+        conn.execute("ALTER TABLE dvf RENAME TO dvf_ancienne")
+        creer_dimensions(conn)
+        creer_table_mutations(conn)
+        conn.execute(
+            """INSERT INTO departements (code_departement)
+               SELECT DISTINCT NULLIF(code_departement, '') FROM dvf_ancienne WHERE NULLIF(code_departement, '') IS NOT NULL"""
+        )
+        conn.execute(
+            """INSERT INTO communes (code_commune, nom_commune, departement_id)
+               SELECT DISTINCT NULLIF(a.code_commune, ''), NULLIF(a.nom_commune, ''), d.id
+               FROM dvf_ancienne a LEFT JOIN departements d ON d.code_departement = a.code_departement
+               WHERE NULLIF(a.code_commune, '') IS NOT NULL OR NULLIF(a.nom_commune, '') IS NOT NULL"""
+        )
+        for table, colonnes in DIMENSIONS.items():
+            if table in ("departements", "communes"):
+                continue
+            valeurs = ", ".join(f"NULLIF({nom}, '')" for nom in colonnes)
+            non_vide = " OR ".join(f"NULLIF({nom}, '') IS NOT NULL" for nom in colonnes)
+            conn.execute(
+                f"INSERT INTO {table} ({', '.join(colonnes)}) SELECT DISTINCT {valeurs} FROM dvf_ancienne WHERE {non_vide}"
+            )
+
+        expressions = []
+        for nom, type_sql in COLONNES_MUTATIONS:
+            if nom == "date_mutation":
+                expressions.append("CAST(replace(NULLIF(a.date_mutation, ''), '-', '') AS INTEGER)")
+            elif nom == "numero_disposition":
+                expressions.append("CAST(NULLIF(a.numero_disposition, '') AS INTEGER)")
+            elif nom in REFERENCES.values():
+                table = next(table for table, reference in REFERENCES.items() if reference == nom)
+                expressions.append(f"{table}.id")
+            elif type_sql == "TEXT":
+                expressions.append(f"NULLIF(a.{nom}, '')")
+            else:
+                expressions.append(f"CAST(NULLIF(a.{nom}, '') AS {type_sql})")
+        jointures = ["LEFT JOIN departements ON departements.code_departement = NULLIF(a.code_departement, '')"]
+        jointures.append(
+            "LEFT JOIN communes ON communes.code_commune IS NULLIF(a.code_commune, '') "
+            "AND communes.nom_commune IS NULLIF(a.nom_commune, '') AND communes.departement_id IS departements.id"
+        )
+        for table, colonnes in DIMENSIONS.items():
+            if table in ("departements", "communes"):
+                continue
+            conditions = " AND ".join(f"{table}.{nom} IS NULLIF(a.{nom}, '')" for nom in colonnes)
+            jointures.append(f"LEFT JOIN {table} ON {conditions}")
+        conn.execute(
+            f"INSERT INTO mutations ({', '.join(NOMS_MUTATIONS)}) SELECT {', '.join(expressions)} FROM dvf_ancienne a "
+            + " ".join(jointures)
+            + " ORDER BY a.rowid"
+        )
+        conn.execute("DROP TABLE dvf_ancienne")
+        conn.execute("DROP TABLE IF EXISTS dvf_stats")
+    conn.execute("VACUUM")
+
+
+# Migration d'une table mutations sans clé explicite : elle est recréée avec la colonne id,
+# égale à l'ancien rowid. Ses index et ses triggers disparaissent avec elle ; l'index R*Tree
+# est supprimé pour être reconstruit, avec ses triggers, au prochain chargement.
+def ajouter_cle_mutations(conn):
+    print("Migration de la table mutations vers une clé explicite", file=sys.stderr)
+    colonnes = ", ".join(NOMS_MUTATIONS)
+    with conn:
+        # La vue dvf empêcherait de renommer la table ; elle est recréée par creer_vue
+        conn.execute("DROP VIEW IF EXISTS dvf")
+        conn.execute("DROP TABLE IF EXISTS mutations_rtree")
+        creer_table_mutations(conn, "mutations_cle")
+        conn.execute(f"INSERT INTO mutations_cle (id, {colonnes}) SELECT rowid, {colonnes} FROM mutations ORDER BY rowid")
+        conn.execute("DROP TABLE mutations")
+        conn.execute("ALTER TABLE mutations_cle RENAME TO mutations")
+    conn.execute("VACUUM")
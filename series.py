@@ -0,0 +1,169 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+import agregation
+import indexes
+import schema
+
+# Agrégats mensuels des ventes pour les séries temporelles du prix au m². La date est déjà un
+# entier AAAAMMJJ dans mutations, le mois AAAAMM s'en déduit par division entière. Une ligne
+# par commune, type de local et mois, et par département, type de local et mois (lieu : nom de
+# la commune ou code du département), calculées avec pandas (agregation.py). Les
+# sommes se cumulent : l'API regroupe les mois en trimestres ou en années, additionne
+# plusieurs lieux et tous les types de local.
+
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS dvf_mensuel (
+    code_departement TEXT,
+    lieu TEXT,
+    type_local TEXT,
+    mois INTEGER,
+    nb_ventes INTEGER,
+    nb_prix_m2 INTEGER,
+    somme_prix_m2 REAL,
+    somme_valeur REAL,
+    somme_surface REAL
+)"""
+
+COLONNES_TABLE = ["code_departement", "lieu", "type_local", "mois", "nb_ventes", "nb_prix_m2", "somme_prix_m2", "somme_valeur", "somme_surface"]
+
+# Colonnes des lignes lues par l'API pour calculer une série
+COLONNES = ("mois", "nb_ventes", "nb_prix_m2", "somme_prix_m2", "somme_valeur", "somme_surface")
+
+# Pas de temps des séries : nombre de mois par période
+PAS = {"mois": 1, "trimestre": 3, "annee": 12}
+
+
+def bornes_mois(annee):
+    annee = int(annee)
+    return annee * 100 + 1, annee * 100 + 12
+
+
+def creer_table(conn):
+    conn.execute(CREATE_TABLE)
+    indexes.creer_index_mensuel(conn)
+
+
+# Agrégats partiels d'un bloc de ventes (agregation.Agregats) par commune, type de local,
+# nature de mutation et mois. somme_valeur et somme_surface ne portent que sur les ventes dont
+# le prix au m² est connu, pour que leur rapport soit un prix au m².
+CLES = ["departement_id", "commune_id", "type_local_id", "nature_mutation_id", "mois"]
+
+OPERATIONS = [
+    ("nb_ventes", "prix_m2", "size"),
+    ("nb_prix_m2", "prix_m2", "count"),
+    ("somme_prix_m2", "prix_m2", "sum"),
+    ("somme_valeur", "valeur_prix_m2", "sum"),
+    ("somme_surface", "surface_prix_m2", "sum"),
+]
+
+
+def partiel(ventes):
+    connu = ventes["prix_m2"].notna()
+    valeurs = ventes.assign(
+        valeur_prix_m2=ventes["valeur_fonciere"].where(connu),
+        surface_prix_m2=ventes["surface_reelle_bati"].where(connu),
+    )
+    return agregation.regrouper(valeurs, CLES, OPERATIONS)
+
+
+# Lignes de dvf_mensuel à partir des agrégats partiels : ventes par commune, type de local et
+# mois, puis par département, type de local et mois (ventes sans commune comprises)
+def calculer_lignes(conn, partiels):
+    agregation.ajouter_libelle(conn, partiels, "nature_mutation_id", "natures_mutation", "nature_mutation")
+    partiels = partiels[partiels["nature_mutation"].isin(schema.NATURES_VENTE)].copy()
+    agregation.ajouter_libelle(conn, partiels, "type_local_id", "types_local", "type_local")
+    agregation.ajouter_libelle(conn, partiels, "commune_id", "communes", "nom_commune", "lieu")
+    communes = agregation.fusionner(
+        partiels[partiels["lieu"].notna()], ["departement_id", "commune_id", "type_local_id", "mois"], OPERATIONS
+    )
+    agregation.ajouter_libelle(conn, communes, "commune_id", "communes", "nom_commune", "lieu")
+    agregation.ajouter_libelle(conn, communes, "type_local_id", "types_local", "type_local")
+    departements = agregation.fusionner(partiels, ["departement_id", "type_local", "mois"], OPERATIONS)
+    lignes = pd.concat([communes, departements], ignore_index=True)
+    agregation.ajouter_libelle(conn, lignes, "departement_id", "departements", "code_departement")
+    lignes["lieu"] = lignes["lieu"].fillna(lignes["code_departement"])
+    return lignes[COLONNES_TABLE]
+
+
+# Vrai si les agrégats mensuels n'ont jamais été calculés
+def absents(conn):
+    creer_table(conn)
+    return conn.execute("SELECT NOT EXISTS (SELECT 1 FROM dvf_mensuel)").fetchone()[0] == 1
+
+
+def reconstruire(conn, partiels):
+    creer_table(conn)
+    with conn:
+        conn.execute("DELETE FROM dvf_mensuel")
+        agregation.inserer(conn, "dvf_mensuel", calculer_lignes(conn, partiels))
+    print("Agrégats mensuels calculés", file=sys.stderr)
+
+
+# Recalcule les partitions (année, département) données à partir des agrégats partiels de
+# leurs ventes
+def mettre_a_jour(conn, partitions, partiels):
+    creer_table(conn)
+    with conn:
+        conn.executemany(
+            "DELETE FROM dvf_mensuel WHERE code_departement = ? AND mois BETWEEN ? AND ?",
+            [(code_departement, *bornes_mois(annee)) for annee, code_departement in partitions],
+        )
+        agregation.inserer(conn, "dvf_mensuel", calculer_lignes(conn, partiels))
+    print(f"Agrégats mensuels mis à jour pour {len(partitions)} partitions", file=sys.stderr)
+
+
+def libelle(periode, pas):
+    annee, rang = divmod(periode, 12 // PAS[pas])
+    if pas == "mois":
+        return f"{annee}-{rang + 1:02d}"
+    if pas == "trimestre":
+        return f"{annee}-T{rang + 1}"
+    return str(annee)
+
+
+# Sommes glissantes sur les `fenetre` dernières périodes (moins au début de la série)
+def sommes_glissantes(valeurs, fenetre):
+    cumul = np.concatenate(([0.0], np.cumsum(valeurs)))
+    fin = np.arange(1, len(valeurs) + 1)
+    return cumul[fin] - cumul[np.maximum(fin - fenetre, 0)]
+
+
+def rapport(numerateur, denominateur):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominateur > 0, numerateur / denominateur, np.nan)
+
+
+# Série à partir des lignes (valeurs des COLONNES, un même mois pouvant revenir plusieurs
+# fois) : regroupement au pas demandé, périodes sans vente comprises entre la première et la
+# dernière, et lissage par moyenne glissante sur `lissage` périodes (rapport des sommes
+# glissantes, chaque période pesant son nombre de ventes)
+def calculer(lignes, pas="mois", lissage=1):
+    if not lignes:
+        return []
+    valeurs = np.array(lignes, dtype=float)
+    mois = valeurs[:, 0].astype(np.int64)
+    # Mois AAAAMM -> rang de la période depuis l'an 0
+    periodes = ((mois // 100) * 12 + mois % 100 - 1) // PAS[pas]
+    premiere = periodes.min()
+    totaux = np.zeros((periodes.max() - premiere + 1, valeurs.shape[1] - 1))
+    np.add.at(totaux, periodes - premiere, np.nan_to_num(valeurs[:, 1:]))
+    nb_ventes, nb_prix_m2, somme_prix_m2, somme_valeur, somme_surface = totaux.T
+    colonnes = {
+        "nb_ventes": nb_ventes.astype(np.int64),
+        "nb_prix_m2": nb_prix_m2.astype(np.int64),
+        "prix_moyen_m2": rapport(somme_prix_m2, nb_prix_m2),
+        "prix_m2": rapport(somme_valeur, somme_surface),
+    }
+    if lissage > 1:
+        colonnes["prix_moyen_m2_lisse"] = rapport(sommes_glissantes(somme_prix_m2, lissage), sommes_glissantes(nb_prix_m2, lissage))
+        colonnes["prix_m2_lisse"] = rapport(sommes_glissantes(somme_valeur, lissage), sommes_glissantes(somme_surface, lissage))
+    serie = []
+    for i in range(len(totaux)):
+        point = {"periode": libelle(premiere + i, pas)}
+        for nom, colonne in colonnes.items():
+            valeur = colonne[i].item()
+            point[nom] = None if valeur != valeur else valeur
+        serie.append(point)
+    return serie
@@ -0,0 +1,41 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import uvicorn
+
+# Lancement de l'API avec plusieurs processus workers uvicorn. La base est chargée et préparée
+# une seule fois ici (chargement incrémental du CSV, index, agrégats, vérification des plans,
+# export Parquet) avant de lancer les workers : ils démarrent avec DVF_BASE_PREPAREE=1, ouvrent
+# la base sans la modifier et lisent au travers d'un pool de connexions en lecture seule
+# (DVF_CONNEXIONS par worker, voir connexions.py).
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lance l'API DVF avec plusieurs workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Nombre de processus (un par cœur par défaut)")
+    parser.add_argument("--connexions", type=int, default=4, help="Connexions SQLite en lecture seule par worker (0 : databases)")
+    args = parser.parse_args()
+
+    # Les variables sont lues à l'import de main, ici comme dans les workers
+    os.environ["DVF_CONNEXIONS"] = str(args.connexions)
+    os.environ["DVF_BASE_PREPAREE"] = "1"
+    # Le cache en mémoire n'est pas partagé entre les workers
+    if args.workers > 1:
+        os.environ.setdefault("DVF_CACHE", "sqlite")
+
+    import main as api
+
+    if Path(api.CSV_FILE).exists():
+        modifiees = api.insert_data_from_csv()
+        print(f"{len(modifiees)} partitions modifiées", file=sys.stderr)
+    api.preparer_base()
+
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
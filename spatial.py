@@ -0,0 +1,171 @@
+import math
+import sys
+
+import numpy as np
+import pandas as pd
+
+import agregation
+import schema
+
+# Index spatial des ventes. Deux structures, construites à l'ingestion :
+# - mutations_rtree, table R*Tree des coordonnées de chaque vente (id = id de mutations),
+#   tenue à jour par des triggers sur mutations. Comme les index, elle est supprimée avant un
+#   chargement en masse puis reconstruite en une fois ;
+# - dvf_grille, agrégats du prix au m² par case de la grille des tuiles de carte (x, y au
+#   niveau de zoom z, projection Web Mercator), par partition (année, département) pour être
+#   mise à jour avec les autres agrégats (calcul dans agregation.py).
+
+CREATE_RTREE = "CREATE VIRTUAL TABLE IF NOT EXISTS mutations_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)"
+
+TRIGGERS = {
+    "mutations_rtree_insertion": """CREATE TRIGGER IF NOT EXISTS mutations_rtree_insertion AFTER INSERT ON mutations
+        WHEN NEW.longitude IS NOT NULL AND NEW.latitude IS NOT NULL
+        BEGIN
+            INSERT INTO mutations_rtree VALUES (NEW.id, NEW.longitude, NEW.longitude, NEW.latitude, NEW.latitude);
+        END""",
+    "mutations_rtree_suppression": """CREATE TRIGGER IF NOT EXISTS mutations_rtree_suppression AFTER DELETE ON mutations
+        BEGIN
+            DELETE FROM mutations_rtree WHERE id = OLD.id;
+        END""",
+}
+
+CREATE_GRILLE = """CREATE TABLE IF NOT EXISTS dvf_grille (
+    zoom INTEGER,
+    x INTEGER,
+    y INTEGER,
+    annee INTEGER,
+    code_departement TEXT,
+    nb_prix_m2 INTEGER,
+    somme_prix_m2 REAL
+)"""
+
+INDEX_GRILLE = {
+    "idx_dvf_grille_case": "CREATE INDEX IF NOT EXISTS idx_dvf_grille_case ON dvf_grille (zoom, x, y, nb_prix_m2, somme_prix_m2)",
+    "idx_dvf_grille_partition": "CREATE INDEX IF NOT EXISTS idx_dvf_grille_partition ON dvf_grille (code_departement, annee)",
+}
+
+# Niveaux de zoom précalculés (une case de zoom 14 fait environ 1,7 km de côté en France)
+ZOOMS = (6, 8, 10, 12, 14)
+
+# Latitude maximale de la projection Web Mercator
+LATITUDE_MAX = 85.05112878
+
+
+# Coordonnées de la tuile (x, y) qui contient un point, au niveau de zoom donné
+def tuile_x(longitude, zoom):
+    n = 1 << zoom
+    return min(n - 1, max(0, int((longitude + 180) / 360 * n)))
+
+
+def tuile_y(latitude, zoom):
+    n = 1 << zoom
+    latitude = math.radians(max(-LATITUDE_MAX, min(LATITUDE_MAX, latitude)))
+    return min(n - 1, max(0, int((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 * n)))
+
+
+# Mêmes calculs sur des tableaux numpy pour la grille : une fonction Python appelée sur
+# chaque vente coûterait plus que le regroupement lui-même. astype tronque vers zéro comme int().
+def tuiles_x(longitudes, zoom):
+    n = 1 << zoom
+    return np.clip(((longitudes + 180.0) / 360.0 * n).astype(np.int64), 0, n - 1)
+
+
+def tuiles_y(latitudes, zoom):
+    n = 1 << zoom
+    latitudes = np.radians(np.clip(latitudes, -LATITUDE_MAX, LATITUDE_MAX))
+    return np.clip(((1.0 - np.arcsinh(np.tan(latitudes)) / np.pi) / 2.0 * n).astype(np.int64), 0, n - 1)
+
+
+# Agrégats partiels d'un bloc de ventes (agregation.Agregats) : prix au m² par partition,
+# nature de mutation et case au zoom le plus fin
+CLES = ["departement_id", "annee", "nature_mutation_id", "x", "y"]
+
+OPERATIONS = [("nb_prix_m2", "prix_m2", "count"), ("somme_prix_m2", "prix_m2", "sum")]
+
+COLONNES_GRILLE = ["zoom", "x", "y", "annee", "code_departement", "nb_prix_m2", "somme_prix_m2"]
+
+
+def partiel(ventes):
+    ventes = ventes[ventes["longitude"].notna() & ventes["latitude"].notna()]
+    valeurs = ventes.assign(
+        x=tuiles_x(ventes["longitude"].to_numpy(), ZOOMS[-1]),
+        y=tuiles_y(ventes["latitude"].to_numpy(), ZOOMS[-1]),
+    )
+    return agregation.regrouper(valeurs, CLES, OPERATIONS)
+
+
+# Cases de la grille des ventes (natures de vente) à partir des agrégats partiels, à chaque
+# zoom. Les tuiles s'emboîtent : une case de zoom z regroupe les cases du zoom le plus fin
+# dont les coordonnées décalées de (zoom le plus fin - z) bits sont les siennes.
+def calculer_grille(conn, partiels):
+    agregation.ajouter_libelle(conn, partiels, "nature_mutation_id", "natures_mutation", "nature_mutation")
+    partiels = partiels[partiels["nature_mutation"].isin(schema.NATURES_VENTE)]
+    niveaux = []
+    for zoom in ZOOMS:
+        decalage = ZOOMS[-1] - zoom
+        cases = partiels.assign(x=np.right_shift(partiels["x"], decalage), y=np.right_shift(partiels["y"], decalage))
+        niveau = agregation.fusionner(cases, ["departement_id", "annee", "x", "y"], OPERATIONS)
+        niveau["zoom"] = zoom
+        niveaux.append(niveau)
+    grille = pd.concat(niveaux, ignore_index=True)
+    agregation.ajouter_libelle(conn, grille, "departement_id", "departements", "code_departement")
+    return grille[COLONNES_GRILLE]
+
+
+# Bornes (ouest, sud, est, nord) en degrés d'une tuile
+def bornes_tuile(x, y, zoom):
+    n = 1 << zoom
+
+    def latitude(ligne):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ligne / n))))
+
+    return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
+
+
+def existe(conn):
+    return schema.existe(conn, "mutations_rtree") and schema.existe(conn, "dvf_grille")
+
+
+# Supprime l'index spatial avant un chargement en masse (les triggers ralentiraient l'insertion)
+def supprimer(conn):
+    for nom in TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {nom}")
+    conn.execute("DROP TABLE IF EXISTS mutations_rtree")
+
+
+def creer_grille(conn):
+    conn.execute(CREATE_GRILLE)
+    for requete in INDEX_GRILLE.values():
+        conn.execute(requete)
+
+
+# Reconstruit l'index R*Tree à partir de mutations et la grille à partir des agrégats
+# partiels des ventes de toute la table
+def reconstruire(conn, partiels):
+    with conn:
+        supprimer(conn)
+        conn.execute(CREATE_RTREE)
+        conn.execute(
+            """INSERT INTO mutations_rtree
+               SELECT id, longitude, longitude, latitude, latitude FROM mutations
+               WHERE longitude IS NOT NULL AND latitude IS NOT NULL"""
+        )
+        for requete in TRIGGERS.values():
+            conn.execute(requete)
+        creer_grille(conn)
+        conn.execute("DELETE FROM dvf_grille")
+        agregation.inserer(conn, "dvf_grille", calculer_grille(conn, partiels))
+    print("Index spatial construit", file=sys.stderr)
+
+
+# Après un chargement incrémental : l'index R*Tree est tenu à jour par les triggers, seule la
+# grille des partitions modifiées est recalculée
+def mettre_a_jour(conn, partitions, partiels):
+    creer_grille(conn)
+    with conn:
+        conn.executemany(
+            "DELETE FROM dvf_grille WHERE code_departement = ? AND annee = ?",
+            [(code_departement, int(annee)) for annee, code_departement in partitions],
+        )
+        agregation.inserer(conn, "dvf_grille", calculer_grille(conn, partiels))
+    print(f"Grille spatiale mise à jour pour {len(partitions)} partitions", file=sys.stderr)
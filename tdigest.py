@@ -0,0 +1,113 @@
+import math
+from array import array
+
+# t-digest (variante « merging digest » de Dunning) : résumé d'une distribution en quelques
+# dizaines de centroïdes (moyenne, poids), plus fins près des extrémités, qui donne les
+# quantiles avec une erreur de rang bornée et se fusionne avec d'autres t-digests. Les
+# centroïdes sont gardés triés par moyenne.
+
+# L'échelle k couvre COMPRESSION / 2 unités et deux centroïdes consécutifs en couvrent plus
+# d'une : environ COMPRESSION / 2 centroïdes, jamais plus de COMPRESSION. Plus elle est
+# grande, plus l'erreur est faible.
+COMPRESSION = 100
+
+
+# Fonction d'échelle k1 : un centroïde couvre au plus une unité de k
+def echelle(q, compression):
+    return compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+
+def echelle_inverse(k, compression):
+    return (math.sin(min(k, compression / 4) * 2 * math.pi / compression) + 1) / 2
+
+
+class TDigest:
+    def __init__(self, moyennes=(), poids=(), minimum=None, maximum=None, compression=COMPRESSION):
+        self.moyennes = list(moyennes)
+        self.poids = list(poids)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.compression = compression
+
+    # Digest d'une liste de valeurs triées
+    @classmethod
+    def depuis_valeurs(cls, valeurs, compression=COMPRESSION):
+        digest = cls(compression=compression)
+        if valeurs:
+            digest.minimum = valeurs[0]
+            digest.maximum = valeurs[-1]
+            digest.compresser(valeurs, [1.0] * len(valeurs))
+        return digest
+
+    # Fusion de plusieurs digests en un seul
+    @classmethod
+    def fusionner(cls, digests, compression=COMPRESSION):
+        digest = cls(compression=compression)
+        centroides = sorted(
+            (moyenne, poids) for autre in digests for moyenne, poids in zip(autre.moyennes, autre.poids)
+        )
+        if centroides:
+            digest.minimum = min(autre.minimum for autre in digests if autre.poids)
+            digest.maximum = max(autre.maximum for autre in digests if autre.poids)
+            digest.compresser([moyenne for moyenne, _ in centroides], [poids for _, poids in centroides])
+        return digest
+
+    # Regroupe des centroïdes triés tant que le centroïde courant couvre moins d'une unité d'échelle
+    def compresser(self, moyennes, poids):
+        total = sum(poids)
+        self.moyennes = []
+        self.poids = []
+        cumul = 0.0
+        moyenne_courante = moyennes[0]
+        poids_courant = poids[0]
+        limite = total * echelle_inverse(echelle(0.0, self.compression) + 1, self.compression)
+        for moyenne, poids_centroide in zip(moyennes[1:], poids[1:]):
+            if cumul + poids_courant + poids_centroide <= limite:
+                poids_courant += poids_centroide
+                moyenne_courante += (moyenne - moyenne_courante) * poids_centroide / poids_courant
+            else:
+                self.moyennes.append(moyenne_courante)
+                self.poids.append(poids_courant)
+                cumul += poids_courant
+                limite = total * echelle_inverse(echelle(cumul / total, self.compression) + 1, self.compression)
+                moyenne_courante = moyenne
+                poids_courant = poids_centroide
+        self.moyennes.append(moyenne_courante)
+        self.poids.append(poids_courant)
+
+    def nombre(self):
+        return sum(self.poids)
+
+    # Quantile q (entre 0 et 1) par interpolation linéaire entre les centres des centroïdes,
+    # et avec le minimum et le maximum aux extrémités
+    def quantile(self, q):
+        if not self.poids:
+            return None
+        if len(self.poids) == 1:
+            return self.minimum + (self.maximum - self.minimum) * q
+        total = self.nombre()
+        cible = q * total
+        cumul = self.poids[0] / 2
+        if cible < cumul:
+            return self.minimum + (self.moyennes[0] - self.minimum) * cible / cumul
+        for i in range(len(self.poids) - 1):
+            ecart = (self.poids[i] + self.poids[i + 1]) / 2
+            if cible <= cumul + ecart:
+                return self.moyennes[i] + (self.moyennes[i + 1] - self.moyennes[i]) * (cible - cumul) / ecart
+            cumul += ecart
+        return self.moyennes[-1] + (self.maximum - self.moyennes[-1]) * (cible - cumul) / (total - cumul)
+
+    # Sérialisation : compression, minimum, maximum puis les couples (moyenne, poids) en doubles
+    def en_octets(self):
+        valeurs = array("d", [self.compression, self.minimum or 0.0, self.maximum or 0.0])
+        for moyenne, poids in zip(self.moyennes, self.poids):
+            valeurs.append(moyenne)
+            valeurs.append(poids)
+        return valeurs.tobytes()
+
+    @classmethod
+    def depuis_octets(cls, octets):
+        valeurs = array("d")
+        valeurs.frombytes(octets)
+        compression, minimum, maximum = valeurs[:3]
+        return cls(valeurs[3::2], valeurs[4::2], minimum, maximum, compression)
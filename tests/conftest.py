@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+RACINE = Path(__file__).resolve().parent.parent
+
+# Les modules de l'application sont à la racine du dépôt, le générateur de données dans benchmarks
+sys.path.insert(0, str(RACINE))
+sys.path.insert(0, str(RACINE / "benchmarks"))
+
+# L'API des tests lit la base sans cache de réponses
+os.environ.setdefault("DVF_CACHE", "aucun")
+
+import createdb  # noqa: E402
+import generer_dvf  # noqa: E402
+
+LIGNES_API = 20_000
+
+
+# Fichier DVF synthétique de deux années (voir benchmarks/generer_dvf.py)
+@pytest.fixture(scope="session")
+def fichier_dvf(tmp_path_factory):
+    chemin = tmp_path_factory.mktemp("donnees") / "dvf.csv"
+    generer_dvf.ecrire(chemin, LIGNES_API, [2022, 2023])
+    return chemin
+
+
+# Dossier avec la base chargée depuis le fichier synthétique, index et agrégats compris
+@pytest.fixture(scope="session")
+def dossier_api(tmp_path_factory, fichier_dvf):
+    dossier = tmp_path_factory.mktemp("api")
+    conn = sqlite3.connect(dossier / "dvf.db")
+    try:
+        createdb.charger(conn, [fichier_dvf])
+    finally:
+        conn.close()
+    return dossier
+
+
+# Client de l'API sur cette base, une fois le démarrage terminé
+@pytest.fixture(scope="session")
+def client(dossier_api):
+    from fastapi.testclient import TestClient
+
+    dossier = os.getcwd()
+    os.chdir(dossier_api)
+    try:
+        import main
+
+        with TestClient(main.app) as client:
+            for _ in range(600):
+                if main.etat_chargement["statut"] in ("ok", "erreur"):
+                    break
+                time.sleep(0.05)
+            assert main.etat_chargement["statut"] == "ok", main.etat_chargement
+            yield client
+    finally:
+        os.chdir(dossier)
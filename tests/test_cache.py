@@ -0,0 +1,105 @@
+import types
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import cache
+
+# Réponses d'environ 230 octets : un cache de 1000 octets en garde quatre
+TAILLE_MAX = 1000
+TTL = 10
+
+
+# Horloge du module cache, avancée par les tests
+@pytest.fixture
+def horloge(monkeypatch):
+    maintenant = [1_000_000.0]
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(time=lambda: maintenant[0]))
+    return maintenant
+
+
+@pytest.fixture(params=["memoire", "sqlite"])
+def stockage(request, tmp_path, horloge):
+    if request.param == "sqlite":
+        return cache.CacheSQLite(tmp_path / "cache.db", TAILLE_MAX, TTL)
+    return cache.CacheMemoire(TAILLE_MAX, TTL)
+
+
+# Application d'un seul endpoint mis en cache ; appels : paramètres des requêtes exécutées,
+# version : version des données servie au middleware
+@pytest.fixture
+def api(stockage):
+    app = FastAPI()
+    appels = []
+    version = {"valeur": "1"}
+
+    @app.get("/donnees/")
+    async def donnees(n: int = 0):
+        appels.append(n)
+        return {"n": n, "remplissage": "x" * 200}
+
+    async def lire_version():
+        return version["valeur"]
+
+    app.add_middleware(cache.CacheReponses, stockage=stockage, version=lire_version, chemins=["/donnees/"])
+    return TestClient(app), appels, version
+
+
+def test_hit_miss(api):
+    client, appels, _ = api
+    premiere = client.get("/donnees/?n=1")
+    assert premiere.headers["X-Cache"] == "MISS"
+    seconde = client.get("/donnees?n=1")
+    assert seconde.headers["X-Cache"] == "HIT"
+    assert seconde.json() == premiere.json() and seconde.headers["content-type"] == "application/json"
+    assert appels == [1]
+
+
+def test_etag_304(api):
+    client, appels, _ = api
+    etag = client.get("/donnees/?n=1").headers["ETag"]
+    reponse = client.get("/donnees/?n=1", headers={"If-None-Match": etag})
+    assert reponse.status_code == 304 and reponse.content == b"" and reponse.headers["ETag"] == etag
+    assert client.get("/donnees/?n=2", headers={"If-None-Match": etag}).status_code == 200
+    assert appels == [1, 2]
+
+
+# Nouvelle version des données : les entrées et les ETag de l'ancienne ne sont plus servis
+def test_invalidation_version(api, stockage):
+    client, appels, version = api
+    etag = client.get("/donnees/?n=1").headers["ETag"]
+    client.get("/donnees/?n=2")
+    version["valeur"] = "2"
+    reponse = client.get("/donnees/?n=1", headers={"If-None-Match": etag})
+    assert reponse.status_code == 200 and reponse.headers["X-Cache"] == "MISS" and reponse.headers["ETag"] != etag
+    assert appels == [1, 2, 1]
+    # Dans le fichier SQLite, l'écriture sous la nouvelle version retire celles de l'ancienne
+    # (en mémoire, elles sont retirées à la lecture ou par l'ordre LRU)
+    if isinstance(stockage, cache.CacheSQLite):
+        assert stockage.nb_entrees() == 1
+
+
+def test_expiration(api, horloge):
+    client, appels, _ = api
+    client.get("/donnees/?n=1")
+    horloge[0] += TTL - 1
+    assert client.get("/donnees/?n=1").headers["X-Cache"] == "HIT"
+    horloge[0] += 2
+    assert client.get("/donnees/?n=1").headers["X-Cache"] == "MISS"
+    assert appels == [1, 1]
+
+
+# Au-delà de la taille maximale, l'entrée lue le moins récemment est retirée
+def test_eviction_lru(api, stockage, horloge):
+    client, appels, _ = api
+    for n in range(4):
+        client.get(f"/donnees/?n={n}")
+        horloge[0] += 1
+    assert client.get("/donnees/?n=0").headers["X-Cache"] == "HIT"
+    horloge[0] += 1
+    client.get("/donnees/?n=4")
+    assert stockage.nb_entrees() == 4
+    assert client.get("/donnees/?n=0").headers["X-Cache"] == "HIT"
+    assert client.get("/donnees/?n=1").headers["X-Cache"] == "MISS"
+    assert appels == [0, 1, 2, 3, 4, 1]
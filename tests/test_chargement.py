@@ -0,0 +1,245 @@
+import csv
+import sqlite3
+
+import pytest
+
+import chargement
+import createdb
+import generer_dvf
+import rollups
+import schema
+
+# Tables recalculées à l'ingestion, comparées ligne à ligne ; les identifiants des dimensions
+# dépendent de l'ordre de chargement, les communes sont comparées par leurs libellés
+TABLES = {
+    "dvf_stats": "SELECT * FROM dvf_stats",
+    "dvf_robuste": "SELECT * FROM dvf_robuste",
+    "dvf_quantiles": "SELECT * FROM dvf_quantiles",
+    "dvf_mensuel": "SELECT * FROM dvf_mensuel",
+    "dvf_grille": "SELECT * FROM dvf_grille",
+    "communes_codes_postaux": """SELECT c.annee, c.code_departement, communes.code_commune, communes.nom_commune, c.code_postal, c.nb_ventes
+                                 FROM communes_codes_postaux c JOIN communes ON communes.id = c.commune_id""",
+}
+
+
+def arrondir(valeur):
+    return float(f"{valeur:.9g}") if isinstance(valeur, float) else valeur
+
+
+def lignes(conn, requete):
+    return sorted((tuple(arrondir(valeur) for valeur in ligne) for ligne in conn.execute(requete)), key=repr)
+
+
+# Contenu de la base : ventes telles que les expose la vue dvf, agrégats, index spatial
+def contenu(chemin):
+    conn = sqlite3.connect(chemin)
+    try:
+        resultat = {"dvf": lignes(conn, f"SELECT {', '.join(schema.NOMS_COLONNES)} FROM dvf")}
+        for table, requete in TABLES.items():
+            resultat[table] = lignes(conn, requete)
+        resultat["mutations_rtree"] = conn.execute(
+            """SELECT count(*) FROM mutations_rtree JOIN mutations ON mutations.id = mutations_rtree.id
+               WHERE mutations.longitude BETWEEN mutations_rtree.min_lon AND mutations_rtree.max_lon
+               AND mutations.latitude BETWEEN mutations_rtree.min_lat AND mutations_rtree.max_lat"""
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return resultat
+
+
+def charger(chemin, fichiers, complet=False):
+    conn = sqlite3.connect(chemin)
+    try:
+        return createdb.charger(conn, fichiers, taille_lot=1000, complet=complet)
+    finally:
+        conn.close()
+
+
+def lire_csv(chemin):
+    with open(chemin, newline="", encoding="utf-8") as fichier:
+        return list(csv.reader(fichier))
+
+
+def ecrire_csv(chemin, lignes):
+    with open(chemin, "w", newline="", encoding="utf-8") as fichier:
+        csv.writer(fichier, lineterminator="\n").writerows(lignes)
+
+
+@pytest.fixture
+def fichiers(tmp_path):
+    initial = tmp_path / "dvf.csv"
+    ajout = tmp_path / "dvf_2024.csv"
+    generer_dvf.ecrire(initial, 4000, [2022, 2023], communes_par_departement=20)
+    generer_dvf.ecrire(ajout, 1000, [2024], graine=1, communes_par_departement=20)
+    return initial, ajout
+
+
+# Modifie le fichier initial : ventes d'un département supprimées en 2022, une valeur foncière
+# changée en 2023 et une ligne en double (la première est gardée)
+def modifier(chemin):
+    entete, *lignes = lire_csv(chemin)
+    date, departement, valeur = (entete.index(nom) for nom in ("date_mutation", "code_departement", "valeur_fonciere"))
+    supprime = lignes[0][departement]
+    lignes = [ligne for ligne in lignes if not (ligne[date].startswith("2022") and ligne[departement] == supprime)]
+    modifiee = next(ligne for ligne in lignes if ligne[date].startswith("2023"))
+    modifiee[valeur] = "123456.00"
+    double = list(lignes[-1])
+    double[valeur] = "1.00"
+    ecrire_csv(chemin, [entete, *lignes, double])
+
+
+# Chargements successifs (fichier initial, ajout d'une année, fichier initial modifié) : même
+# base qu'un chargement complet des derniers fichiers
+def test_chargement_incremental_egal_au_complet(tmp_path, fichiers):
+    initial, ajout = fichiers
+    incremental = tmp_path / "incremental.db"
+    charger(incremental, [initial])
+    assert charger(incremental, [initial, ajout]) == {("2024", code) for _, code in charger(tmp_path / "ajout.db", [ajout])}
+    modifier(initial)
+    modifiees = charger(incremental, [initial, ajout])
+    assert modifiees and all(annee in ("2022", "2023") for annee, _ in modifiees)
+    assert not charger(incremental, [initial, ajout])
+
+    complet = tmp_path / "complet.db"
+    charger(complet, [ajout])
+    charger(complet, [initial, ajout], complet=True)
+    attendu = contenu(complet)
+    assert attendu == contenu(incremental)
+    charger(tmp_path / "vide.db", [initial, ajout])
+    assert attendu == contenu(tmp_path / "vide.db")
+
+
+# Chargement en masse d'un fichier avec des lignes en double : la clé de dédoublonnage, créée
+# après l'insertion, ne garde que la première de chaque clé, comme un chargement incrémental
+def test_chargement_en_masse_doublons(tmp_path, fichiers):
+    initial, ajout = fichiers
+    entete, *lignes = lire_csv(initial)
+    valeur = entete.index("valeur_fonciere")
+    doubles = [list(ligne) for ligne in lignes[:3]]
+    for ligne in doubles:
+        ligne[valeur] = "1.00"
+    avec_doubles = tmp_path / "avec_doubles.csv"
+    ecrire_csv(avec_doubles, [entete, *lignes, *doubles])
+
+    conn = sqlite3.connect(tmp_path / "masse.db")
+    try:
+        progression = createdb.Progression()
+        createdb.charger(conn, [avec_doubles, ajout], taille_lot=1000, progression=progression)
+        assert progression.doublons == len(doubles)
+    finally:
+        conn.close()
+
+    incremental = tmp_path / "incremental.db"
+    charger(incremental, [ajout])
+    charger(incremental, [avec_doubles, ajout])
+    attendu = contenu(incremental)
+    assert attendu == contenu(tmp_path / "masse.db")
+    charger(tmp_path / "sans_doubles.db", [initial, ajout])
+    assert attendu == contenu(tmp_path / "sans_doubles.db")
+
+
+# Base créée par la première version de createdb.py (table dvf en texte, INSERT OR IGNORE
+# ligne par ligne) : migrée vers mutations, puis complétée par le chargement des mêmes fichiers
+def test_migration_base_ancienne(tmp_path, fichiers):
+    initial, ajout = fichiers
+    ancienne = tmp_path / "ancienne.db"
+    chargement.charger_ligne_a_ligne(ancienne, initial)
+    charger(ancienne, [initial, ajout])
+    conn = sqlite3.connect(ancienne)
+    try:
+        assert not schema.existe(conn, "dvf", "table") and schema.existe(conn, "dvf", "view")
+    finally:
+        conn.close()
+
+    charger(tmp_path / "nouvelle.db", [initial, ajout])
+    assert contenu(ancienne) == contenu(tmp_path / "nouvelle.db")
+
+
+# Base dont la table mutations n'a que le rowid implicite (versions précédentes), renuméroté
+# par VACUUM après des suppressions : la table reçoit la clé id et l'index R*Tree, reconstruit,
+# désigne de nouveau les coordonnées de chaque vente
+def test_migration_cle_mutations(tmp_path, fichiers):
+    initial, ajout = fichiers
+    ancienne = tmp_path / "ancienne.db"
+    charger(ancienne, [initial])
+    conn = sqlite3.connect(ancienne)
+    try:
+        colonnes = ", ".join(schema.NOMS_MUTATIONS)
+        with conn:
+            conn.execute("DROP VIEW dvf")
+            conn.execute(f"CREATE TABLE mutations_rowid AS SELECT {colonnes} FROM mutations ORDER BY id")
+            conn.execute("DROP TABLE mutations")
+            conn.execute("ALTER TABLE mutations_rowid RENAME TO mutations")
+            conn.execute("DELETE FROM mutations WHERE rowid % 7 = 0")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    charger(ancienne, [initial, ajout])
+
+    resultat = contenu(ancienne)
+    conn = sqlite3.connect(ancienne)
+    try:
+        assert "id" in {ligne[1] for ligne in conn.execute("PRAGMA table_info(mutations)")}
+        localisees = conn.execute("SELECT count(*) FROM mutations WHERE longitude IS NOT NULL AND latitude IS NOT NULL").fetchone()[0]
+    finally:
+        conn.close()
+    assert resultat["mutations_rtree"] == localisees > 0
+
+
+# Lignes sans date AAAA-MM-JJ valide ou sans département : écartées et comptées, au premier
+# chargement comme au rechargement d'un fichier modifié
+def test_lignes_sans_partition_rejetees(tmp_path, fichiers):
+    initial, ajout = fichiers
+    entete, *lignes = lire_csv(initial)
+    date, departement = entete.index("date_mutation"), entete.index("code_departement")
+    invalides = []
+    for numero, (colonne, valeur) in enumerate([(date, ""), (date, "2022-13-45"), (date, "n/a"), (date, "20220105"), (departement, "")]):
+        ligne = list(lignes[numero])
+        ligne[entete.index("id_mutation")] = f"invalide-{numero}"
+        ligne[colonne] = valeur
+        invalides.append(ligne)
+    avec_invalides = tmp_path / "avec_invalides.csv"
+    ecrire_csv(avec_invalides, [entete, *lignes, *invalides])
+
+    conn = sqlite3.connect(tmp_path / "dvf.db")
+    try:
+        progression = createdb.Progression()
+        createdb.charger(conn, [avec_invalides], taille_lot=1000, progression=progression)
+        assert progression.rejetees == len(invalides)
+        modifier(avec_invalides)
+        ecrire_csv(avec_invalides, [*lire_csv(avec_invalides), *invalides])
+        assert createdb.charger(conn, [avec_invalides, ajout], taille_lot=1000)
+    finally:
+        conn.close()
+
+    modifier(initial)
+    charger(tmp_path / "attendu.db", [initial, ajout])
+    assert contenu(tmp_path / "dvf.db") == contenu(tmp_path / "attendu.db")
+
+
+# Échec du calcul des agrégats après l'insertion des lignes : les empreintes ne sont pas
+# enregistrées, la relance recharge le fichier et met les agrégats à jour
+def test_empreintes_apres_agregats(tmp_path, fichiers, monkeypatch):
+    initial, ajout = fichiers
+    db = tmp_path / "dvf.db"
+    charger(db, [initial])
+
+    def echec(conn, partitions, partiels):
+        raise RuntimeError("échec des agrégats")
+
+    modifier(initial)
+    with monkeypatch.context() as patch:
+        patch.setattr(rollups, "mettre_a_jour", echec)
+        with pytest.raises(RuntimeError):
+            charger(db, [initial, ajout])
+    assert charger(db, [initial, ajout])
+
+    charger(tmp_path / "attendu.db", [initial, ajout])
+    assert contenu(db) == contenu(tmp_path / "attendu.db")
+
+
+def test_colonnes_obligatoires(tmp_path):
+    chemin = tmp_path / "sans_date.csv"
+    ecrire_csv(chemin, [["id_mutation", "code_departement", "valeur_fonciere"], ["2022-1", "33", "100000"]])
+    with pytest.raises(ValueError, match="date_mutation"):
+        charger(tmp_path / "dvf.db", [chemin])
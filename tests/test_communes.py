@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+import communes
+
+
+def test_resolution_des_homonymes():
+    resolveur = communes.Resolveur(
+        [
+            communes.Commune("Saint-Denis", "93066", "93", ["93200", "93210"], 4000),
+            communes.Commune("Saint-Denis", "97411", "974", ["97400", "97490"], 2900),
+            communes.Commune("Saint-Étienne", "42218", "42", ["42000"], 1000),
+        ],
+        ["93", "974", "42"],
+    )
+    assert resolveur.resoudre("saint denis") == communes.Lieu("Saint-Denis", "93")
+    assert resolveur.resoudre("97411") == communes.Lieu("Saint-Denis", "974")
+    assert resolveur.resoudre("97490") == communes.Lieu("Saint-Denis", "974")
+    assert resolveur.resoudre("93066") == communes.Lieu("Saint-Denis", "93")
+    assert resolveur.resoudre("St-Etienne") == communes.Lieu("Saint-Étienne", "42")
+    assert resolveur.resoudre("974") == communes.Lieu(None, "974")
+    assert resolveur.resoudre("974").departement
+    assert resolveur.resoudre("974").nom == "974"
+    assert resolveur.resoudre("Nulle part") is None
+
+
+def nombre_ventes(dossier, code_commune):
+    conn = sqlite3.connect(dossier / "dvf.db")
+    try:
+        return conn.execute(
+            """SELECT count(*) FROM dvf WHERE code_commune = ? AND nature_mutation IN ('Vente', "Vente en l'état futur d'achèvement")""",
+            (code_commune,),
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Les deux Saint-Denis (Seine-Saint-Denis et La Réunion) ne sont jamais regroupés
+def test_statistiques_par_code_insee(client, dossier_api):
+    reunion = client.get("/prix-m2-robuste/", params={"nom_ville": "97411"}).json()["97411"]
+    seine = client.get("/prix-m2-robuste/", params={"nom_ville": "93066"}).json()["93066"]
+    assert reunion["code_departement"] == "974"
+    assert seine["code_departement"] == "93"
+    assert reunion["tous"]["nb_prix_m2"] != seine["tous"]["nb_prix_m2"]
+
+    for code in ("97411", "93066"):
+        profil = client.get("/profil-commune/", params={"nom_commune": code}).json()[code]
+        assert profil["nb_ventes"] == nombre_ventes(dossier_api, code)
+        serie = client.get("/serie-temporelle/", params={"lieux": code, "pas": "annee"}).json()["serie"]
+        assert sum(point["nb_ventes"] for point in serie) == profil["nb_ventes"]
+        robuste = client.get("/prix-m2-robuste/", params={"nom_ville": code}).json()[code]
+        quantiles = client.get("/quantiles-prix-m2/", params={"lieux": code}).json()
+        assert quantiles["nb_prix_m2"] == robuste["tous"]["nb_prix_m2"]
+        maisons = client.get("/maisons-par-commune/", params={"nom_commune": code, "colonnes": "code_commune"}).json()
+        assert maisons and {maison["code_commune"] for maison in maisons} == {code}
+
+    villes = client.get("/prix-moyen-m2-par-villes/", params={"villes": "97411,93066"}).json()
+    assert villes["97411"] != villes["93066"]
+    assert villes["97411"] == client.get("/prix-moyen-m2-par-ville/", params={"nom_ville": "97411"}).json()["97411"]
+
+
+# Moteur en colonnes : mêmes agrégats par commune que dvf_stats, sans regrouper les homonymes
+def test_colonnes_homonymes(dossier_api, tmp_path):
+    pytest.importorskip("pyarrow.parquet", exc_type=ImportError)
+    pytest.importorskip("duckdb")
+    import colonnes
+
+    conn = sqlite3.connect(dossier_api / "dvf.db")
+    try:
+        colonnes.exporter(conn, tmp_path / "parquet")
+        attendu = {
+            code: nb
+            for code, nb in conn.execute(
+                """SELECT code_departement, sum(nb_lignes) FROM dvf_stats
+                   WHERE nom_commune = 'Saint-Denis' AND nature_mutation IN ('Vente', "Vente en l'état futur d'achèvement")
+                   GROUP BY code_departement"""
+            )
+        }
+    finally:
+        conn.close()
+    entrepot = colonnes.EntrepotColonnes(tmp_path / "parquet")
+    entrepot.charger()
+    lieux = [communes.Lieu("Saint-Denis", "93"), communes.Lieu("Saint-Denis", "974")]
+    stats = entrepot.stats_groupees(lieux, False)
+    assert {lieu.code_departement: ligne["nb_lignes"] for lieu, ligne in stats.items()} == attendu
+    assert sum(ligne["nb_lignes"] for ligne in entrepot.profil(lieux[1])) == attendu["974"]
@@ -0,0 +1,73 @@
+import asyncio
+import sqlite3
+
+import connexions
+
+
+def creer_base(chemin):
+    conn = sqlite3.connect(chemin)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(100)])
+    conn.commit()
+    conn.close()
+
+
+# 90 requêtes simultanées sur un pool de 2 connexions : aucune ne doit en ouvrir une troisième
+def test_requetes_simultanees_dans_la_taille_du_pool(tmp_path):
+    chemin = tmp_path / "base.db"
+    creer_base(chemin)
+    pool = connexions.PoolLecture(str(chemin), taille=2)
+
+    async def executer():
+        await pool.connect()
+        try:
+            resultats = await asyncio.gather(*(pool.fetch_val(f"SELECT count(*) + {i} FROM t") for i in range(90)))
+            ouvertes = len(pool.connexions)
+        finally:
+            await pool.disconnect()
+        return resultats, ouvertes
+
+    resultats, ouvertes = asyncio.run(executer())
+    assert resultats == [100 + i for i in range(90)]
+    assert ouvertes == 2
+
+
+# Un parcours par iterate garde sa connexion ; les autres requêtes attendent une connexion libre
+def test_iterate_et_lectures_simultanees(tmp_path):
+    chemin = tmp_path / "base.db"
+    creer_base(chemin)
+    pool = connexions.PoolLecture(str(chemin), taille=1)
+
+    async def parcourir():
+        return [ligne[0] async for ligne in pool.iterate("SELECT x FROM t ORDER BY x")]
+
+    async def executer():
+        await pool.connect()
+        try:
+            return await asyncio.gather(parcourir(), pool.fetch_val("SELECT max(x) FROM t"), parcourir()), len(pool.connexions)
+        finally:
+            await pool.disconnect()
+
+    (premier, maximum, second), ouvertes = asyncio.run(executer())
+    assert premier == second == list(range(100))
+    assert maximum == 99
+    assert ouvertes == 1
+
+
+# Une ouverture qui échoue libère sa place dans le pool
+def test_echec_ouverture(tmp_path):
+    pool = connexions.PoolLecture(str(tmp_path / "absente.db"), taille=1)
+
+    async def executer():
+        await pool.connect()
+        try:
+            for _ in range(2):
+                try:
+                    await pool.fetch_val("SELECT 1")
+                except sqlite3.OperationalError:
+                    pass
+            return pool.ouvertes
+        finally:
+            await pool.disconnect()
+
+    assert asyncio.run(executer()) == 0
@@ -0,0 +1,129 @@
+import base64
+import csv
+import io
+import json
+import sqlite3
+
+import pytest
+
+import schema
+
+VENTES = ("Vente", "Vente en l'état futur d'achèvement")
+
+
+# Commune qui a le plus de ventes de maisons dans la base des tests
+@pytest.fixture(scope="module")
+def commune(dossier_api):
+    conn = sqlite3.connect(dossier_api / "dvf.db")
+    try:
+        return conn.execute(
+            f"""SELECT code_commune FROM dvf WHERE type_local = 'Maison' AND nature_mutation IN ({', '.join('?' * len(VENTES))})
+                GROUP BY code_commune ORDER BY count(*) DESC LIMIT 1""",
+            VENTES,
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Ventes de la commune dont la clé DVF est vide (id_mutation et numero_disposition NULL) ou
+# sans date, ajoutées le temps d'un test
+@pytest.fixture
+def ventes_sans_cle(dossier_api, commune):
+    conn = sqlite3.connect(dossier_api / "dvf.db")
+    colonnes = ", ".join(schema.NOMS_MUTATIONS)
+    try:
+        (modele,) = conn.execute(
+            """SELECT mutations.id FROM mutations JOIN communes ON communes.id = mutations.commune_id
+               JOIN types_local ON types_local.id = mutations.type_local_id
+               JOIN natures_mutation ON natures_mutation.id = mutations.nature_mutation_id
+               WHERE communes.code_commune = ? AND types_local.type_local = 'Maison' AND natures_mutation.nature_mutation = 'Vente'
+               LIMIT 1""",
+            (commune,),
+        ).fetchone()
+        ajoutees = []
+        with conn:
+            for remplacements in ({"id_mutation": "NULL", "numero_disposition": "NULL"}, {"date_mutation": "NULL"}, {"date_mutation": "NULL"}):
+                selection = ", ".join(remplacements.get(nom, nom) for nom in schema.NOMS_MUTATIONS)
+                ajoutees.append(conn.execute(f"INSERT INTO mutations ({colonnes}) SELECT {selection} FROM mutations WHERE id = ?", (modele,)).lastrowid)
+        yield ajoutees
+        with conn:
+            conn.executemany("DELETE FROM mutations WHERE id = ?", [(identifiant,) for identifiant in ajoutees])
+    finally:
+        conn.close()
+
+
+def pages(client, parametres, limite):
+    lignes = []
+    curseur = None
+    while True:
+        reponse = client.get("/maisons-par-commune/", params={**parametres, "limite": limite, **({"curseur": curseur} if curseur else {})})
+        assert reponse.status_code == 200
+        page = reponse.json()
+        assert len(page) <= limite
+        lignes.extend(page)
+        curseur = reponse.headers.get("X-Curseur-Suivant")
+        if curseur is None:
+            return lignes
+        assert len(page) == limite
+
+
+# Les pages suivies de curseur en curseur redonnent exactement la liste complète, ventes sans
+# clé DVF ou sans date comprises : ni doublon ni trou
+def test_pagination_complete(client, commune, ventes_sans_cle):
+    parametres = {"nom_commune": commune}
+    complete = client.get("/maisons-par-commune/", params=parametres).json()
+    assert sum(vente["id_mutation"] is None for vente in complete) == 1
+    assert sum(vente["date_mutation"] is None for vente in complete) == len(ventes_sans_cle) - 1
+    for limite in (1, 7, len(complete) - 1, len(complete)):
+        assert pages(client, parametres, limite) == complete
+
+
+@pytest.mark.parametrize(
+    "curseur",
+    [
+        "pas du base64 !",
+        base64.urlsafe_b64encode(b"pas du json").decode(),
+        base64.urlsafe_b64encode(json.dumps({"date": 20230101}).encode()).decode(),
+        base64.urlsafe_b64encode(json.dumps([20230101]).encode()).decode(),
+        base64.urlsafe_b64encode(json.dumps(["2023-01-01", 1]).encode()).decode(),
+        base64.urlsafe_b64encode(json.dumps([20230101, "1 OR 1=1"]).encode()).decode(),
+        base64.urlsafe_b64encode(json.dumps([20230101, True]).encode()).decode(),
+    ],
+)
+def test_curseur_altere(client, commune, curseur):
+    reponse = client.get("/maisons-par-commune/", params={"nom_commune": commune, "curseur": curseur})
+    assert reponse.status_code == 400
+
+
+def lire_arrow(contenu):
+    pa = pytest.importorskip("pyarrow")
+    return pa.ipc.open_stream(contenu).read_all().to_pylist()
+
+
+def lire_csv(contenu):
+    lignes = list(csv.DictReader(io.StringIO(contenu.decode("utf-8"))))
+    return [{nom: valeur or None for nom, valeur in ligne.items()} for ligne in lignes]
+
+
+LECTEURS = {
+    "json": json.loads,
+    "ndjson": lambda contenu: [json.loads(ligne) for ligne in contenu.decode("utf-8").splitlines()],
+    "csv": lire_csv,
+    "arrow": lire_arrow,
+}
+
+
+# Chaque format a son type de contenu et un corps lisible, avec les mêmes ventes qu'en JSON
+@pytest.mark.parametrize("format_sortie", ["json", "ndjson", "csv", "arrow"])
+def test_formats(client, commune, format_sortie):
+    import formats
+
+    parametres = {"nom_commune": commune, "colonnes": "id_mutation,date_mutation,valeur_fonciere,nombre_pieces_principales"}
+    attendu = client.get("/maisons-par-commune/", params=parametres).json()
+    reponse = client.get("/maisons-par-commune/", params={**parametres, "format": format_sortie})
+    assert reponse.status_code == 200
+    assert reponse.headers["content-type"] == formats.TYPES_CONTENU[format_sortie]
+    lignes = LECTEURS[format_sortie](reponse.content)
+    if format_sortie == "csv":
+        attendu = [{nom: None if valeur is None else str(valeur) for nom, valeur in vente.items()} for vente in attendu]
+    assert lignes == attendu
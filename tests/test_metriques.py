@@ -0,0 +1,64 @@
+import sqlite3
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import connexions
+import metriques
+
+
+def creer_application(chemin):
+    conn = sqlite3.connect(chemin)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10_000)])
+    conn.commit()
+    conn.close()
+    mesures = metriques.Metriques()
+    base = metriques.BaseMesuree(connexions.PoolLecture(str(chemin), taille=2))
+    app = FastAPI()
+    app.add_middleware(metriques.MesureRequetes, metriques=mesures, routes=app.routes, exclus=["/metrics"])
+
+    @app.on_event("startup")
+    async def startup():
+        await base.connect()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await base.disconnect()
+
+    @app.get("/elements/{numero}")
+    async def element(numero: int):
+        return {"x": await base.fetch_val(f"SELECT x FROM t WHERE rowid = {numero}")}
+
+    @app.get("/somme/")
+    async def somme():
+        return {"somme": await base.fetch_val("SELECT sum(x) FROM t")}
+
+    return app, mesures
+
+
+def test_regroupement_par_route(tmp_path):
+    app, mesures = creer_application(tmp_path / "base.db")
+    with TestClient(app) as client:
+        for numero in range(1, 51):
+            assert client.get(f"/elements/{numero}").status_code == 200
+        for numero in range(50):
+            assert client.get(f"/inconnu/{numero}").status_code == 404
+    endpoints = mesures.resume()["endpoints"]
+    assert sorted(endpoints) == [metriques.NON_RECONNU, "/elements/{numero}"]
+    assert endpoints["/elements/{numero}"]["nb_requetes"] == 50
+    assert endpoints[metriques.NON_RECONNU]["nb_requetes"] == 50
+    assert mesures.resume()["dernieres_requetes"][0]["chemin"] == "/elements/1"
+
+
+# Une somme sur toute la table renvoie une ligne, mais ses instructions dépassent le nombre de
+# lignes parcourues ; une lecture par rowid en exécute peu
+def test_instructions_sqlite(tmp_path):
+    app, mesures = creer_application(tmp_path / "base.db")
+    with TestClient(app) as client:
+        assert client.get("/somme/").json() == {"somme": sum(range(10_000))}
+        client.get("/elements/1")
+    endpoints = mesures.resume()["endpoints"]
+    assert endpoints["/somme/"]["lignes_renvoyees"] == 1
+    assert endpoints["/somme/"]["instructions_sqlite"] >= 10_000
+    assert endpoints["/elements/{numero}"]["instructions_sqlite"] < 1_000
@@ -0,0 +1,33 @@
+import sqlite3
+
+from sqlalchemy import Float, Integer, LargeBinary
+from sqlmodel import AutoString, SQLModel
+
+# Type SQLAlchemy attendu pour chaque type déclaré dans le schéma SQLite (les colonnes
+# calculées de la vue dvf n'en ont pas)
+TYPES = {"INTEGER": Integer, "INT": Integer, "REAL": Float, "TEXT": AutoString, "BLOB": LargeBinary}
+
+# Modèles qui ne déclarent que les colonnes lues par l'API
+MODELES_PARTIELS = {"mutations"}
+
+
+# Les modèles SQLModel de main.py, écrits à la main, suivent les tables et vues créées par
+# createdb.py et au démarrage de l'API : mêmes colonnes, types compatibles
+def test_modeles_egaux_au_schema(client, dossier_api):
+    import main  # noqa: F401  (importé par client, déclare les modèles)
+
+    conn = sqlite3.connect(dossier_api / "dvf.db")
+    try:
+        for nom, table in SQLModel.metadata.tables.items():
+            colonnes = {ligne[1]: ligne[2] for ligne in conn.execute(f"PRAGMA table_info({nom})")}
+            assert colonnes, f"{nom} absente de la base"
+            modele = {colonne.name: colonne.type for colonne in table.columns}
+            if nom in MODELES_PARTIELS:
+                assert set(modele) <= set(colonnes), f"{nom} : {sorted(set(modele) - set(colonnes))}"
+            else:
+                assert set(modele) == set(colonnes), f"{nom} : {sorted(set(modele) ^ set(colonnes))}"
+            for colonne, type_modele in modele.items():
+                if colonnes[colonne]:
+                    assert isinstance(type_modele, TYPES[colonnes[colonne]]), f"{nom}.{colonne} : {colonnes[colonne]}, {type_modele!r}"
+    finally:
+        conn.close()
@@ -0,0 +1,20 @@
+# Les moyennes et les médianes du profil portent sur la même commune, y compris pour un nom
+# partagé par plusieurs communes (Saint-Denis : la plus vendue, en Seine-Saint-Denis)
+def test_profil_d_une_seule_commune(client):
+    par_nom = client.get("/profil-commune/", params={"nom_commune": "Saint-Denis"}).json()["Saint-Denis"]
+    par_code = client.get("/profil-commune/", params={"nom_commune": "93066"}).json()["93066"]
+    assert par_nom == par_code
+
+    robuste = client.get("/prix-m2-robuste/", params={"nom_ville": "Saint-Denis"}).json()["Saint-Denis"]
+    assert robuste["code_departement"] == "93"
+    assert par_nom["prix_median_m2"] == robuste["tous"]["mediane"]
+    assert par_nom["prix_median_m2_maisons"] == robuste["Maison"]["mediane"]
+    moyenne = client.get("/prix-moyen-m2-par-ville/", params={"nom_ville": "Saint-Denis"}).json()["Saint-Denis"]
+    assert par_nom["prix_moyen_m2"] == moyenne
+
+
+def test_profil_d_un_departement(client):
+    profil = client.get("/profil-commune/", params={"nom_commune": "974"}).json()["974"]
+    robuste = client.get("/prix-m2-robuste/", params={"nom_ville": "974"}).json()["974"]
+    assert profil["prix_median_m2"] == robuste["tous"]["mediane"]
+    assert client.get("/profil-commune/", params={"nom_commune": "Nulle part"}).status_code == 404
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+import quantiles
+import tdigest
+
+
+def valeurs_prix(nombre, graine):
+    aleatoire = random.Random(graine)
+    return sorted(aleatoire.lognormvariate(8, 0.5) for _ in range(nombre))
+
+
+# Écart entre q et la part des valeurs inférieures ou égales au quantile q du digest
+def erreur_rang(valeurs, digest, q):
+    estimation = digest.quantile(q)
+    return abs(sum(valeur <= estimation for valeur in valeurs) / len(valeurs) - q)
+
+
+@pytest.mark.parametrize("q", [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99])
+def test_erreur_de_rang(q):
+    valeurs = valeurs_prix(20_000, 1)
+    digest = tdigest.TDigest.depuis_valeurs(valeurs)
+    assert len(digest.poids) <= tdigest.COMPRESSION
+    assert erreur_rang(valeurs, digest, q) < 0.01
+
+
+# Fusion de digests de tailles et de distributions différentes (communes d'un département)
+def test_fusion():
+    parties = [valeurs_prix(nombre, graine) for graine, nombre in enumerate([5, 300, 2_000, 12_000, 1])]
+    digests = [tdigest.TDigest.depuis_valeurs(partie) for partie in parties]
+    fusion = tdigest.TDigest.fusionner(digests)
+    assert len(fusion.poids) <= tdigest.COMPRESSION
+    valeurs = sorted(valeur for partie in parties for valeur in partie)
+    assert fusion.nombre() == len(valeurs)
+    assert fusion.minimum == valeurs[0] and fusion.maximum == valeurs[-1]
+    assert fusion.quantile(0) == valeurs[0] and fusion.quantile(1) == valeurs[-1]
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        assert erreur_rang(valeurs, fusion, q) < 0.01
+    # Fusionner en plusieurs étapes (années puis lieux) garde la borne
+    etapes = tdigest.TDigest.fusionner([tdigest.TDigest.fusionner(digests[:2]), tdigest.TDigest.fusionner(digests[2:])])
+    assert etapes.nombre() == len(valeurs)
+    assert len(etapes.poids) <= tdigest.COMPRESSION
+    for q in (0.1, 0.5, 0.9):
+        assert erreur_rang(valeurs, etapes, q) < 0.01
+
+
+def test_serialisation():
+    digest = tdigest.TDigest.depuis_valeurs(valeurs_prix(1_000, 2))
+    relu = quantiles.fusionner([digest.en_octets()])
+    assert relu.nombre() == digest.nombre()
+    assert relu.quantile(0.5) == pytest.approx(digest.quantile(0.5))
+    assert quantiles.fusionner([]).nombre() == 0
+
+
+def nb_prix(client, lieux):
+    reponse = client.get("/quantiles-prix-m2/", params={"lieux": lieux})
+    assert reponse.status_code == 200
+    return reponse.json()["nb_prix_m2"]
+
+
+# Une commune demandée avec son département n'est comptée qu'une fois
+def test_lieux_qui_se_recouvrent(client):
+    assert nb_prix(client, "Paris,75") == nb_prix(client, "75")
+    assert nb_prix(client, "75,Paris,paris,75056") == nb_prix(client, "75")
+    assert nb_prix(client, "Bordeaux,33") == nb_prix(client, "33")
+    assert nb_prix(client, "Bordeaux,33,Toulouse") == nb_prix(client, "33") + nb_prix(client, "Toulouse")
+    assert nb_prix(client, "Bordeaux,Toulouse") == nb_prix(client, "Bordeaux") + nb_prix(client, "Toulouse")
@@ -0,0 +1,83 @@
+import csv
+import random
+import sqlite3
+import statistics
+
+import pytest
+
+import createdb
+import robustes
+import schema
+
+
+# Statistiques de robustes.statistiques calculées en Python pur
+def reference(prix):
+    prix = sorted(prix)
+    nombre = len(prix)
+    centre = statistics.median(prix)
+    mad = statistics.median(abs(valeur - centre) for valeur in prix)
+    coupe = int(nombre * robustes.PROPORTION_TRONQUEE)
+    gardes = [valeur for valeur in prix if abs(valeur - centre) <= robustes.SEUIL_Z * robustes.FACTEUR_MAD * mad] if mad > 0 else prix
+    return (
+        nombre,
+        statistics.fmean(prix),
+        centre,
+        mad,
+        statistics.fmean(prix[coupe:nombre - coupe]),
+        statistics.fmean(gardes),
+        nombre - len(gardes),
+    )
+
+
+# Deux communes homonymes du même département (codes INSEE différents) : chacune a ses
+# statistiques, le département celles de toutes leurs ventes
+def test_homonymes_d_un_departement(tmp_path):
+    aleatoire = random.Random(0)
+    prix = {}
+    lignes = []
+    for code_commune, base, nombre in (("01001", 1000.0, 31), ("01002", 5000.0, 40)):
+        for numero in range(nombre):
+            for type_local, facteur in (("Maison", 1.0), ("Appartement", 1.5)):
+                valeur = round(base * facteur * 100 * aleatoire.uniform(0.5, 1.5) * (20 if numero == 0 else 1), 2)
+                ligne = dict.fromkeys(schema.NOMS_COLONNES, "")
+                ligne.update(
+                    id_mutation=f"{code_commune}-{numero}-{type_local}",
+                    date_mutation="2023-01-15",
+                    numero_disposition="000001",
+                    nature_mutation="Vente",
+                    valeur_fonciere=f"{valeur:.2f}",
+                    code_commune=code_commune,
+                    nom_commune="Saint-Martin",
+                    code_departement="01",
+                    code_type_local="1" if type_local == "Maison" else "2",
+                    type_local=type_local,
+                    surface_reelle_bati="100",
+                )
+                lignes.append([ligne[nom] for nom in schema.NOMS_COLONNES])
+                prix.setdefault((code_commune, type_local), []).append(valeur / 100)
+    chemin = tmp_path / "homonymes.csv"
+    with open(chemin, "w", newline="", encoding="utf-8") as fichier:
+        csv.writer(fichier, lineterminator="\n").writerows([schema.NOMS_COLONNES, *lignes])
+
+    conn = sqlite3.connect(tmp_path / "dvf.db")
+    try:
+        createdb.charger(conn, [chemin])
+        resultats = {
+            (code_commune, type_local): statistiques
+            for code_commune, type_local, *statistiques in conn.execute(
+                """SELECT code_commune, type_local, nb_prix_m2, moyenne, mediane, mad, moyenne_tronquee, moyenne_filtree, nb_exclus
+                   FROM dvf_robuste WHERE code_departement = '01'"""
+            )
+        }
+    finally:
+        conn.close()
+
+    attendus = dict(prix)
+    for code_commune in ("01001", "01002"):
+        attendus[code_commune, None] = prix[code_commune, "Maison"] + prix[code_commune, "Appartement"]
+    for type_local in ("Maison", "Appartement"):
+        attendus[None, type_local] = prix["01001", type_local] + prix["01002", type_local]
+    attendus[None, None] = [valeur for valeurs in prix.values() for valeur in valeurs]
+    assert set(resultats) == set(attendus)
+    for cle, valeurs in attendus.items():
+        assert resultats[cle] == pytest.approx(list(reference(valeurs)), rel=1e-9), cle
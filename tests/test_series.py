@@ -0,0 +1,32 @@
+import series
+
+
+def nb_ventes(client, lieux, **parametres):
+    reponse = client.get("/serie-temporelle/", params={"lieux": lieux, "pas": "annee", **parametres})
+    assert reponse.status_code == 200
+    return sum(point["nb_ventes"] for point in reponse.json()["serie"])
+
+
+# Une commune demandée avec son département n'est comptée qu'une fois
+def test_lieux_qui_se_recouvrent(client):
+    assert nb_ventes(client, "33,Bordeaux") == nb_ventes(client, "33")
+    assert nb_ventes(client, "Paris,75,75056") == nb_ventes(client, "75")
+    assert nb_ventes(client, "33,Bordeaux,Toulouse") == nb_ventes(client, "33") + nb_ventes(client, "Toulouse")
+    assert nb_ventes(client, "Bordeaux,Toulouse", type_local="Maison") == (
+        nb_ventes(client, "Bordeaux", type_local="Maison") + nb_ventes(client, "Toulouse", type_local="Maison")
+    )
+
+
+# Un même mois venant de plusieurs lieux est additionné, les périodes sans vente sont comprises
+def test_calcul_des_periodes():
+    lignes = [
+        [202301, 2, 2, 6000.0, 600_000.0, 100.0],
+        [202301, 1, 1, 4000.0, 200_000.0, 50.0],
+        [202305, 1, 0, 0.0, 0.0, 0.0],
+    ]
+    serie = series.calculer(lignes, "trimestre", lissage=2)
+    assert [point["periode"] for point in serie] == ["2023-T1", "2023-T2"]
+    assert serie[0]["nb_ventes"] == 3 and serie[0]["prix_moyen_m2"] == 10_000 / 3
+    assert serie[0]["prix_m2"] == 800_000 / 150
+    assert serie[1]["prix_moyen_m2"] is None
+    assert serie[1]["prix_moyen_m2_lisse"] == 10_000 / 3
@@ -0,0 +1,17 @@
+import random
+
+import numpy as np
+
+import spatial
+
+
+# Tuiles calculées sur des tableaux numpy pour la grille : mêmes cases que tuile_x et tuile_y, utilisées par l'API
+def test_tuiles_numpy_egales_python():
+    aleatoire = random.Random(0)
+    points = [(aleatoire.uniform(-200, 200), aleatoire.uniform(-90, 90)) for _ in range(10000)]
+    points += [(-180, -spatial.LATITUDE_MAX), (180, spatial.LATITUDE_MAX), (0, 0), (-0.0, 90), (179.9999999, -90)]
+    longitudes, latitudes = (np.array(valeurs) for valeurs in zip(*points))
+    for zoom in spatial.ZOOMS:
+        cases = zip(spatial.tuiles_x(longitudes, zoom).tolist(), spatial.tuiles_y(latitudes, zoom).tolist())
+        for (longitude, latitude), (x, y) in zip(points, cases):
+            assert (x, y) == (spatial.tuile_x(longitude, zoom), spatial.tuile_y(latitude, zoom))